@@ -0,0 +1,267 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+""" Benchmarks the Raw_Products index set on a synthetic table.
+
+A copy of the Raw_Products table is built in a scratch schema and filled
+with synthetic rows by the database itself (generate_series), so millions
+of rows load in seconds. The common catalog queries are then run with
+EXPLAIN ANALYZE, first without any secondary indexes and then with the
+indexes declared on Raw_Product, and the plans and median latencies are
+printed for both.
+
+This requires PostgreSQL.
+"""
+
+# Copyright 2022, United States Government as represented by the
+# Administrator of the National Aeronautics and Space Administration.
+# All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+# Reuse is permitted under the terms of the license.
+# The AUTHORS file and the LICENSE file are at the
+# top level of this library.
+
+import argparse
+import datetime
+import logging
+from pathlib import Path
+import statistics
+import time
+from sqlalchemy import Boolean, DateTime, Float, Integer, MetaData, String
+
+import sys
+import os
+sys.path.insert(1, os.path.join(sys.path[0],'../../../../vipersci/src'))
+from vipersci import util
+from vipersci.pds.pid import vis_instruments, vis_compression
+
+import table_raw_products as tb
+from db_utility import new_db
+
+logger = logging.getLogger(__name__)
+
+bench_schema = "visdb_bench"
+epoch = datetime.datetime(2024, 1, 1)
+
+
+def arg_parser():
+    parser = argparse.ArgumentParser(
+            description=__doc__,
+            formatter_class=argparse.RawDescriptionHelpFormatter,
+            parents=[util.parent_parser()]
+    )
+    parser.add_argument(
+            "-c", "--config",
+            type=Path,
+            required=True,
+            help="Path to database configuration file."
+    )
+    parser.add_argument(
+            "-n", "--rows",
+            type=int,
+            default=2000000,
+            help="Number of synthetic rows to generate."
+    )
+    parser.add_argument(
+            "-r", "--repeat",
+            type=int,
+            default=5,
+            help="Number of times each query is run."
+    )
+    parser.add_argument(
+            "--keep",
+            action='store_true',
+            help=f"Do not drop the {bench_schema} schema afterwards."
+    )
+    return parser
+
+
+def bench_table():
+    """Returns a copy of the Raw_Products table in the scratch schema."""
+    return tb.Raw_Product.__table__.to_metadata(
+        MetaData(), schema=bench_schema
+    )
+
+
+def _synthetic_value(col, instruments):
+    """SQL for a column's value in terms of the series value i.
+
+    Rows cycle through the instruments, so each instrument gets a frame
+    every second and product_ids stay unique.
+    """
+    n_inst = len(instruments)
+    start = (
+        f"(TIMESTAMP '{epoch.isoformat()}' "
+        f"+ (i / {n_inst}) * INTERVAL '1 second')"
+    )
+    inst = (
+        "(ARRAY[" + ", ".join(f"'{c}'" for c in instruments) + "])"
+        f"[1 + mod(i, {n_inst})]"
+    )
+    special = {
+        "product_id": (
+            f"to_char({start}, 'YYMMDD-HH24MISS') || '-' || {inst} || '-a'"
+        ),
+        "instrument_name": "(ARRAY[" + ", ".join(
+            f"'{vis_instruments[c]}'" for c in instruments
+        ) + f"])[1 + mod(i, {n_inst})]",
+        "start_time": start,
+        "stop_time": start,
+        "compression_ratio": str(vis_compression["a"]),
+        "mission_phase": (
+            f"CASE WHEN mod(i, 10) = 0 THEN '{tb.active_mission_phase}' "
+            "ELSE 'CRUISE' END"
+        ),
+        # As benchmark.synthetic_records() has them: every light on in
+        # one frame in seven, and off in the rest.
+        "lighting": (
+            f"CASE WHEN mod(i, 7) = 0 THEN {tb.all_lights} ELSE 0 END"
+        ),
+    }
+    if col.name in special:
+        return special[col.name]
+    if isinstance(col.type, DateTime):
+        return start
+    if isinstance(col.type, Boolean):
+        return "(mod(i, 7) = 0)"
+    if isinstance(col.type, Integer):
+        return "mod(i, 1024)"
+    if isinstance(col.type, Float):
+        return "mod(i, 1000) / 10.0"
+    if isinstance(col.type, String):
+        return "'synthetic'"
+    raise TypeError(f"No synthetic value for {col.name} ({col.type}).")
+
+
+def fill_table(conn, table, rows):
+    """Inserts rows synthetic rows into table with a single statement."""
+    instruments = [k for k in vis_instruments if k != "pan"]
+    cols = [
+        c for c in table.columns if c.name != "id" and c.computed is None
+    ]
+    prep = conn.dialect.identifier_preparer
+    conn.exec_driver_sql(
+        f"INSERT INTO {prep.format_table(table)} "
+        f"({', '.join(prep.quote(c.name) for c in cols)}) "
+        f"SELECT {', '.join(_synthetic_value(c, instruments) for c in cols)} "
+        f"FROM generate_series(0, {rows - 1}) AS g(i)"
+    )
+
+
+def queries(table, rows):
+    """The benchmark queries as (name, SQL text) pairs."""
+    prep_table = f'{bench_schema}."{table.name}"'
+    n_inst = len([k for k in vis_instruments if k != "pan"])
+    mid = epoch + datetime.timedelta(seconds=rows // n_inst // 2)
+    hour = mid + datetime.timedelta(hours=1)
+    pid = f"{mid:%y%m%d-%H%M%S}-ncl-a"
+    return [
+        (
+            "product_id lookup",
+            f"SELECT * FROM {prep_table} WHERE product_id = '{pid}'"
+        ),
+        (
+            "instrument + start_time range",
+            f"SELECT id FROM {prep_table} "
+            f"WHERE instrument_name = '{vis_instruments['ncl']}' "
+            f"AND start_time >= '{mid}' AND start_time < '{hour}'"
+        ),
+        (
+            "start_time range",
+            f"SELECT count(*) FROM {prep_table} "
+            f"WHERE start_time >= '{mid}' AND start_time < '{hour}'"
+        ),
+        (
+            "active mission phase",
+            f"SELECT id FROM {prep_table} "
+            f"WHERE mission_phase = '{tb.active_mission_phase}' "
+            f"AND instrument_name = '{vis_instruments['ncl']}' "
+            f"AND start_time >= '{mid}' AND start_time < '{hour}'"
+        ),
+    ]
+
+
+def run_queries(conn, table, rows, repeat):
+    """Returns {name: (median seconds, plan text)} for each query."""
+    results = {}
+    for name, sql in queries(table, rows):
+        times = []
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            conn.exec_driver_sql(sql).fetchall()
+            times.append(time.perf_counter() - t0)
+        plan = conn.exec_driver_sql(f"EXPLAIN (ANALYZE, BUFFERS) {sql}")
+        results[name] = (
+            statistics.median(times),
+            "\n".join(r[0] for r in plan)
+        )
+    return results
+
+
+def report(label, results):
+    print(f"\n========== {label} ==========")
+    for name, (seconds, plan) in results.items():
+        print(f"\n--- {name}: {seconds * 1000:.2f} ms (median)")
+        print(plan)
+
+
+if __name__ == "__main__":
+    args = arg_parser().parse_args()
+    util.set_logger(args.verbose)
+
+    Base, engine, db = new_db(args.config)
+    if engine.dialect.name != "postgresql":
+        sys.exit("The index benchmark requires PostgreSQL.")
+
+    table = bench_table()
+    indexes = list(table.indexes)
+    with engine.begin() as conn:
+        conn.exec_driver_sql(f"DROP SCHEMA IF EXISTS {bench_schema} CASCADE")
+        conn.exec_driver_sql(f"CREATE SCHEMA {bench_schema}")
+        table.indexes.clear()
+        table.create(bind=conn)
+        t0 = time.perf_counter()
+        fill_table(conn, table, args.rows)
+        logger.info(f"Generated {args.rows} rows in {time.perf_counter() - t0:.1f} s")
+
+    try:
+        with engine.connect() as conn:
+            conn.exec_driver_sql(f'ANALYZE {bench_schema}."{table.name}"')
+            before = run_queries(conn, table, args.rows, args.repeat)
+
+        with engine.begin() as conn:
+            for index in indexes:
+                t0 = time.perf_counter()
+                index.create(bind=conn)
+                logger.info(f"Built {index.name} in {time.perf_counter() - t0:.1f} s")
+            conn.exec_driver_sql(f'ANALYZE {bench_schema}."{table.name}"')
+
+        with engine.connect() as conn:
+            after = run_queries(conn, table, args.rows, args.repeat)
+    finally:
+        if not args.keep:
+            with engine.begin() as conn:
+                conn.exec_driver_sql(f"DROP SCHEMA {bench_schema} CASCADE")
+
+    report(f"Without indexes ({args.rows} rows)", before)
+    report(f"With indexes ({args.rows} rows)", after)
+
+    print("\n========== Summary ==========")
+    for name in before:
+        b, a = before[name][0], after[name][0]
+        print(f"{name:35s} {b * 1000:10.2f} ms -> {a * 1000:10.2f} ms "
+              f"({b / a if a else float('inf'):.1f}x)")
@@ -0,0 +1,475 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+""" Benchmarks the hot paths of the visdb schema.
+
+A synthetic, reproducible data set of valid VIS product ids across every
+instrument is generated and then used to measure:
+
+  single-row ingest   ORM add and commit of one Raw_Product at a time
+  bulk ingest         bulk_ingest.bulk_insert_raw_products()
+  upsert re-ingest    the same bulk ingest again, in upsert mode
+  point lookup        selecting a Raw_Product by product_id
+  time-range scan     paging through an instrument's time window
+  lineage link        adding products to the Product_Lineage closure
+  lineage traversal   upstream and downstream closure lookups
+
+The results are printed (or written with -o) as JSON so that runs can be
+compared to catch regressions.
+
+With a configuration file for a PostgreSQL database, everything runs in
+a scratch schema that is dropped afterwards. Without one, a temporary
+SQLite database is used as a stand-in.
+"""
+
+# Copyright 2022, United States Government as represented by the
+# Administrator of the National Aeronautics and Space Administration.
+# All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+# Reuse is permitted under the terms of the license.
+# The AUTHORS file and the LICENSE file are at the
+# top level of this library.
+
+import argparse
+import datetime
+import json
+import logging
+from pathlib import Path
+import platform
+import random
+import statistics
+import tempfile
+import time
+import sqlalchemy
+from sqlalchemy import Boolean, DateTime, Float, Integer, String
+from sqlalchemy import create_engine, select
+from sqlalchemy.engine import make_url
+
+import sys
+import os
+sys.path.insert(1, os.path.join(sys.path[0],'../../../../vipersci/src'))
+from vipersci import util
+from vipersci.pds.pid import vis_instruments
+
+import bulk_ingest
+import catalog_query
+import db_engine
+import lineage
+import partitions
+import table_product_lineage as tpl
+import table_raw_products as tb
+
+logger = logging.getLogger(__name__)
+
+bench_schema = "visdb_benchmark"
+epoch = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+
+"""Every VIS instrument code, including the combined Panorama product."""
+instruments = list(vis_instruments)
+
+"""Compression codes with a numeric ratio, as compression_ratio is a
+Float column."""
+compressions = ["a", "b", "c", "d"]
+
+
+def arg_parser():
+    parser = argparse.ArgumentParser(
+            description=__doc__,
+            formatter_class=argparse.RawDescriptionHelpFormatter,
+            parents=[util.parent_parser()]
+    )
+    parser.add_argument(
+            "-c", "--config",
+            type=Path,
+            help="Path to database configuration file. Without one, a "
+                 "temporary SQLite database is used."
+    )
+    parser.add_argument(
+            "-n", "--rows",
+            type=int,
+            default=100000,
+            help="Number of rows written by the bulk ingest."
+    )
+    parser.add_argument(
+            "--single-rows",
+            type=int,
+            default=500,
+            help="Number of rows written one at a time."
+    )
+    parser.add_argument(
+            "-b", "--batch-size",
+            type=int,
+            default=5000,
+            help="Batch size for the bulk ingest."
+    )
+    parser.add_argument(
+            "--lookups",
+            type=int,
+            default=1000,
+            help="Number of product_id lookups."
+    )
+    parser.add_argument(
+            "--scans",
+            type=int,
+            default=100,
+            help="Number of time-range scans."
+    )
+    parser.add_argument(
+            "--window",
+            type=float,
+            default=600.0,
+            help="Length in seconds of each time-range scan."
+    )
+    parser.add_argument(
+            "--lineage-products",
+            type=int,
+            default=1000,
+            help="Number of raw products given a processing chain."
+    )
+    parser.add_argument(
+            "--seed",
+            type=int,
+            default=0,
+            help="Random seed for choosing the queries, so that runs are "
+                 "comparable."
+    )
+    parser.add_argument(
+            "-o", "--output",
+            type=Path,
+            help="Write the JSON results here instead of to stdout."
+    )
+    parser.add_argument(
+            "--keep",
+            action='store_true',
+            help=f"Do not drop the {bench_schema} schema afterwards."
+    )
+    return parser
+
+
+def synthetic_time(i):
+    """The start_time of synthetic row i.
+
+    Rows cycle through the instruments, so each instrument gets one frame
+    per second and every product_id is unique.
+    """
+    return epoch + datetime.timedelta(seconds=i // len(instruments))
+
+
+def synthetic_pid(i):
+    """The product_id of synthetic row i."""
+    n = len(instruments)
+    return (
+        f"{synthetic_time(i):%y%m%d-%H%M%S}-{instruments[i % n]}-"
+        f"{compressions[(i // n) % len(compressions)]}"
+    )
+
+
+def _synthetic_value(col, i, t):
+    if isinstance(col.type, DateTime):
+        return t
+    if isinstance(col.type, Boolean):
+        return i % 7 == 0
+    if isinstance(col.type, Integer):
+        return i % 1024
+    if isinstance(col.type, Float):
+        return (i % 1000) / 10.0
+    if isinstance(col.type, String):
+        return "synthetic"
+    raise TypeError(f"No synthetic value for {col.name} ({col.type}).")
+
+
+def synthetic_records(n, start=0):
+    """Yields n Raw_Product records, beginning with synthetic row start.
+
+    The records are the keyword arguments the Raw_Product constructor
+    takes, with a valid product_id and every other column filled in. Row
+    i is always the same, so separate runs load identical data.
+    """
+    table = tb.Raw_Product.__table__
+    derived = set(tb.product_id_columns(synthetic_pid(0)))
+    for i in range(start, start + n):
+        t = synthetic_time(i)
+        record = {
+            c: _synthetic_value(table.c[c], i, t)
+            for c in bulk_ingest.raw_columns if c not in derived
+        }
+        record["product_id"] = synthetic_pid(i)
+        record["mission_phase"] = (
+            tb.active_mission_phase if i % 10 == 0 else "CRUISE"
+        )
+        record["stop_time"] = t + datetime.timedelta(seconds=0.5)
+        record["lighting"] = tb.all_lights if i % 7 == 0 else 0
+        yield record
+
+
+def summarize(times):
+    """Returns latency statistics in ms, and the rate per second, for a
+    list of per-operation times in seconds."""
+    total = sum(times)
+    count = len(times)
+    ordered = sorted(times)
+
+    def pct(p):
+        return ordered[min(len(ordered) - 1, int(p * len(ordered)))] * 1000
+
+    return {
+        "count": count,
+        "seconds": round(total, 6),
+        "per_second": round(count / total, 2) if total else None,
+        "mean_ms": round(statistics.mean(times) * 1000, 4),
+        "median_ms": round(statistics.median(times) * 1000, 4),
+        "p95_ms": round(pct(0.95), 4),
+        "p99_ms": round(pct(0.99), 4),
+        "max_ms": round(ordered[-1] * 1000, 4),
+    }
+
+
+def bench_single_ingest(engine, n):
+    times = []
+    with db_engine.session(engine) as session:
+        for record in synthetic_records(n):
+            t0 = time.perf_counter()
+            session.add(tb.Raw_Product(**record))
+            session.commit()
+            times.append(time.perf_counter() - t0)
+    return summarize(times)
+
+
+def bench_bulk_ingest(engine, n, start, batch_size, upsert=False):
+    stats = bulk_ingest.bulk_insert_raw_products(
+        engine, synthetic_records(n, start=start),
+        batch_size=batch_size, upsert=upsert
+    )
+    return {
+        "count": stats.rows,
+        "seconds": round(stats.seconds, 6),
+        "per_second": round(stats.rows_per_second, 2),
+        "method": stats.method,
+        "batches": stats.batches,
+        "commits": stats.commits,
+        "inserted": stats.inserted,
+        "updated": stats.updated,
+        "unchanged": stats.unchanged,
+    }
+
+
+def bench_point_lookup(engine, total, lookups, rng):
+    rp = tb.Raw_Product
+    times = []
+    with engine.connect() as conn:
+        for i in rng.choices(range(total), k=lookups):
+            pid = synthetic_pid(i)
+            t0 = time.perf_counter()
+            row = conn.execute(
+                select(rp.__table__).where(
+                    catalog_query.product_id_filter(pid)
+                )
+            ).first()
+            times.append(time.perf_counter() - t0)
+            if row is None:
+                raise RuntimeError(f"Lookup of {pid} found nothing.")
+    return summarize(times)
+
+
+def bench_time_range(engine, total, scans, window, rng):
+    span = (synthetic_time(total - 1) - epoch).total_seconds()
+    times = []
+    rows = 0
+    with db_engine.session(engine) as session:
+        for _ in range(scans):
+            start = epoch + datetime.timedelta(
+                seconds=rng.uniform(0, max(span - window, 0))
+            )
+            stop = start + datetime.timedelta(seconds=window)
+            inst = rng.choice(instruments)
+            after = None
+            t0 = time.perf_counter()
+            while True:
+                page, after = catalog_query.raw_product_page(
+                    session, inst, start, stop, after
+                )
+                rows += len(page)
+                if after is None:
+                    break
+            times.append(time.perf_counter() - t0)
+            session.expunge_all()
+    result = summarize(times)
+    result["rows"] = rows
+    return result
+
+
+"""The synthetic processing chain, one product per step for each raw
+product, with every mosaic_span rectified products in one mosaic."""
+chain = [
+    "Raw_Products",
+    lineage.calibrated.Calibrated_Product.__tablename__,
+    lineage.undistorted.Undistorted_Product.__tablename__,
+    lineage.rectified.Rectified_Product.__tablename__,
+]
+mosaic_span = 50
+
+
+def bench_lineage(engine, n, rng):
+    link_times = []
+    with engine.begin() as conn:
+        for r in range(1, n + 1):
+            for parent, child in zip(chain, chain[1:]):
+                t0 = time.perf_counter()
+                lineage.link_products(conn, (parent, r), (child, r))
+                link_times.append(time.perf_counter() - t0)
+            t0 = time.perf_counter()
+            lineage.link_products(
+                conn, (chain[-1], r), ("Mosaic_Products", r // mosaic_span)
+            )
+            link_times.append(time.perf_counter() - t0)
+
+    up_times, down_times = [], []
+    n_mosaics = n // mosaic_span + 1
+    with engine.connect() as conn:
+        for _ in range(min(n, 1000)):
+            m = rng.randrange(n_mosaics)
+            t0 = time.perf_counter()
+            lineage.upstream(conn, "Mosaic_Products", m)
+            up_times.append(time.perf_counter() - t0)
+
+            r = rng.randint(1, n)
+            t0 = time.perf_counter()
+            lineage.downstream(conn, "Raw_Products", r)
+            down_times.append(time.perf_counter() - t0)
+
+    return (
+        summarize(link_times),
+        summarize(up_times),
+        summarize(down_times),
+    )
+
+
+def bench_engine(config):
+    """Returns a private engine for the benchmark and a cleanup function.
+
+    For PostgreSQL the engine's connections use the scratch schema as
+    their search_path, so all the library code runs unchanged against the
+    scratch tables. It is not the shared db_engine engine, so the
+    search_path never leaks into other users of the pool.
+    """
+    if config is None:
+        tmp = tempfile.TemporaryDirectory()
+        engine = create_engine(f"sqlite:///{tmp.name}/benchmark.db")
+        return engine, lambda keep: tmp.cleanup()
+
+    url, options, db = db_engine.read_config(config)
+    if make_url(url).get_backend_name() == "sqlite":
+        sys.exit(
+            "Run without -c for SQLite; the benchmark will not write into "
+            "an existing SQLite database."
+        )
+    engine = create_engine(
+        url, connect_args={"options": f"-csearch_path={bench_schema}"}
+    )
+    with engine.begin() as conn:
+        conn.exec_driver_sql(f"DROP SCHEMA IF EXISTS {bench_schema} CASCADE")
+        conn.exec_driver_sql(f"CREATE SCHEMA {bench_schema}")
+
+    def cleanup(keep):
+        if not keep:
+            with engine.begin() as conn:
+                conn.exec_driver_sql(f"DROP SCHEMA {bench_schema} CASCADE")
+        engine.dispose()
+
+    return engine, cleanup
+
+
+def run(engine, args):
+    """Runs every benchmark and returns the results as a dict."""
+    partitions.create_raw_products(engine)
+    tpl.Base.metadata.create_all(engine)
+    rng = random.Random(args.seed)
+    total = args.single_rows + args.rows
+
+    results = {}
+    logger.info("Single-row ingest")
+    results["single_row_ingest"] = bench_single_ingest(
+        engine, args.single_rows
+    )
+    logger.info("Bulk ingest")
+    results["bulk_ingest"] = bench_bulk_ingest(
+        engine, args.rows, args.single_rows, args.batch_size
+    )
+    logger.info("Upsert re-ingest")
+    results["upsert_reingest"] = bench_bulk_ingest(
+        engine, args.rows, args.single_rows, args.batch_size, upsert=True
+    )
+    with engine.connect() as conn:
+        partitioned = partitions.is_partitioned(conn)
+    if partitioned:
+        # The synthetic data predates the partitions made for the current
+        # time, so give it partitions of its own to be pruned to.
+        partitions.ensure_partitions(engine)
+    with engine.begin() as conn:
+        conn.exec_driver_sql("ANALYZE")
+
+    logger.info("Point lookup")
+    results["point_lookup"] = bench_point_lookup(
+        engine, total, args.lookups, rng
+    )
+    logger.info("Time-range scan")
+    results["time_range_scan"] = bench_time_range(
+        engine, total, args.scans, args.window, rng
+    )
+    logger.info("Lineage")
+    n = min(args.lineage_products, total)
+    (
+        results["lineage_link"],
+        results["lineage_upstream"],
+        results["lineage_downstream"],
+    ) = bench_lineage(engine, n, rng)
+
+    with engine.connect() as conn:
+        server = conn.dialect.server_version_info
+    return {
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "database": {
+            "dialect": engine.dialect.name,
+            "driver": engine.dialect.driver,
+            "server_version": ".".join(str(v) for v in server or ()),
+            "partitioned": partitioned,
+        },
+        "python": platform.python_version(),
+        "sqlalchemy": sqlalchemy.__version__,
+        "parameters": {
+            k: v for k, v in vars(args).items()
+            if k not in ("config", "output", "keep", "verbose")
+        },
+        "results": results,
+    }
+
+
+if __name__ == "__main__":
+    args = arg_parser().parse_args()
+    util.set_logger(args.verbose)
+
+    engine, cleanup = bench_engine(args.config)
+    try:
+        report = run(engine, args)
+    finally:
+        cleanup(args.keep)
+
+    text = json.dumps(report, indent=2, default=str)
+    if args.output:
+        args.output.write_text(text + "\n")
+    else:
+        print(text)
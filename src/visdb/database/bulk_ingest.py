@@ -0,0 +1,497 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+""" Bulk loads records into the Raw_Products table.
+
+Records are written in large batches through a Core executemany insert,
+or through the PostgreSQL COPY command when the database driver supports
+it, rather than by building and adding one Raw_Product object at a time.
+
+With --upsert, records whose product_id is already in the table update
+that row instead, so a downlink or reprocessing run can be re-ingested
+without creating duplicates. Rows that have not changed are left alone.
+"""
+
+# Copyright 2022, United States Government as represented by the
+# Administrator of the National Aeronautics and Space Administration.
+# All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+# Reuse is permitted under the terms of the license.
+# The AUTHORS file and the LICENSE file are at the
+# top level of this library.
+
+import argparse
+import csv
+from dataclasses import dataclass
+import datetime
+import io
+import itertools
+import json
+import logging
+from pathlib import Path
+import time
+import yaml
+from sqlalchemy import Column, DateTime, MetaData, Table, func, or_, select
+from sqlalchemy.dialects import postgresql, sqlite
+
+import sys
+import os
+sys.path.insert(1, os.path.join(sys.path[0],'../../../../vipersci/src'))
+from vipersci import util
+
+import table_raw_products as tb
+from db_utility import new_db
+from partitions import create_raw_products, config_interval
+from product_cache import invalidate_on_commit
+import rollups
+
+logger = logging.getLogger(__name__)
+
+raw_table = tb.Raw_Product.__table__
+
+"""These are the columns a record may provide. The identity column and the
+generated product_id component columns are filled in by the database."""
+raw_columns = [
+    c.name for c in raw_table.columns
+    if c.name != "id" and c.computed is None
+]
+
+datetime_columns = [
+    c.name for c in raw_table.columns
+    if isinstance(c.type, DateTime)
+]
+
+"""The columns an upsert matches on: those of the product_id unique index.
+The start_time is derived from the product_id, so it never changes."""
+upsert_key = ["product_id", "start_time"]
+
+"""A session-private table that upserts COPY each batch into."""
+staging = Table(
+    f"{raw_table.name}_staging", MetaData(),
+    *[Column(c, raw_table.c[c].type) for c in raw_columns],
+    prefixes=["TEMPORARY"]
+)
+
+
+def arg_parser():
+    parser = argparse.ArgumentParser(
+            description=__doc__,
+            parents=[util.parent_parser()]
+    )
+    parser.add_argument(
+            "-c", "--config",
+            type=Path,
+            required=True,
+            help="Path to database configuration file."
+    )
+    parser.add_argument(
+            "-b", "--batch-size",
+            type=int,
+            default=5000,
+            help="Number of rows sent to the database in each batch."
+    )
+    parser.add_argument(
+            "--commit-interval",
+            type=int,
+            default=50000,
+            help="Number of rows written between commits."
+    )
+    parser.add_argument(
+            "--no-copy",
+            action='store_true',
+            help="Always use executemany inserts, even if COPY is available."
+    )
+    parser.add_argument(
+            "-u", "--upsert",
+            action='store_true',
+            help="Update the rows of records whose product_id is already "
+                 "in the table, instead of failing."
+    )
+    parser.add_argument(
+            "records",
+            type=Path,
+            nargs="+",
+            help="JSON, JSON-lines, or YAML files of Raw_Product records."
+    )
+    return parser
+
+
+@dataclass
+class IngestStats:
+    """Row count and timing from a bulk load.
+
+    An upsert also counts how many rows were new, how many were updated,
+    and how many were already identical, which together make up rows.
+    Records that repeated a product_id earlier in the same batch are not
+    rows, but are counted as duplicates.
+    """
+    rows: int = 0
+    batches: int = 0
+    commits: int = 0
+    seconds: float = 0.0
+    method: str = "insert"
+    inserted: int = 0
+    updated: int = 0
+    unchanged: int = 0
+    duplicates: int = 0
+
+    @property
+    def rows_per_second(self):
+        if self.seconds <= 0:
+            return 0.0
+        return self.rows / self.seconds
+
+    def __str__(self):
+        s = (
+            f"{self.rows} rows in {self.batches} batches and "
+            f"{self.commits} commits via {self.method}: "
+            f"{self.seconds:.2f} s, {self.rows_per_second:.0f} rows/s"
+        )
+        if self.method == "upsert":
+            s += (
+                f" ({self.inserted} inserted, {self.updated} updated, "
+                f"{self.unchanged} unchanged"
+                + (f", {self.duplicates} duplicates" if self.duplicates else "")
+                + ")"
+            )
+        return s
+
+
+def raw_product_row(record):
+    """Returns a dict of Raw_Products column values for a single record.
+
+    The record is a mapping of the same keyword arguments that the
+    Raw_Product constructor accepts. The product_id is validated or built
+    exactly as the constructor does, and the light states (NavLight_Left_On
+    and so on) are packed into the lighting bitmask unless it is given,
+    but no ORM object is created.
+    """
+    pid = tb.resolve_product_id(record)
+    row = {k: v for k, v in record.items() if k in raw_columns}
+    row.update(tb.product_id_columns(pid))
+    if "lighting" not in row:
+        row["lighting"] = tb.lighting_mask(record)
+
+    missing = set(raw_columns) - row.keys()
+    if missing:
+        raise ValueError(
+            f"Record for {row['product_id']} is missing: {sorted(missing)}"
+        )
+    return row
+
+
+def batched(iterable, size):
+    """Yields lists of up to size items from iterable."""
+    it = iter(iterable)
+    while True:
+        batch = list(itertools.islice(it, size))
+        if not batch:
+            return
+        yield batch
+
+
+def copy_supported(conn):
+    """True if the connection's DBAPI cursor can run COPY FROM STDIN."""
+    if conn.dialect.name != "postgresql":
+        return False
+    cursor = conn.connection.cursor()
+    try:
+        return hasattr(cursor, "copy_expert")
+    finally:
+        cursor.close()
+
+
+def _copy_value(value):
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        return "t" if value else "f"
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    return value
+
+
+def copy_rows(conn, rows, table=raw_table, columns=raw_columns):
+    """Writes rows to table with a single COPY ... FROM STDIN command."""
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    for row in rows:
+        writer.writerow([_copy_value(row[c]) for c in columns])
+    buf.seek(0)
+
+    prep = conn.dialect.identifier_preparer
+    cols = ", ".join(prep.quote(c) for c in columns)
+    command = (
+        f"COPY {prep.format_table(table)} ({cols}) FROM STDIN WITH (FORMAT csv)"
+    )
+    cursor = conn.connection.cursor()
+    try:
+        cursor.copy_expert(command, buf)
+    finally:
+        cursor.close()
+
+
+def insert_rows(conn, rows, table=raw_table):
+    """Writes rows to table with a single executemany insert."""
+    conn.execute(table.insert(), rows)
+
+
+def upsert_statement(conn, table=raw_table, source=None):
+    """Returns an INSERT ... ON CONFLICT DO UPDATE for Raw_Products rows.
+
+    A row that conflicts on upsert_key has its other columns overwritten,
+    but only if at least one of them differs, so identical rows are not
+    rewritten at all. If source is a select of the raw_columns, the rows
+    come from it rather than from parameters.
+    """
+    if conn.dialect.name == "postgresql":
+        stmt = postgresql.insert(table)
+    elif conn.dialect.name == "sqlite":
+        stmt = sqlite.insert(table)
+    else:
+        raise NotImplementedError(
+            f"Upserts are not supported for {conn.dialect.name}."
+        )
+    if source is not None:
+        stmt = stmt.from_select(raw_columns, source)
+    columns = [c for c in raw_columns if c not in upsert_key]
+    return stmt.on_conflict_do_update(
+        index_elements=[table.c[c] for c in upsert_key],
+        set_={c: stmt.excluded[c] for c in columns},
+        where=or_(*[
+            table.c[c].is_distinct_from(stmt.excluded[c]) for c in columns
+        ])
+    )
+
+
+def _staged(conn, rows):
+    """COPYs rows into a temporary staging table and returns a select of
+    them, so that an upsert of the whole batch is one set-based statement
+    instead of one round trip per row."""
+    staging.create(bind=conn, checkfirst=True)
+    conn.exec_driver_sql(
+        f"TRUNCATE {conn.dialect.identifier_preparer.format_table(staging)}"
+    )
+    copy_rows(conn, rows, table=staging)
+    return select(*[staging.c[c] for c in raw_columns])
+
+
+def upsert_rows(conn, rows, table=raw_table, use_copy=True):
+    """Inserts rows, or updates the existing rows with the same product_id.
+
+    Returns the (inserted, updated, unchanged) counts. Each call costs one
+    query to count the rows that already exist and one upsert statement;
+    if use_copy and COPY is available, the rows are first copied to a
+    staging table.
+    If a product_id appears more than once in rows, the last one wins.
+    The rows are removed from any product_cache.ProductCache.
+    """
+    unique = {r["product_id"]: r for r in rows}
+    if len(unique) < len(rows):
+        logger.warning(
+            f"{len(rows) - len(unique)} records repeat a product_id in the "
+            "same batch; only the last of each is kept."
+        )
+    rows = list(unique.values())
+
+    # The start_time range lets a partitioned table prune to the
+    # partitions this batch can be in. It is widened by a day so the
+    # database time zone does not matter.
+    times = [r["start_time"].replace(tzinfo=None) for r in rows]
+    day = datetime.timedelta(days=1)
+    existing = conn.execute(
+        select(func.count()).select_from(table).where(
+            table.c.product_id.in_(list(unique)),
+            table.c.start_time.between(min(times) - day, max(times) + day),
+        )
+    ).scalar()
+
+    if use_copy and copy_supported(conn):
+        changed = conn.execute(
+            upsert_statement(conn, table, _staged(conn, rows))
+        ).rowcount
+    else:
+        changed = conn.execute(upsert_statement(conn, table), rows).rowcount
+    if table is raw_table:
+        invalidate_on_commit(conn, unique)
+
+    # The rowcount includes inserted and updated rows, but not the rows
+    # skipped by the ON CONFLICT ... WHERE because nothing had changed.
+    inserted = len(rows) - existing
+    updated = changed - inserted
+    return inserted, updated, existing - updated
+
+
+def track_rollups(rows, counts, totals, days):
+    """Notes how a batch written by upsert_rows() changes the rollups.
+
+    A batch that was all new is added to totals; otherwise the days of
+    its rows go in days, to be summarized again.
+    """
+    inserted, updated, unchanged = counts
+    if inserted == len(rows):
+        rollups.aggregate(rows, totals)
+    elif inserted or updated:
+        days |= rollups.touched_days(rows)
+
+
+def update_rollups_before_commit(conn, totals, days):
+    """Applies what track_rollups() or rollups.aggregate() collected."""
+    rollups.add(conn, totals)
+    # The days summarized again may include some that were just added
+    # to, so this must come second.
+    rollups.refresh(conn, days)
+
+
+def bulk_insert_raw_products(
+    engine, records, batch_size=5000, commit_interval=50000, use_copy=True,
+    upsert=False, update_rollups=True
+):
+    """Writes an iterable of Raw_Product records to the database in batches.
+
+    Each record is converted with raw_product_row(), and every batch_size
+    rows are written in one statement: COPY if use_copy is True and the
+    database supports it, otherwise a Core executemany insert.  The
+    transaction is committed after at least commit_interval rows, and once
+    more at the end.  A failure rolls back only the uncommitted rows.
+
+    If upsert is True, each batch is written with upsert_rows() instead,
+    so records that are already in the table update their rows; it stages
+    the rows with COPY only if use_copy is True.
+
+    If update_rollups is True, the Catalog_Summaries rollups are brought
+    up to date before each commit (see rollups.py).
+
+    Returns an IngestStats.
+    """
+    if batch_size < 1:
+        raise ValueError("batch_size must be positive.")
+
+    stats = IngestStats()
+    start = time.perf_counter()
+    with engine.connect() as conn:
+        do_copy = use_copy and not upsert and copy_supported(conn)
+        if upsert:
+            stats.method = "upsert"
+        else:
+            stats.method = "copy" if do_copy else "insert"
+        if update_rollups:
+            rollups.summary.create(bind=conn, checkfirst=True)
+        uncommitted = 0
+        totals, days = {}, set()
+        trans = conn.begin()
+        try:
+            for batch in batched(records, batch_size):
+                rows = [raw_product_row(r) for r in batch]
+                if upsert:
+                    counts = upsert_rows(conn, rows, use_copy=use_copy)
+                    stats.inserted += counts[0]
+                    stats.updated += counts[1]
+                    stats.unchanged += counts[2]
+                    written = sum(counts)
+                    stats.duplicates += len(rows) - written
+                    if update_rollups:
+                        track_rollups(rows, counts, totals, days)
+                elif do_copy:
+                    copy_rows(conn, rows)
+                    written = len(rows)
+                    stats.inserted += written
+                else:
+                    insert_rows(conn, rows)
+                    written = len(rows)
+                    stats.inserted += written
+                if update_rollups and not upsert:
+                    rollups.aggregate(rows, totals)
+                stats.rows += written
+                stats.batches += 1
+                uncommitted += len(rows)
+
+                if uncommitted >= commit_interval:
+                    update_rollups_before_commit(conn, totals, days)
+                    totals, days = {}, set()
+                    trans.commit()
+                    stats.commits += 1
+                    uncommitted = 0
+                    logger.info(
+                        f"{stats.rows} rows, "
+                        f"{stats.rows / (time.perf_counter() - start):.0f} "
+                        "rows/s"
+                    )
+                    trans = conn.begin()
+            update_rollups_before_commit(conn, totals, days)
+            trans.commit()
+            stats.commits += 1
+        except Exception:
+            trans.rollback()
+            raise
+
+    stats.seconds = time.perf_counter() - start
+    logger.info(str(stats))
+    return stats
+
+
+def _parse_datetimes(record):
+    for k in datetime_columns:
+        if isinstance(record.get(k), str):
+            record[k] = datetime.datetime.fromisoformat(
+                record[k].replace("Z", "+00:00")
+            )
+    return record
+
+
+def read_records(path):
+    """Yields record dicts from a JSON, JSON-lines, or YAML file.
+
+    A file may hold a single record or a list of records.  ISO 8601
+    strings in datetime columns are converted to datetime objects.
+    """
+    with open(path, 'r') as f:
+        if path.suffix in (".jsonl", ".ndjson"):
+            for line in f:
+                if line.strip():
+                    yield _parse_datetimes(json.loads(line))
+            return
+        elif path.suffix in (".yml", ".yaml"):
+            data = yaml.safe_load(f)
+        else:
+            data = json.load(f)
+
+    if isinstance(data, dict):
+        data = [data]
+    for record in data:
+        yield _parse_datetimes(record)
+
+
+if __name__ == "__main__":
+    args = arg_parser().parse_args()
+    util.set_logger(args.verbose)
+
+    Base, engine, db = new_db(args.config)
+    create_raw_products(engine, config_interval(db))
+
+    records = itertools.chain.from_iterable(
+        read_records(p) for p in args.records
+    )
+    stats = bulk_insert_raw_products(
+        engine,
+        records,
+        batch_size=args.batch_size,
+        commit_interval=args.commit_interval,
+        use_copy=not args.no_copy,
+        upsert=args.upsert
+    )
+    print(stats)
@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+""" Catalog queries over the Raw_Products table.
+
+These are meant for large result sets: rows are read in fixed-size pages
+with keyset pagination on (start_time, id), and each page is streamed
+from a server-side cursor, so memory use stays constant and every page
+costs the same no matter how far into the result it is.
+
+Jobs that only read, such as reports and exports, should use
+stream_raw_product_rows(), which returns plain read-only rows of just
+the columns asked for, rather than Raw_Product objects that the session
+has to construct and track.
+"""
+
+# Copyright 2022, United States Government as represented by the
+# Administrator of the National Aeronautics and Space Administration.
+# All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+# Reuse is permitted under the terms of the license.
+# The AUTHORS file and the LICENSE file are at the
+# top level of this library.
+
+import datetime
+import logging
+from sqlalchemy import and_, select, tuple_
+
+import db_engine
+import table_raw_products as tb
+
+logger = logging.getLogger(__name__)
+
+raw = tb.Raw_Product.__table__
+
+"""The columns that pages are keyed on, which every row read by
+stream_raw_product_rows() has."""
+key_columns = ("start_time", "id")
+
+
+def product_id_filter(product_id):
+    """Returns a filter selecting the Raw_Product with a product_id.
+
+    The start_time that the product_id encodes is matched as well, to
+    within a day either way so that the database time zone does not
+    matter. That lets PostgreSQL prune a partitioned Raw_Products to the
+    partition that holds the product, instead of probing the product_id
+    index of every partition.
+    """
+    rp = tb.Raw_Product
+    cols = tb.product_id_columns(product_id)
+    t = cols["start_time"].replace(tzinfo=None)
+    day = datetime.timedelta(days=1)
+    return and_(
+        rp.product_id == cols["product_id"],
+        rp.start_time >= t - day,
+        rp.start_time < t + day,
+    )
+
+
+def product_ids_filter(product_ids):
+    """Returns a filter selecting the Raw_Products with any of product_ids.
+
+    As with product_id_filter(), the start_time range that the product_ids
+    span, widened by a day, is matched as well, so only the partitions
+    that can hold them are searched.
+    """
+    rp = tb.Raw_Product
+    cols = [tb.product_id_columns(p) for p in product_ids]
+    times = [c["start_time"].replace(tzinfo=None) for c in cols]
+    day = datetime.timedelta(days=1)
+    return and_(
+        rp.product_id.in_([c["product_id"] for c in cols]),
+        rp.start_time >= min(times) - day,
+        rp.start_time < max(times) + day,
+    )
+
+
+def time_window(stmt, instrument_name, start_time, stop_time, after=None):
+    """Restricts a Raw_Product select to one instrument and time window.
+
+    The window includes start_time and excludes stop_time. The
+    instrument_name may be the long name or the VISID instrument code. If
+    after is a (start_time, id) key, only rows that sort after it are
+    selected. The result is ordered by (start_time, id).
+    """
+    rp = tb.Raw_Product
+    instrument_name = tb.vis_instruments.get(instrument_name, instrument_name)
+    stmt = stmt.where(
+        rp.instrument_name == instrument_name,
+        rp.start_time >= start_time,
+        rp.start_time < stop_time,
+    )
+    if after is not None:
+        stmt = stmt.where(tuple_(rp.start_time, rp.id) > tuple(after))
+    return stmt.order_by(rp.start_time, rp.id)
+
+
+def raw_product_page(
+    session, instrument_name, start_time, stop_time, after=None, page_size=1000
+):
+    """Returns one page of Raw_Products and the key for the next page.
+
+    Pass the returned key as after to get the following page; it is None
+    once the window is exhausted. The page is found with an index seek on
+    the key, not an OFFSET, so later pages are as cheap as the first.
+    """
+    stmt = time_window(
+        select(tb.Raw_Product), instrument_name, start_time, stop_time, after
+    ).limit(page_size)
+    rows = session.execute(stmt).scalars().all()
+    if len(rows) < page_size:
+        return rows, None
+    return rows, (rows[-1].start_time, rows[-1].id)
+
+
+def stream_raw_products(
+    engine, instrument_name, start_time, stop_time, page_size=1000, after=None
+):
+    """Yields the Raw_Products for an instrument and time window.
+
+    Rows come from a server-side cursor, page_size at a time, and each
+    page is a separate keyset query, so neither the database driver nor
+    the session ever holds more than one page. Objects are detached from
+    the session once their page has been yielded.
+    """
+    while True:
+        with db_engine.session(engine) as session:
+            stmt = time_window(
+                select(tb.Raw_Product),
+                instrument_name, start_time, stop_time, after
+            ).limit(page_size).execution_options(
+                stream_results=True, yield_per=page_size
+            )
+            n = 0
+            for row in session.execute(stmt).scalars():
+                n += 1
+                after = (row.start_time, row.id)
+                yield row
+            session.expunge_all()
+
+        logger.debug(f"Streamed a page of {n} rows ending at {after}.")
+        if n < page_size:
+            return
+
+
+def raw_product_columns(columns=None):
+    """Returns the Raw_Products columns with the given names (all of them
+    if None), with the key_columns added if they are missing."""
+    if columns is None:
+        return list(raw.columns)
+    names = list(columns) + [k for k in key_columns if k not in columns]
+    return [raw.c[name] for name in names]
+
+
+def stream_raw_product_rows(
+    engine, instrument_name, start_time, stop_time, columns=None,
+    page_size=1000, after=None
+):
+    """Yields read-only rows of the Raw_Products for an instrument and time
+    window.
+
+    This reads like stream_raw_products(), but with a Core select() of
+    only the named columns, so no Raw_Product objects are built or
+    tracked. The rows are named tuples of those columns and the
+    key_columns (product_id is the plain string).
+    """
+    cols = raw_product_columns(columns)
+    while True:
+        with engine.connect() as conn:
+            stmt = time_window(
+                select(*cols), instrument_name, start_time, stop_time, after
+            ).limit(page_size)
+            result = conn.execution_options(
+                stream_results=True, max_row_buffer=page_size
+            ).execute(stmt)
+            n = 0
+            for row in result:
+                n += 1
+                after = (row.start_time, row.id)
+                yield row
+
+        logger.debug(f"Streamed a page of {n} rows ending at {after}.")
+        if n < page_size:
+            return
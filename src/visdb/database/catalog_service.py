@@ -0,0 +1,388 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+""" A small read-only HTTP/JSON service over the catalog.
+
+Scripts that would each open their own engine can ask this service
+instead, so that the database sees one pool of connections however many
+clients there are. It is a single asyncio process, with an asyncio
+engine from db_engine (asyncpg for PostgreSQL, aiosqlite for a SQLite
+file), and only runs SELECTs. These are the endpoints, all GET:
+
+    /products/PRODUCT_ID
+        The Raw_Product with a product_id, as a JSON object.
+    /products?instrument=I&start=T&stop=T[&columns=C,...][&limit=N]
+        The Raw_Products of an instrument (name or code) from start up to
+        stop (ISO 8601), as NDJSON in (start_time, id) order, with just
+        the given columns if columns is given.
+    /products/PRODUCT_ID/lineage[?direction=downstream|upstream]
+    /lineage/TABLE/ID[?direction=downstream|upstream]
+        The products derived from (or that a product derives from) a
+        Raw_Product, or any product, as a JSON list, nearest first.
+    /health
+        Whether the database answers.
+    /metrics
+        The db_metrics of the engine, in the Prometheus text format.
+
+Time windows are read in keyset pages, as catalog_query does, and each
+page is sent before the next is read, so a connection is only held for
+as long as it takes to read one page, however slow the client is.
+"""
+
+# Copyright 2022, United States Government as represented by the
+# Administrator of the National Aeronautics and Space Administration.
+# All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+# Reuse is permitted under the terms of the license.
+# The AUTHORS file and the LICENSE file are at the
+# top level of this library.
+
+import argparse
+import asyncio
+import contextlib
+import datetime
+import decimal
+import json
+import logging
+from pathlib import Path
+from urllib.parse import parse_qs, unquote, urlsplit
+from sqlalchemy import select, text
+from sqlalchemy.engine import make_url
+
+import sys
+import os
+sys.path.insert(1, os.path.join(sys.path[0],'../../../../vipersci/src'))
+from vipersci import util
+
+import catalog_query
+import db_engine
+import db_metrics
+import lineage
+import table_raw_products as tb
+
+logger = logging.getLogger(__name__)
+
+raw = tb.Raw_Product.__table__
+
+"""Rows read per query when streaming a time window."""
+default_page_size = 1000
+
+"""Requests with a longer request line or headers than this are refused."""
+max_request_bytes = 16384
+
+reasons = {
+    200: "OK", 400: "Bad Request", 404: "Not Found",
+    405: "Method Not Allowed", 500: "Internal Server Error",
+    503: "Service Unavailable",
+}
+
+
+def arg_parser():
+    parser = argparse.ArgumentParser(
+            description=__doc__,
+            formatter_class=argparse.RawDescriptionHelpFormatter,
+            parents=[util.parent_parser()]
+    )
+    parser.add_argument(
+            "-c", "--config",
+            type=Path,
+            required=True,
+            help="Path to database configuration file."
+    )
+    parser.add_argument(
+            "--host",
+            default="127.0.0.1",
+            help="Address to listen on."
+    )
+    parser.add_argument(
+            "-p", "--port",
+            type=int,
+            default=8080,
+            help="Port to listen on."
+    )
+    parser.add_argument(
+            "--page-size",
+            type=int,
+            default=default_page_size,
+            help="Number of rows read per query when streaming."
+    )
+    return parser
+
+
+class HTTPError(Exception):
+    """An error to answer a request with."""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def _json_default(value):
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def dumps(value):
+    return json.dumps(value, default=_json_default)
+
+
+def read_only_engine(url, **options):
+    """Returns the shared asyncio engine for url, opening a SQLite file
+    read-only. (CatalogService makes PostgreSQL transactions READ ONLY.)"""
+    url = make_url(url)
+    if url.get_backend_name() == "sqlite":
+        url = url.set(
+            database=f"file:{url.database}",
+            query=dict(url.query, mode="ro", uri="true"),
+        )
+    return db_engine.get_async_engine(url, **options)
+
+
+class CatalogService:
+    """Answers catalog requests from one shared asyncio engine."""
+
+    def __init__(self, engine, page_size=default_page_size):
+        self.engine = engine
+        self.page_size = page_size
+
+    @contextlib.asynccontextmanager
+    async def connect(self):
+        """A pooled connection whose PostgreSQL transactions are READ ONLY."""
+        async with self.engine.connect() as conn:
+            if conn.dialect.name == "postgresql":
+                conn = await conn.execution_options(postgresql_readonly=True)
+            yield conn
+
+    async def product(self, product_id):
+        try:
+            where = catalog_query.product_id_filter(product_id)
+        except Exception as e:
+            raise HTTPError(400, f"Bad product_id {product_id!r}: {e}")
+        async with self.connect() as conn:
+            row = (await conn.execute(select(raw).where(where))).first()
+        if row is None:
+            raise HTTPError(404, f"No product {product_id}")
+        return dict(row._mapping)
+
+    async def products(self, query):
+        """Yields NDJSON pages of a time window."""
+        try:
+            instrument = query["instrument"]
+            if instrument not in tb.vis_instruments and \
+                    instrument not in tb.vis_instruments.values():
+                raise ValueError(f"Unknown instrument {instrument!r}")
+            start = datetime.datetime.fromisoformat(query["start"])
+            stop = datetime.datetime.fromisoformat(query["stop"])
+            columns = query["columns"].split(",") if "columns" in query \
+                else None
+            cols = catalog_query.raw_product_columns(columns)
+            limit = int(query["limit"]) if "limit" in query else None
+        except KeyError as e:
+            raise HTTPError(400, f"Missing or unknown {e}")
+        except ValueError as e:
+            raise HTTPError(400, str(e))
+
+        names = columns or [c.name for c in cols]
+        after = None
+        sent = 0
+        while limit is None or sent < limit:
+            n = self.page_size if limit is None \
+                else min(self.page_size, limit - sent)
+            stmt = catalog_query.time_window(
+                select(*cols), instrument, start, stop, after
+            ).limit(n)
+            async with self.connect() as conn:
+                rows = (await conn.execute(stmt)).all()
+            if rows:
+                after = (rows[-1].start_time, rows[-1].id)
+                sent += len(rows)
+                yield "".join(
+                    dumps({k: row._mapping[k] for k in names}) + "\n"
+                    for row in rows
+                ).encode()
+            if len(rows) < n:
+                return
+
+    async def lineage(self, product_type, product_id, direction):
+        if direction == "downstream":
+            find = lineage.downstream
+        elif direction == "upstream":
+            find = lineage.upstream
+        else:
+            raise HTTPError(400, "direction must be downstream or upstream.")
+        try:
+            product_id = int(product_id)
+        except ValueError as e:
+            raise HTTPError(400, str(e))
+        async with self.connect() as conn:
+            relatives = await conn.run_sync(find, product_type, product_id)
+        return [r._asdict() for r in relatives]
+
+    async def product_lineage(self, product_id, direction):
+        row = await self.product(product_id)
+        return await self.lineage(raw.name, row["id"], direction)
+
+    async def health(self):
+        async with self.connect() as conn:
+            await conn.execute(text("SELECT 1"))
+        return {"status": "ok"}
+
+    def metrics(self):
+        m = db_metrics.metrics(self.engine.sync_engine)
+        return m.to_prometheus() if m is not None else ""
+
+    async def route(self, path, query):
+        """Returns the status, content type, and body for a request; the
+        body is bytes, or an async iterator of bytes to send chunked."""
+        parts = [unquote(p) for p in path.strip("/").split("/")]
+        direction = query.get("direction", "downstream")
+        if parts == ["products"]:
+            return 200, "application/x-ndjson", self.products(query)
+        if len(parts) == 2 and parts[0] == "products":
+            body = await self.product(parts[1])
+        elif len(parts) == 3 and parts[0] == "products" \
+                and parts[2] == "lineage":
+            body = await self.product_lineage(parts[1], direction)
+        elif len(parts) == 3 and parts[0] == "lineage":
+            body = await self.lineage(parts[1], parts[2], direction)
+        elif parts == ["health"]:
+            body = await self.health()
+        elif parts == ["metrics"]:
+            return 200, "text/plain; version=0.0.4", self.metrics().encode()
+        else:
+            raise HTTPError(404, f"No endpoint {path}")
+        return 200, "application/json", dumps(body).encode()
+
+    async def handle(self, reader, writer):
+        """Answers the requests on one client connection, which is kept
+        open between requests unless the client asks otherwise."""
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b"\r\n\r\n")
+                except asyncio.IncompleteReadError:
+                    return
+                except asyncio.LimitOverrunError:
+                    await self.respond(writer, *self.error(
+                        HTTPError(400, "Request too large.")
+                    ), keep_alive=False)
+                    return
+                lines = head.decode("latin-1").split("\r\n")
+                try:
+                    method, target, version = lines[0].split(" ")
+                except ValueError:
+                    return
+                headers = {
+                    k.strip().lower(): v.strip()
+                    for k, v in (
+                        line.split(":", 1) for line in lines[1:] if ":" in line
+                    )
+                }
+                keep_alive = (
+                    version == "HTTP/1.1"
+                    and headers.get("connection", "").lower() != "close"
+                )
+                if method != "GET":
+                    response = self.error(HTTPError(405, "Only GET is served."))
+                else:
+                    url = urlsplit(target)
+                    query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+                    try:
+                        response = await self.route(url.path, query)
+                    except Exception as e:
+                        response = self.error(e)
+                await self.respond(writer, *response, keep_alive=keep_alive)
+                if not keep_alive:
+                    return
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        except Exception as e:
+            # Part of the response may have been sent, so just hang up.
+            logger.exception(e)
+        finally:
+            writer.close()
+
+    def error(self, e):
+        if not isinstance(e, HTTPError):
+            logger.exception(e)
+            e = HTTPError(500, "Internal error.")
+        return e.status, "application/json", dumps({"error": str(e)}).encode()
+
+    async def respond(self, writer, status, content_type, body, keep_alive):
+        head = [
+            f"HTTP/1.1 {status} {reasons[status]}",
+            f"Content-Type: {content_type}",
+            f"Connection: {'keep-alive' if keep_alive else 'close'}",
+        ]
+        if isinstance(body, bytes):
+            head.append(f"Content-Length: {len(body)}")
+            writer.write(("\r\n".join(head) + "\r\n\r\n").encode() + body)
+            await writer.drain()
+            return
+
+        # A stream: errors before the first chunk still get a status.
+        chunks = body.__aiter__()
+        try:
+            first = await chunks.__anext__()
+        except StopAsyncIteration:
+            first = b""
+        except Exception as e:
+            await self.respond(writer, *self.error(e), keep_alive=keep_alive)
+            return
+        head.append("Transfer-Encoding: chunked")
+        writer.write(("\r\n".join(head) + "\r\n\r\n").encode())
+        chunk = first
+        while True:
+            if chunk:
+                writer.write(f"{len(chunk):x}\r\n".encode() + chunk + b"\r\n")
+                await writer.drain()
+            try:
+                chunk = await chunks.__anext__()
+            except StopAsyncIteration:
+                break
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+
+async def serve(engine, host="127.0.0.1", port=8080,
+                page_size=default_page_size):
+    """Serves the catalog until cancelled."""
+    service = CatalogService(engine, page_size)
+    server = await asyncio.start_server(
+        service.handle, host, port, limit=max_request_bytes
+    )
+    logger.info(f"Serving the catalog on {host}:{port}")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    args = arg_parser().parse_args()
+    util.set_logger(args.verbose)
+
+    url, options, db = db_engine.read_config(args.config)
+    engine = read_only_engine(url, **options)
+    try:
+        asyncio.run(serve(engine, args.host, args.port, args.page_size))
+    except KeyboardInterrupt:
+        pass
@@ -1,5 +1,13 @@
 """ This is the program used to clean up after a database.
 There's minimal checking of commands here.
+
+For test and rehearsal environments that are reset often, --snapshot
+saves the database as it is now (schema, indexes, and any seeded
+reference data), and --restore puts it back in seconds: PostgreSQL
+clones a template database, and SQLite copies the database file.
+--truncate empties the tables but keeps the schema, for data-only
+resets. Snapshot and restore disconnect everyone else using the
+database.
 """
 
 # Copyright 2022, United States Government as represented by the
@@ -29,9 +37,12 @@ import hashlib
 from importlib import resources
 import logging
 from pathlib import Path
+import sqlite3
+import time
 import yaml
-from sqlalchemy import create_engine, MetaData, select
+from sqlalchemy import bindparam, create_engine, MetaData, select, text
 from sqlalchemy import orm, schema, inspect
+from sqlalchemy.pool import NullPool
 
 import sys
 import os
@@ -39,6 +50,8 @@ sys.path.insert(1, os.path.join(sys.path[0],'../../../../vipersci/src'))
 from vipersci.pds import pid as pds
 from vipersci import util
 
+import db_engine
+
 logger = logging.getLogger(__name__)
 
 
@@ -74,35 +87,48 @@ def arg_parser():
             action='store_true',
             help='run special query.'
     )
+    parser.add_argument(
+            "--snapshot",
+            nargs="?",
+            const="",
+            metavar="NAME",
+            help="Save the database as a template database (PostgreSQL) "
+                 "or file (SQLite) called NAME, by default the database "
+                 "name with a _snapshot suffix."
+    )
+    parser.add_argument(
+            "--restore",
+            nargs="?",
+            const="",
+            metavar="NAME",
+            help="Replace the database with the snapshot NAME."
+    )
+    parser.add_argument(
+            "-t", "--truncate",
+            action='store_true',
+            help="Delete all rows, and restart the identity columns, but "
+                 "keep the tables."
+    )
+    parser.add_argument(
+            "-k", "--keep",
+            action='append',
+            default=[],
+            help="Table to leave alone when truncating. May be given more "
+                 "than once."
+    )
     return parser
 
-def get_engine(url):
-    engine = create_engine(url, echo=True)
-    return(engine)
+def get_engine(url, **options):
+    """Return the process-wide shared engine for url."""
+    return db_engine.get_engine(url, **options)
 
 def new_db(fname):
     """ Create a new database connection from a yaml configuration file.
     """
 
-    with open(fname, 'r') as f:
-        conf_text = f.read()
-        
-    db = yaml.load(conf_text, Loader=yaml.FullLoader)
-    print(db)
-
-    db_host = db['db_host']
-    db_host = db['db_host']
-    db_port = db['db_port']
-    db_name = db['db_name']
-    db_user = db['db_user']
-    db_pass = db['db_pass']
-    db_type = db['db_type']
-    url = f'{db_type}://{db_user}:{db_pass}@{db_host}:{db_port}/{db_name}'
-
-    engine = get_engine(url)
-    print("\n\n\n**************************")
-    print(engine.url)
-    print("**************************\n\n\n")
+    url, options, db = db_engine.read_config(fname)
+    engine = get_engine(url, **options)
+    logger.info(f"Connected to {engine.url!r}")
     Base = orm.declarative_base()
     Base.metadata.create_all(engine)
     return(Base, engine, db)
@@ -120,20 +146,182 @@ def refresh_db(engine, Base):
     engine.execute(db_refresh_command)
 
 
+"""The suffix of the default snapshot name."""
+snapshot_suffix = "_snapshot"
+
+
+def _snapshot_name(engine, name=None):
+    return name or engine.url.database + snapshot_suffix
+
+
+def _sqlite_path(engine):
+    path = engine.url.database
+    if not path or path == ":memory:":
+        raise ValueError("An in-memory SQLite database has no snapshot.")
+    return path
+
+
+def _sqlite_copy(source, target):
+    """Copies one SQLite database file over another with the backup API,
+    which gives a consistent copy even if the source is in use."""
+    src = sqlite3.connect(source)
+    dst = sqlite3.connect(target)
+    try:
+        src.backup(dst)
+    finally:
+        src.close()
+        dst.close()
+
+
+def _maintenance_engine(engine):
+    """Returns an engine for another database on the same PostgreSQL
+    server, since a database cannot be dropped or copied by a connection
+    to itself."""
+    other = "template1" if engine.url.database == "postgres" else "postgres"
+    return create_engine(
+        engine.url.set(database=other),
+        isolation_level="AUTOCOMMIT",
+        poolclass=NullPool
+    )
+
+
+def _disconnect(conn, database):
+    """Ends every other session connected to database."""
+    conn.execute(
+        text(
+            "SELECT pg_terminate_backend(pid) FROM pg_stat_activity "
+            "WHERE datname = :database AND pid <> pg_backend_pid()"
+        ),
+        {"database": database}
+    )
+
+
+def _drop_database(conn, database):
+    q = conn.dialect.identifier_preparer.quote
+    is_template = conn.execute(
+        text("SELECT datistemplate FROM pg_database WHERE datname = :d"),
+        {"d": database}
+    ).scalar()
+    if is_template:
+        conn.exec_driver_sql(
+            f"ALTER DATABASE {q(database)} WITH IS_TEMPLATE false"
+        )
+    _disconnect(conn, database)
+    conn.exec_driver_sql(f"DROP DATABASE IF EXISTS {q(database)}")
+
+
+def snapshot_db(engine, name=None):
+    """Saves the database so that restore_db() can bring it back.
+
+    On PostgreSQL the snapshot is a template database, which cannot be
+    connected to, so it stays as it was. On SQLite it is a copy of the
+    database file. Any earlier snapshot of the same name is replaced.
+    Returns the name of the snapshot.
+    """
+    name = _snapshot_name(engine, name)
+    start = time.perf_counter()
+    if engine.dialect.name == "sqlite":
+        _sqlite_copy(_sqlite_path(engine), name)
+    elif engine.dialect.name == "postgresql":
+        database = engine.url.database
+        engine.dispose()
+        maintenance = _maintenance_engine(engine)
+        q = maintenance.dialect.identifier_preparer.quote
+        with maintenance.connect() as conn:
+            _drop_database(conn, name)
+            _disconnect(conn, database)
+            conn.exec_driver_sql(
+                f"CREATE DATABASE {q(name)} TEMPLATE {q(database)}"
+            )
+            conn.exec_driver_sql(
+                f"ALTER DATABASE {q(name)} "
+                "WITH IS_TEMPLATE true ALLOW_CONNECTIONS false"
+            )
+        maintenance.dispose()
+    else:
+        raise NotImplementedError(
+            f"Snapshots are not supported for {engine.dialect.name}."
+        )
+    logger.info(
+        f"Saved snapshot {name} in {time.perf_counter() - start:.2f} s"
+    )
+    return name
+
+
+def restore_db(engine, name=None):
+    """Replaces the database with the snapshot saved by snapshot_db().
+
+    The engine's pooled connections are closed, so that the next use of
+    the engine connects to the restored database.
+    """
+    name = _snapshot_name(engine, name)
+    start = time.perf_counter()
+    engine.dispose()
+    if engine.dialect.name == "sqlite":
+        if not Path(name).exists():
+            raise ValueError(f"There is no snapshot {name}.")
+        _sqlite_copy(name, _sqlite_path(engine))
+    elif engine.dialect.name == "postgresql":
+        database = engine.url.database
+        maintenance = _maintenance_engine(engine)
+        q = maintenance.dialect.identifier_preparer.quote
+        with maintenance.connect() as conn:
+            exists = conn.execute(
+                text("SELECT 1 FROM pg_database WHERE datname = :d"),
+                {"d": name}
+            ).scalar()
+            if not exists:
+                raise ValueError(f"There is no snapshot {name}.")
+            _drop_database(conn, database)
+            conn.exec_driver_sql(
+                f"CREATE DATABASE {q(database)} TEMPLATE {q(name)}"
+            )
+        maintenance.dispose()
+    else:
+        raise NotImplementedError(
+            f"Snapshots are not supported for {engine.dialect.name}."
+        )
+    logger.info(
+        f"Restored snapshot {name} in {time.perf_counter() - start:.2f} s"
+    )
+
+
+def truncate_db(engine, keep=()):
+    """Deletes every row of every table except those in keep, and
+    restarts the identity columns, leaving the tables and indexes."""
+    tables = [t for t in list_db_tables(None, engine) if t not in keep]
+    if not tables:
+        return tables
+    q = engine.dialect.identifier_preparer.quote
+    with engine.begin() as conn:
+        if engine.dialect.name == "postgresql":
+            conn.exec_driver_sql(
+                "TRUNCATE " + ", ".join(q(t) for t in tables) +
+                " RESTART IDENTITY CASCADE"
+            )
+        else:
+            for t in tables:
+                conn.exec_driver_sql(f"DELETE FROM {q(t)}")
+            if "sqlite_sequence" in inspect(conn).get_table_names():
+                conn.execute(
+                    text("DELETE FROM sqlite_sequence WHERE name IN :names")
+                    .bindparams(bindparam("names", expanding=True)),
+                    {"names": tables}
+                )
+    return tables
+
+
 """ Drop database tables."""
 def drop_db_table(table_name, engine, Base):
     if table_name == "all":
         """This is treated as if the user called --refresh"""
         refresh_db(engine, Base)
-    elif table_to_drop is not None:
+    elif table_name is not None:
         try:
             engine.execute(f"DROP TABLE IF EXISTS {table_name};")
         except Exception as e:
             logging.error(e)
 
-    Base, engine, db = new_db(db_config)
-    inspector = inspect(engine)
-    metadata = MetaData(engine)
     tables = list_db_tables(Base, engine)
     print("*****************************************")
     print(f"These tables still exist: {tables}!!!!")
@@ -188,6 +376,15 @@ if __name__ == "__main__":
     if args.refresh:
         refresh_db(engine, Base)
 
+    if args.snapshot is not None:
+        print(f"Saved snapshot {snapshot_db(engine, args.snapshot)}")
+
+    if args.restore is not None:
+        restore_db(engine, args.restore)
+
+    if args.truncate:
+        print(f"Truncated {truncate_db(engine, args.keep)}")
+
     if args.drop:
         print("*****************************************")
         print("*****************************************")
@@ -0,0 +1,241 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+""" The process-wide registry of database engines and sessions.
+
+Every program and library call in visdb should get its engine from here,
+so that one connection pool per database is shared across the process
+rather than each caller building (and logging through) its own engine.
+"""
+
+# Copyright 2022, United States Government as represented by the
+# Administrator of the National Aeronautics and Space Administration.
+# All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+# Reuse is permitted under the terms of the license.
+# The AUTHORS file and the LICENSE file are at the
+# top level of this library.
+
+import logging
+import threading
+import yaml
+from sqlalchemy import create_engine, orm
+from sqlalchemy.engine import make_url
+
+import db_metrics
+
+logger = logging.getLogger(__name__)
+
+"""Pool settings used unless the configuration file overrides them.
+Statement logging (echo) is off; turn it on in the configuration file
+only when debugging, since it writes every statement to stdout. The
+timings that db_metrics keeps, and its slow query log, are the way to
+see what the database is doing otherwise."""
+default_engine_options = {
+    "pool_size": 5,
+    "max_overflow": 10,
+    "pool_pre_ping": True,
+    "pool_recycle": 1800,
+    "echo": False,
+}
+
+"""Options that only apply to a QueuePool, which SQLite does not use."""
+queue_pool_options = ("pool_size", "max_overflow")
+
+"""Settings for db_metrics.instrument(), rather than create_engine():
+statements that take slow_query_ms or longer are logged, and the
+metrics are merged into metrics_file when the process exits."""
+default_metrics_options = {
+    "slow_query_ms": 1000,
+    "metrics_file": None,
+}
+
+"""The asyncio driver that get_async_engine() uses for each backend."""
+async_drivers = {
+    "postgresql": "asyncpg",
+    "sqlite": "aiosqlite",
+}
+
+_lock = threading.Lock()
+_engines = {}
+_async_engines = {}
+_sessionmakers = {}
+
+
+def read_config(fname):
+    """Reads a yaml database configuration file.
+
+    Returns the database URL, the engine options, and the parsed
+    configuration. Two layouts are understood: the flat file with db_type,
+    db_host, db_port, db_name, db_user, and db_pass keys, and the
+    docker-compose.yml for the postgres service. Engine options are read
+    from pool_size, max_overflow, pool_pre_ping, pool_recycle, and echo
+    keys, and the db_metrics settings from slow_query_ms and metrics_file
+    keys; in a docker-compose file these go in an x-visdb section.
+    """
+    with open(fname, 'r') as f:
+        db = yaml.load(f, Loader=yaml.FullLoader)
+
+    if "services" in db:
+        env = dict(
+            e.split("=", 1) for e in db['services']['postgres']['environment']
+        )
+        db_port = db['services']['postgres']['ports'][0].split(":")[0]
+        url = (
+            f"postgresql://{env['POSTGRES_USER']}:{env['POSTGRES_PASSWORD']}"
+            f"@localhost:{db_port}/{env['POSTGRES_DB']}"
+        )
+        settings = db.get("x-visdb", {})
+    elif db.get('db_type', '').startswith("sqlite"):
+        url = f"{db['db_type']}:///{db['db_name']}"
+        settings = db
+    else:
+        url = (
+            f"{db['db_type']}://{db['db_user']}:{db['db_pass']}"
+            f"@{db['db_host']}:{db['db_port']}/{db['db_name']}"
+        )
+        settings = db
+
+    options = {
+        k: settings[k]
+        for k in (*default_engine_options, *default_metrics_options)
+        if k in settings
+    }
+    return url, options, db
+
+
+def _options(options, poolclass, pooled):
+    # Splits options into those for the engine and those for db_metrics.
+    opts = dict(default_engine_options, **options)
+    if pooled:
+        opts.setdefault("poolclass", poolclass)
+    else:
+        for k in queue_pool_options:
+            opts.pop(k)
+    metrics_opts = {
+        k: opts.pop(k, v) for k, v in default_metrics_options.items()
+    }
+    return opts, metrics_opts
+
+
+def get_engine(url, **options):
+    """Returns the shared engine for url, creating it on first use.
+
+    Options override default_engine_options and default_metrics_options.
+    An engine is created once per (url, options) and then reused, so
+    callers anywhere in the process that ask for the same database share
+    its connection pool. Every engine is instrumented by db_metrics, and
+    a QueuePool records how long checkouts wait.
+    """
+    opts, metrics_opts = _options(
+        options, db_metrics.TimedQueuePool,
+        make_url(url).get_backend_name() != "sqlite"
+    )
+    key = (
+        str(url), tuple(sorted(opts.items())),
+        tuple(sorted(metrics_opts.items()))
+    )
+    with _lock:
+        engine = _engines.get(key)
+        if engine is None:
+            engine = create_engine(url, **opts)
+            db_metrics.instrument(engine, **metrics_opts)
+            _engines[key] = engine
+            logger.info(f"Created engine for {engine.url!r}")
+    return engine
+
+
+def get_async_engine(url, **options):
+    """Returns the shared asyncio engine for url, creating it on first use.
+
+    This is get_engine() for asyncio programs: the url's driver is
+    replaced by the one in async_drivers, and the engine is shared and
+    instrumented in the same way. Its metrics are those of its
+    sync_engine. Unlike get_engine(), a SQLite file gets a QueuePool too,
+    since otherwise each aiosqlite connection, with its own thread, would
+    be opened and closed for every use.
+    """
+    from sqlalchemy.ext.asyncio import create_async_engine
+
+    url = make_url(url)
+    backend = url.get_backend_name()
+    if backend not in async_drivers:
+        raise NotImplementedError(
+            f"There is no asyncio driver for {backend} configured."
+        )
+    url = url.set(drivername=f"{backend}+{async_drivers[backend]}")
+    opts, metrics_opts = _options(
+        options, db_metrics.TimedAsyncQueuePool,
+        url.database not in (None, "", ":memory:")
+    )
+    key = (
+        str(url), tuple(sorted(opts.items())),
+        tuple(sorted(metrics_opts.items()))
+    )
+    with _lock:
+        engine = _async_engines.get(key)
+        if engine is None:
+            engine = create_async_engine(url, **opts)
+            db_metrics.instrument(engine.sync_engine, **metrics_opts)
+            _async_engines[key] = engine
+            logger.info(f"Created asyncio engine for {engine.url!r}")
+    return engine
+
+
+def engine_from_config(fname, **options):
+    """Returns the shared engine for a yaml configuration file.
+
+    Options given here override those in the file.
+    """
+    url, file_options, db = read_config(fname)
+    return get_engine(url, **dict(file_options, **options))
+
+
+def get_sessionmaker(engine):
+    """Returns the shared sessionmaker bound to engine."""
+    with _lock:
+        factory = _sessionmakers.get(engine)
+        if factory is None:
+            factory = orm.sessionmaker(bind=engine)
+            _sessionmakers[engine] = factory
+    return factory
+
+
+def session(engine):
+    """Returns a new Session from the shared sessionmaker for engine.
+
+    Use it as a context manager: with session(engine) as s: ...
+    """
+    return get_sessionmaker(engine)()
+
+
+def dispose_all(close=True):
+    """Forgets every engine, closing its pooled connections unless close
+    is False.
+
+    Call dispose_all(close=False) in a child process after a fork, before
+    using the database, so that the child opens connections of its own
+    and leaves those it inherited, which are still the parent's, alone;
+    closing them would close them for the parent too. Asyncio engines
+    are only forgotten, since their connections belong to an event loop.
+    """
+    with _lock:
+        for engine in _engines.values():
+            engine.dispose(close=close)
+        _engines.clear()
+        _async_engines.clear()
+        _sessionmakers.clear()
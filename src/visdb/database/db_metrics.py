@@ -0,0 +1,435 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+""" Statement timing, row counts, and connection pool waits for engines.
+
+instrument() hooks an engine's events to keep, for every distinct
+statement (with its literal values and bind parameters replaced by ?),
+a latency histogram, the total and longest time, the number of rows
+(those fetched, for a statement that returns rows, otherwise those it
+changed), and the number of errors; and a histogram of how long
+connections took to check out of the pool. Statements slower than a
+threshold are also written, with their parameters, as one JSON object
+per line to the "db_metrics.slow" logger.
+
+The metrics can be exported as JSON or in the Prometheus text format,
+and can be merged into a JSON file when the process exits, for
+db_utility --stats to summarize.
+"""
+
+# Copyright 2022, United States Government as represented by the
+# Administrator of the National Aeronautics and Space Administration.
+# All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+# Reuse is permitted under the terms of the license.
+# The AUTHORS file and the LICENSE file are at the
+# top level of this library.
+
+import atexit
+import bisect
+import datetime
+import fcntl
+import functools
+import hashlib
+import json
+import logging
+import re
+import threading
+import time
+import weakref
+from sqlalchemy import event
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+logger = logging.getLogger(__name__)
+slow_logger = logging.getLogger("db_metrics.slow")
+
+"""Upper bounds, in seconds, of the latency histogram buckets. The last
+bucket, for everything slower, is implied."""
+buckets = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+    1.0, 2.5, 5.0, 10.0,
+)
+
+"""Statements are kept by their first this many normalized characters."""
+max_statement_length = 2000
+
+"""The longest repr() of the parameters written to the slow query log."""
+max_parameters_length = 2000
+
+_literals = re.compile(
+    r"'(?:[^']|'')*'"                 # string literals
+    r"|%\(\w+\)s|\?|:\w+|\$\d+"       # bind parameters, in each paramstyle
+    r"|\b\d+(?:\.\d+)?(?:[eE][-+]?\d+)?\b"  # numbers
+)
+_lists = re.compile(r"\?(?:\s*,\s*\?)+")
+_space = re.compile(r"\s+")
+
+_metrics = weakref.WeakKeyDictionary()
+
+
+@functools.lru_cache(maxsize=4096)
+def normalize(statement):
+    """Returns statement with whitespace collapsed and each literal value
+    or bind parameter replaced by ?, and each list of them by ?, ..."""
+    s = _literals.sub("?", _space.sub(" ", statement).strip())
+    return _lists.sub("?, ...", s)[:max_statement_length]
+
+
+def statement_id(statement):
+    """A short, stable identifier of a normalized statement."""
+    return hashlib.md5(statement.encode()).hexdigest()[:12]
+
+
+class Histogram:
+    """Counts of observations in each of the latency buckets."""
+
+    def __init__(self):
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(buckets, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def merge(self, other):
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def to_dict(self):
+        return {
+            "count": self.count, "total": self.total, "max": self.max,
+            "buckets": self.counts,
+        }
+
+    @classmethod
+    def from_dict(cls, d):
+        h = cls()
+        h.counts = list(d["buckets"])
+        h.count = d["count"]
+        h.total = d["total"]
+        h.max = d["max"]
+        return h
+
+
+class StatementStats(Histogram):
+    """The latency histogram of a statement, and its rows and errors."""
+
+    def __init__(self):
+        super().__init__()
+        self.rows = 0
+        self.errors = 0
+
+    def merge(self, other):
+        super().merge(other)
+        self.rows += other.rows
+        self.errors += other.errors
+
+    def to_dict(self):
+        return dict(super().to_dict(), rows=self.rows, errors=self.errors)
+
+    @classmethod
+    def from_dict(cls, d):
+        s = super().from_dict(d)
+        s.rows = d["rows"]
+        s.errors = d["errors"]
+        return s
+
+
+class Metrics:
+    """The statement and pool metrics of one engine, or of many merged."""
+
+    def __init__(self):
+        self.statements = {}
+        self.checkout = Histogram()
+        self._lock = threading.Lock()
+
+    def record(self, statement, seconds, rows):
+        key = normalize(statement)
+        with self._lock:
+            stats = self.statements.get(key)
+            if stats is None:
+                stats = self.statements[key] = StatementStats()
+            stats.observe(seconds)
+            stats.rows += max(rows, 0)
+        return stats
+
+    def record_rows(self, stats, rows):
+        with self._lock:
+            stats.rows += rows
+
+    def record_error(self, statement):
+        key = normalize(statement)
+        with self._lock:
+            stats = self.statements.get(key)
+            if stats is None:
+                stats = self.statements[key] = StatementStats()
+            stats.errors += 1
+
+    def record_checkout(self, seconds):
+        with self._lock:
+            self.checkout.observe(seconds)
+
+    def merge(self, other):
+        with self._lock:
+            for key, stats in other.statements.items():
+                if key in self.statements:
+                    self.statements[key].merge(stats)
+                else:
+                    self.statements[key] = stats
+            self.checkout.merge(other.checkout)
+
+    def reset(self):
+        with self._lock:
+            self.statements = {}
+            self.checkout = Histogram()
+
+    def top(self, n=20, by="total"):
+        """Returns the n (statement, StatementStats) with the highest by
+        (total, count, max, rows, or errors)."""
+        with self._lock:
+            items = list(self.statements.items())
+        return sorted(
+            items, key=lambda kv: getattr(kv[1], by), reverse=True
+        )[:n]
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                "buckets": list(buckets),
+                "statements": {
+                    k: v.to_dict() for k, v in self.statements.items()
+                },
+                "pool_checkout": self.checkout.to_dict(),
+            }
+
+    def to_json(self):
+        return json.dumps(self.to_dict(), indent=2)
+
+    @classmethod
+    def from_dict(cls, d):
+        if list(d.get("buckets", buckets)) != list(buckets):
+            raise ValueError("The metrics have different histogram buckets.")
+        m = cls()
+        m.statements = {
+            k: StatementStats.from_dict(v)
+            for k, v in d.get("statements", {}).items()
+        }
+        if "pool_checkout" in d:
+            m.checkout = Histogram.from_dict(d["pool_checkout"])
+        return m
+
+    def to_prometheus(self, prefix="visdb_db"):
+        """Returns the metrics in the Prometheus text exposition format.
+
+        Statements are labelled by statement_id(), and the sql label holds
+        the (normalized) statement itself.
+        """
+        lines = []
+
+        def histogram(name, h, labels=""):
+            cumulative = 0
+            for bound, n in zip(buckets, h.counts):
+                cumulative += n
+                sep = "," if labels else ""
+                lines.append(
+                    f'{name}_bucket{{{labels}{sep}le="{bound}"}} {cumulative}'
+                )
+            sep = "," if labels else ""
+            lines.append(f'{name}_bucket{{{labels}{sep}le="+Inf"}} {h.count}')
+            braces = f"{{{labels}}}" if labels else ""
+            lines.append(f"{name}_sum{braces} {h.total}")
+            lines.append(f"{name}_count{braces} {h.count}")
+
+        name = f"{prefix}_statement_duration_seconds"
+        lines.append(f"# HELP {name} Time taken to execute statements.")
+        lines.append(f"# TYPE {name} histogram")
+        rows, errors = [], []
+        for key, stats in sorted(self.statements.items()):
+            sql = key.replace("\\", "\\\\").replace('"', '\\"')
+            labels = f'statement="{statement_id(key)}",sql="{sql}"'
+            histogram(name, stats, labels)
+            rows.append(f"{prefix}_statement_rows_total{{{labels}}} {stats.rows}")
+            errors.append(
+                f"{prefix}_statement_errors_total{{{labels}}} {stats.errors}"
+            )
+        lines.append(f"# TYPE {prefix}_statement_rows_total counter")
+        lines.extend(rows)
+        lines.append(f"# TYPE {prefix}_statement_errors_total counter")
+        lines.extend(errors)
+
+        name = f"{prefix}_pool_checkout_seconds"
+        lines.append(
+            f"# HELP {name} Time spent waiting for a pooled connection."
+        )
+        lines.append(f"# TYPE {name} histogram")
+        histogram(name, self.checkout)
+        return "\n".join(lines) + "\n"
+
+
+def load(path):
+    """Returns the Metrics saved in a JSON file."""
+    with open(path) as f:
+        return Metrics.from_dict(json.load(f))
+
+
+def merge_into_file(metrics, path):
+    """Adds metrics to those already saved in the JSON file at path.
+
+    The file is locked while it is updated, so that several processes
+    can share it.
+    """
+    with open(path, "a+") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            f.seek(0)
+            text = f.read()
+            total = Metrics.from_dict(json.loads(text)) if text else Metrics()
+            total.merge(metrics)
+            f.seek(0)
+            f.truncate()
+            f.write(total.to_json())
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class TimedQueuePool(QueuePool):
+    """A QueuePool that records how long each checkout waited."""
+
+    metrics = None
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            if self.metrics is not None:
+                self.metrics.record_checkout(time.perf_counter() - start)
+
+    def recreate(self):
+        pool = super().recreate()
+        pool.metrics = self.metrics
+        return pool
+
+
+class TimedAsyncQueuePool(TimedQueuePool, AsyncAdaptedQueuePool):
+    """A TimedQueuePool for asyncio engines."""
+
+
+def _slow(statement, parameters, seconds, rowcount, executemany):
+    if executemany:
+        shown = {"count": len(parameters), "first": parameters[0]}
+    else:
+        shown = parameters
+    slow_logger.warning(json.dumps({
+        "time": datetime.datetime.utcnow().isoformat() + "Z",
+        "seconds": round(seconds, 6),
+        "statement": statement,
+        "parameters": repr(shown)[:max_parameters_length],
+        "rowcount": rowcount,
+        "executemany": executemany,
+    }))
+
+
+class _CountingCursor:
+    """A DBAPI cursor that adds the rows fetched from it to the rows of
+    its statement. The rowcount of a SELECT is -1 for sqlite3, and for
+    server-side cursors, so the rows are counted as they are fetched."""
+
+    def __init__(self, cursor, metrics, stats):
+        self._cursor = cursor
+        self._metrics = metrics
+        self._stats = stats
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def fetchone(self):
+        row = self._cursor.fetchone()
+        if row is not None:
+            self._metrics.record_rows(self._stats, 1)
+        return row
+
+    def fetchmany(self, *args, **kwargs):
+        rows = self._cursor.fetchmany(*args, **kwargs)
+        self._metrics.record_rows(self._stats, len(rows))
+        return rows
+
+    def fetchall(self):
+        rows = self._cursor.fetchall()
+        self._metrics.record_rows(self._stats, len(rows))
+        return rows
+
+
+def metrics(engine):
+    """Returns the Metrics of an instrumented engine, or None."""
+    return _metrics.get(engine)
+
+
+def instrument(engine, slow_query_ms=None, metrics_file=None):
+    """Starts collecting the metrics of engine, and returns its Metrics.
+
+    Statements that take slow_query_ms or longer are logged, if it is
+    given. If metrics_file is given, the metrics are merged into it when
+    the process exits. An engine is only instrumented once.
+    """
+    if engine in _metrics:
+        return _metrics[engine]
+    m = _metrics[engine] = Metrics()
+    if isinstance(engine.pool, TimedQueuePool):
+        engine.pool.metrics = m
+    slow = None if slow_query_ms is None else slow_query_ms / 1000.0
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after(conn, cursor, statement, parameters, context, executemany):
+        seconds = time.perf_counter() - conn.info["query_start"].pop()
+        rowcount = cursor.rowcount
+        # A server-side cursor has no description until it is fetched from.
+        if context is not None and (
+            cursor.description is not None
+            or getattr(context, "_is_server_side", False)
+        ):
+            # The result reads from context.cursor, which is set up after
+            # this, so its rows can be counted as they are fetched.
+            stats = m.record(statement, seconds, 0)
+            context.cursor = _CountingCursor(cursor, m, stats)
+        else:
+            m.record(statement, seconds, rowcount)
+        if slow is not None and seconds >= slow:
+            _slow(statement, parameters, seconds, rowcount, executemany)
+
+    @event.listens_for(engine, "handle_error")
+    def error(context):
+        starts = context.connection.info.get("query_start") \
+            if context.connection is not None else None
+        if starts:
+            starts.pop()
+        if context.statement is not None:
+            m.record_error(context.statement)
+
+    if metrics_file is not None:
+        atexit.register(merge_into_file, m, metrics_file)
+    return m
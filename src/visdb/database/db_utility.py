@@ -26,6 +26,8 @@ Various vipersci database utilities.
 # top level of this library.
 
 import argparse
+import contextlib
+import datetime
 import hashlib
 from importlib import resources
 import logging
@@ -40,6 +42,8 @@ sys.path.insert(1, os.path.join(sys.path[0],'../../../../vipersci/src'))
 from vipersci.pds import pid as pds
 from vipersci import util
 
+import db_engine
+
 logger = logging.getLogger(__name__)
 
 
@@ -69,28 +73,72 @@ def arg_parser():
             action='store_true',
             help='run special query.'
     )
+    parser.add_argument(
+            "-s", "--stream",
+            nargs=3,
+            metavar=("INSTRUMENT", "START", "STOP"),
+            help="Stream the Raw_Products for an instrument (name or code) "
+                 "from START up to STOP (ISO 8601 datetimes)."
+    )
+    parser.add_argument(
+            "--page-size",
+            type=int,
+            default=1000,
+            help="Number of rows fetched per page when streaming."
+    )
+    parser.add_argument(
+            "--stats",
+            nargs="?",
+            const=True,
+            metavar="FILE",
+            help="Print the statements with the most total time from a "
+                 "db_metrics file, by default the metrics_file in the "
+                 "configuration file."
+    )
+    parser.add_argument(
+            "--stats-format",
+            choices=("table", "json", "prometheus"),
+            default="table",
+            help="How --stats prints the metrics."
+    )
+    parser.add_argument(
+            "--top",
+            type=int,
+            default=20,
+            help="Number of statements printed by --stats."
+    )
+    parser.add_argument(
+            "--profile",
+            nargs="?",
+            const="",
+            metavar="RUN",
+            help="Store the query plans of the --query or --stream "
+                 "statements in Query_Plans, as RUN (the start time by "
+                 "default)."
+    )
+    parser.add_argument(
+            "--plans",
+            nargs="?",
+            const="",
+            metavar="RUN",
+            help="List the stored profiling runs, or the plans of RUN."
+    )
+    parser.add_argument(
+            "--diff-plans",
+            nargs=2,
+            metavar=("OLD", "NEW"),
+            help="Compare the plans of the statements in two profiling runs."
+    )
     return parser
 
-def get_engine(url):
-    engine = create_engine(url, echo=True)
-    return(engine)
+def get_engine(url, **options):
+    """Return the process-wide shared engine for url."""
+    return db_engine.get_engine(url, **options)
 
 """ Read database configuration file."""
 def new_db(fname):
-    with open(fname, 'r') as f:
-        conf_text = f.read()
-        
-    db = yaml.load(conf_text, Loader=yaml.FullLoader)
-
-    db_host = 'localhost'
-    db_port=db['services']['postgres']['ports'][0].split(":")[0] 
-    db_user=db['services']['postgres']['environment'][0].split("=")[1] 
-    db_pass=db['services']['postgres']['environment'][1].split("=")[1] 
-    db_name=db['services']['postgres']['environment'][2].split("=")[1]
-    db_type='postgresql'
-    url = f'{db_type}://{db_user}:{db_pass}@{db_host}:{db_port}/{db_name}'
-
-    engine = get_engine(url)
+    url, options, db = db_engine.read_config(fname)
+    engine = get_engine(url, **options)
     Base = orm.declarative_base()
     Base.metadata.create_all(engine)
     return(Base, engine, db)
@@ -114,9 +162,6 @@ def drop_db_table(table_name, engine, Base):
         except Exception as e:
             logging.error(e)
 
-    Base, engine, db = new_db(db_config)
-    inspector = inspect(engine)
-    metadata = MetaData(engine)
     tables = list_db_tables(Base, engine)
     print("*****************************************")
     print(f"These tables still exist: {tables}!!!!")
@@ -141,16 +186,78 @@ def query(Base, engine):
         except:
             raise
 
+def stream(engine, instrument, start, stop, page_size):
+    """Print the Raw_Products for an instrument and time window."""
+    import catalog_query
+    start_time = datetime.datetime.fromisoformat(start)
+    stop_time = datetime.datetime.fromisoformat(stop)
+    for row in catalog_query.stream_raw_product_rows(
+        engine, instrument, start_time, stop_time,
+        columns=["id", "product_id", "start_time"], page_size=page_size
+    ):
+        print(row.id, row.product_id, row.start_time.isoformat())
+
+def stats(path, fmt="table", top=20):
+    """Print the metrics saved by db_metrics in path."""
+    import db_metrics
+    metrics = db_metrics.load(path)
+    if fmt == "json":
+        print(metrics.to_json())
+        return
+    if fmt == "prometheus":
+        print(metrics.to_prometheus(), end="")
+        return
+    print("total_s\tcount\tmean_ms\tmax_ms\trows\terrors\tstatement")
+    for statement, s in metrics.top(top):
+        mean = s.total / s.count * 1000 if s.count else 0.0
+        print(
+            f"{s.total:.3f}\t{s.count}\t{mean:.3f}\t{s.max * 1000:.3f}\t"
+            f"{s.rows}\t{s.errors}\t{statement}"
+        )
+    c = metrics.checkout
+    if c.count:
+        print(
+            f"pool checkouts: {c.count}, mean wait "
+            f"{c.total / c.count * 1000:.3f} ms, max {c.max * 1000:.3f} ms"
+        )
+
+
+def plans(engine, run):
+    """Print the profiling runs, or the plans of one run."""
+    import query_plans
+    if not run:
+        for r in query_plans.runs(engine):
+            print(r.run, r.captured_at.isoformat(), r.plans)
+        return
+    for p in query_plans.load_run(engine, run):
+        print(f"== {p.id} {p.captured_at.isoformat()} {p.execution_ms} ms")
+        print(p.statement)
+        for s in p.seq_scans or ():
+            print(f"Sequential scan of {s['table']} ({s['rows']} rows)")
+        print("\n".join(query_plans.outline(p.plan)))
 
 
 if __name__ == "__main__":
-    args = arg_parser().parse_args()
+    parser = arg_parser()
+    args = parser.parse_args()
     util.set_logger(args.verbose)
 
     print(args)
 
     db_config = args.config
 
+    if args.stats:
+        path = args.stats
+        if path is True:
+            if db_config is None:
+                parser.error("--stats needs a FILE, or -c for its metrics_file.")
+            path = db_engine.read_config(db_config)[1].get("metrics_file")
+            if path is None:
+                sys.exit("The configuration file has no metrics_file.")
+        stats(path, args.stats_format, args.top)
+        if db_config is None:
+            sys.exit()
+
     Base, engine, db = new_db(db_config)
 
     inspector = inspect(engine)
@@ -166,6 +273,22 @@ if __name__ == "__main__":
         print(f"Dropping table, {args.drop}!!!")
         drop_db_table(args.drop, engine, Base)
 
-    if args.query:
-        query(Base, engine)
+    with contextlib.ExitStack() as stack:
+        if args.profile is not None:
+            import query_plans
+            stack.enter_context(
+                query_plans.Capture(engine, args.profile or None)
+            )
+
+        if args.query:
+            query(Base, engine)
+
+        if args.stream:
+            stream(engine, *args.stream, args.page_size)
+
+    if args.plans is not None:
+        plans(engine, args.plans)
 
+    if args.diff_plans:
+        import query_plans
+        print("\n".join(query_plans.diff_runs(engine, *args.diff_plans)))
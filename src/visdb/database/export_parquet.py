@@ -0,0 +1,330 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+""" Exports the Raw_Products and Observation_Geometries tables to Parquet.
+
+Each table is read through a server-side cursor in fixed-size batches,
+and each batch is converted straight to an Arrow record batch with
+column types taken from the table definition, so neither the table nor
+any ORM objects are ever held in memory.
+
+The files are written as a Hive-partitioned dataset, by the instrument
+code of the product_id and the UTC date of the start_time, e.g.
+Raw_Products/instrument=ncl/date=2024-01-27/. Observation_Geometries
+rows take their instrument and date from their Raw_Product. With pandas:
+
+    pandas.read_parquet("export/Raw_Products", filters=[("date", ">=", ...)])
+
+With --incremental, only the rows added since the last export into the
+same directory are written, as new files alongside the old ones. Rows
+are recognized as new by their id, so rows that were updated in place
+since the last export are not picked up; run a full export to refresh
+them.
+"""
+
+# Copyright 2022, United States Government as represented by the
+# Administrator of the National Aeronautics and Space Administration.
+# All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+# Reuse is permitted under the terms of the license.
+# The AUTHORS file and the LICENSE file are at the
+# top level of this library.
+
+import argparse
+import datetime
+import json
+import logging
+from pathlib import Path
+import shutil
+import time
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from sqlalchemy import BigInteger, Boolean, DateTime, Float, Integer, select
+from sqlalchemy import SmallInteger, inspect
+
+import sys
+import os
+sys.path.insert(1, os.path.join(sys.path[0],'../../../../vipersci/src'))
+from vipersci import util
+
+from db_utility import new_db
+import table_raw_observation_geometry as tog
+import table_raw_products as tb
+
+logger = logging.getLogger(__name__)
+
+raw = tb.Raw_Product.__table__
+geometry = tog.Observation_Geometry.__table__
+
+"""The columns that the exported datasets are partitioned on."""
+partition_columns = ["instrument", "date"]
+
+"""Records the last id exported from each table, in the output directory."""
+state_file = "_export_state.json"
+
+
+def arg_parser():
+    parser = argparse.ArgumentParser(
+            description=__doc__,
+            formatter_class=argparse.RawDescriptionHelpFormatter,
+            parents=[util.parent_parser()]
+    )
+    parser.add_argument(
+            "-c", "--config",
+            type=Path,
+            required=True,
+            help="Path to database configuration file."
+    )
+    parser.add_argument(
+            "-b", "--batch-size",
+            type=int,
+            default=50000,
+            help="Number of rows fetched, and converted, at a time."
+    )
+    parser.add_argument(
+            "-t", "--table",
+            action="append",
+            choices=[raw.name, geometry.name],
+            help="Table to export. May be given more than once. "
+                 "Default: all of them."
+    )
+    parser.add_argument(
+            "-i", "--incremental",
+            action='store_true',
+            help="Only export the rows added since the last export to "
+                 "this directory."
+    )
+    parser.add_argument(
+            "output",
+            type=Path,
+            help="Directory to write the datasets to, one per table."
+    )
+    return parser
+
+
+def arrow_type(column):
+    """Returns the Arrow type for a SQLAlchemy column."""
+    kind = column.type
+    if isinstance(kind, BigInteger):
+        return pa.int64()
+    if isinstance(kind, SmallInteger):
+        return pa.int16()
+    if isinstance(kind, Integer):
+        return pa.int32()
+    if isinstance(kind, Float):
+        return pa.float64()
+    if isinstance(kind, Boolean):
+        return pa.bool_()
+    if isinstance(kind, DateTime):
+        return pa.timestamp("us")
+    return pa.string()
+
+
+def export_query(table):
+    """Returns the select for a table's export, ordered by id.
+
+    The instrument and date partition values are the last two columns.
+    The date column is still the start_time, and is cut down to a date
+    when the batch is converted.
+    """
+    if table is raw:
+        source = raw
+    elif table is geometry:
+        source = geometry.join(raw, geometry.c.raw_product_table_id == raw.c.id)
+    else:
+        raise ValueError(f"There is no export for {table.name}.")
+    return select(
+        *table.columns,
+        raw.c.pid_instrument.label("instrument"),
+        raw.c.start_time.label("date"),
+    ).select_from(source).order_by(table.c.id)
+
+
+def arrow_schema(table):
+    """Returns the Arrow schema of a table's export."""
+    return pa.schema(
+        [pa.field(c.name, arrow_type(c), c.nullable) for c in table.columns] +
+        [pa.field("instrument", pa.string()), pa.field("date", pa.date32())]
+    )
+
+
+def record_batch(rows, schema):
+    """Converts a list of result rows to an Arrow RecordBatch."""
+    columns = list(zip(*rows))
+    arrays = [
+        pa.array(values, type=field.type)
+        for values, field in zip(columns[:-1], schema)
+    ]
+    start_times = pa.array(columns[-1], type=pa.timestamp("us"))
+    arrays.append(pc.cast(start_times, pa.date32()))
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+class PartitionWriter:
+    """Writes record batches to a Hive-partitioned Parquet dataset.
+
+    Each partition's rows go to a file named for the run, which is kept
+    open while the batches keep bringing rows for that partition. The
+    rows arrive in id order, which follows time closely, so few files
+    are open at once, and each partition usually gets one file per run.
+    """
+
+    def __init__(self, directory, schema, run):
+        self.directory = directory
+        self.schema = schema
+        self.run = run
+        self.file_schema = pa.schema(
+            [f for f in schema if f.name not in partition_columns]
+        )
+        self._writers = {}
+        self._files = {}
+
+    def _path(self, key):
+        n = self._files.get(key, 0)
+        self._files[key] = n + 1
+        parts = [f"{c}={v}" for c, v in zip(partition_columns, key)]
+        path = self.directory.joinpath(*parts, f"{self.run}-{n}.parquet")
+        path.parent.mkdir(parents=True, exist_ok=True)
+        return path
+
+    def write(self, batch):
+        data = pa.Table.from_batches([batch])
+        groups = data.group_by(partition_columns).aggregate([])
+        keys = list(zip(*[groups[c].to_pylist() for c in partition_columns]))
+        for key in keys:
+            mask = None
+            for c, value in zip(partition_columns, key):
+                match = pc.equal(data[c], pa.scalar(value, data[c].type))
+                mask = match if mask is None else pc.and_(mask, match)
+            rows = data.filter(mask).drop_columns(partition_columns)
+            if key not in self._writers:
+                self._writers[key] = pq.ParquetWriter(
+                    self._path(key), self.file_schema
+                )
+            self._writers[key].write_table(rows)
+        for key in set(self._writers) - set(keys):
+            self._writers.pop(key).close()
+
+    def close(self):
+        for writer in self._writers.values():
+            writer.close()
+        self._writers = {}
+
+
+def read_state(output):
+    path = output / state_file
+    if not path.exists():
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_state(output, state):
+    path = output / state_file
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "w") as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp, path)
+
+
+def _remove_run(directory, run):
+    """Removes the files of an export run that did not finish."""
+    for path in directory.rglob(f"{run}-*.parquet"):
+        path.unlink()
+
+
+def export_table(
+    engine, table, output, batch_size=50000, incremental=False
+):
+    """Writes a table to a partitioned Parquet dataset under output.
+
+    A full export replaces the table's dataset. An incremental one adds
+    files for the rows with ids above the last one exported. The run is
+    recorded in the state file before any files are written, and the
+    last id once they all are, so the files of a run that was
+    interrupted are removed by the next. Returns the number of rows
+    written.
+    """
+    start = time.perf_counter()
+    output.mkdir(parents=True, exist_ok=True)
+    directory = output / table.name
+    schema = arrow_schema(table)
+    state = read_state(output)
+    previous = state.get(table.name, {})
+
+    if previous.get("pending") is not None:
+        logger.warning(
+            f"Removing the files of the unfinished export {previous['pending']}"
+        )
+        _remove_run(directory, previous["pending"])
+
+    stmt = export_query(table)
+    last_id = previous.get("last_id") if incremental else None
+    if last_id is not None:
+        stmt = stmt.where(table.c.id > last_id)
+    elif directory.exists():
+        shutil.rmtree(directory)
+
+    run = datetime.datetime.utcnow().strftime("%Y%m%dT%H%M%S%f")
+    state[table.name] = dict(previous, pending=run)
+    write_state(output, state)
+
+    written = 0
+    writer = PartitionWriter(directory, schema, run)
+    try:
+        with engine.connect() as conn:
+            result = conn.execution_options(
+                stream_results=True, yield_per=batch_size
+            ).execute(stmt)
+            for rows in result.partitions():
+                writer.write(record_batch(rows, schema))
+                last_id = rows[-1].id
+                written += len(rows)
+                logger.debug(f"{table.name}: {written} rows")
+    finally:
+        writer.close()
+
+    state[table.name] = {
+        "last_id": last_id,
+        "exported_at": run,
+        "pending": None,
+    }
+    write_state(output, state)
+    logger.info(
+        f"Exported {written} rows of {table.name} in "
+        f"{time.perf_counter() - start:.2f} s"
+    )
+    return written
+
+
+if __name__ == "__main__":
+    args = arg_parser().parse_args()
+    util.set_logger(args.verbose)
+
+    Base, engine, db = new_db(args.config)
+
+    tables = {raw.name: raw, geometry.name: geometry}
+    for name in args.table or tables:
+        if not inspect(engine).has_table(name):
+            logger.warning(f"There is no {name} table, skipping.")
+            continue
+        n = export_table(
+            engine, tables[name], args.output, args.batch_size,
+            args.incremental
+        )
+        print(f"{name}: {n} rows")
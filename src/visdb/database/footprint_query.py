@@ -0,0 +1,241 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+""" Finds the Raw_Products whose image centers fall in an area.
+
+Searches use the indexed image_center_geohash column of the
+Observation_Geometries table: the search area is covered by a small set of
+geohash cells, each cell is one index range scan, and only the rows from
+those cells are checked against the exact area. Run as a program with
+--backfill, this adds the geohash column and its index to a database made
+before they existed, and fills the column in for rows written before.
+"""
+
+# Copyright 2022, United States Government as represented by the
+# Administrator of the National Aeronautics and Space Administration.
+# All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+# Reuse is permitted under the terms of the license.
+# The AUTHORS file and the LICENSE file are at the
+# top level of this library.
+
+import argparse
+import logging
+from pathlib import Path
+from sqlalchemy import and_, bindparam, inspect, or_, select
+
+import sys
+import os
+sys.path.insert(1, os.path.join(sys.path[0],'../../../../vipersci/src'))
+from vipersci import util
+
+from db_utility import new_db
+import spatial_index as si
+import table_raw_observation_geometry as tog
+import table_raw_products as tb
+
+logger = logging.getLogger(__name__)
+
+geometry = tog.Observation_Geometry.__table__
+raw = tb.Raw_Product.__table__
+
+
+def arg_parser():
+    parser = argparse.ArgumentParser(
+            description=__doc__,
+            formatter_class=argparse.RawDescriptionHelpFormatter,
+            parents=[util.parent_parser()]
+    )
+    parser.add_argument(
+            "-c", "--config",
+            type=Path,
+            required=True,
+            help="Path to database configuration file."
+    )
+    parser.add_argument(
+            "--backfill",
+            action='store_true',
+            help="Add image_center_geohash if it is missing, and fill it "
+                 "in where it is."
+    )
+    parser.add_argument(
+            "-p", "--point",
+            nargs=3,
+            type=float,
+            metavar=("LAT", "LON", "KM"),
+            help="Find images centered within KM of LAT, LON."
+    )
+    parser.add_argument(
+            "-b", "--bbox",
+            nargs=4,
+            type=float,
+            metavar=("MIN_LAT", "MIN_LON", "MAX_LAT", "MAX_LON"),
+            help="Find images centered within a latitude/longitude box."
+    )
+    return parser
+
+
+def geohash_filter(column, prefixes):
+    """Returns a filter selecting column values that start with any of the
+    prefixes, as index range conditions rather than LIKE patterns."""
+    ranges = []
+    for p in sorted(prefixes):
+        succ = si.prefix_successor(p)
+        if succ is None:
+            ranges.append(column >= p)
+        else:
+            ranges.append(and_(column >= p, column < succ))
+    return or_(*ranges)
+
+
+def _candidates(conn, min_lat, min_lon, max_lat, max_lon, max_cells):
+    prefixes = si.covering_prefixes(
+        min_lat, min_lon, max_lat, max_lon, max_cells
+    )
+    stmt = select(
+        raw,
+        geometry.c.image_center_latitude,
+        geometry.c.image_center_longitude,
+    ).join(
+        geometry, geometry.c.raw_product_table_id == raw.c.id
+    ).where(
+        geohash_filter(geometry.c.image_center_geohash, prefixes),
+        geometry.c.image_center_latitude.between(min_lat, max_lat),
+    )
+    return conn.execute(stmt)
+
+
+def _in_lon_range(lon, min_lon, max_lon):
+    lon = si.normalize_longitude(lon)
+    min_lon, max_lon = si.longitude_range(min_lon, max_lon)
+    if min_lon <= max_lon:
+        return min_lon <= lon <= max_lon
+    return lon >= min_lon or lon <= max_lon
+
+
+def images_in_bbox(conn, min_lat, min_lon, max_lat, max_lon, max_cells=32):
+    """Returns the Raw_Products rows, with the image center latitude and
+    longitude, for images centered within a latitude/longitude box.
+
+    A box that crosses the antimeridian has min_lon greater than max_lon.
+    """
+    return [
+        row for row in _candidates(
+            conn, min_lat, min_lon, max_lat, max_lon, max_cells
+        )
+        if _in_lon_range(row.image_center_longitude, min_lon, max_lon)
+    ]
+
+
+def images_near(conn, lat, lon, radius_km, max_cells=32):
+    """Returns the Raw_Products rows, with the image center latitude and
+    longitude, for images centered within radius_km of a point, nearest
+    first."""
+    bounds = si.radius_bounds(lat, lon, radius_km)
+    found = []
+    for row in _candidates(conn, *bounds, max_cells):
+        d = si.surface_distance(
+            lat, lon, row.image_center_latitude, row.image_center_longitude
+        )
+        if d <= radius_km:
+            found.append((d, row))
+    found.sort(key=lambda x: x[0])
+    return [row for d, row in found]
+
+
+def add_geohash_column(engine):
+    """Adds the image_center_geohash column and its index to an
+    Observation_Geometries table made before they existed. A table that
+    has them is left alone, so this is safe to run more than once.
+
+    Returns whether the column was added.
+    """
+    cols = {c["name"] for c in inspect(engine).get_columns(geometry.name)}
+    column = geometry.c.image_center_geohash
+    added = column.name not in cols
+    with engine.begin() as conn:
+        if added:
+            prep = conn.dialect.identifier_preparer
+            conn.exec_driver_sql(
+                f"ALTER TABLE {prep.format_table(geometry)} "
+                f"ADD COLUMN {prep.quote(column.name)} "
+                f"{column.type.compile(conn.dialect)}"
+            )
+            logger.info(f"Added {column.name} to {geometry.name}.")
+        for index in geometry.indexes:
+            if column.name in index.columns:
+                index.create(bind=conn, checkfirst=True)
+    return added
+
+
+def backfill_geohash(engine, batch_size=5000):
+    """Sets image_center_geohash on every row that does not have one,
+    adding the column first if it is missing.
+
+    Returns the number of rows updated.
+    """
+    add_geohash_column(engine)
+    update = geometry.update().where(
+        geometry.c.id == bindparam("row_id")
+    ).values(image_center_geohash=bindparam("geohash"))
+    total = 0
+    last_id = 0
+    while True:
+        with engine.begin() as conn:
+            rows = conn.execute(
+                select(
+                    geometry.c.id,
+                    geometry.c.image_center_latitude,
+                    geometry.c.image_center_longitude,
+                ).where(
+                    geometry.c.image_center_geohash.is_(None),
+                    geometry.c.id > last_id,
+                ).order_by(geometry.c.id).limit(batch_size)
+            ).all()
+            if not rows:
+                break
+            conn.execute(update, [
+                {"row_id": r.id, "geohash": si.geohash_encode(
+                    r.image_center_latitude, r.image_center_longitude
+                )}
+                for r in rows
+            ])
+        total += len(rows)
+        last_id = rows[-1].id
+        logger.info(f"Backfilled {total} geohashes.")
+    return total
+
+
+if __name__ == "__main__":
+    args = arg_parser().parse_args()
+    util.set_logger(args.verbose)
+
+    Base, engine, db = new_db(args.config)
+
+    if args.backfill:
+        print(f"Backfilled {backfill_geohash(engine)} rows.")
+
+    with engine.connect() as conn:
+        if args.point:
+            for row in images_near(conn, *args.point):
+                print(row.product_id, row.image_center_latitude,
+                      row.image_center_longitude)
+
+        if args.bbox:
+            for row in images_in_bbox(conn, *args.bbox):
+                print(row.product_id, row.image_center_latitude,
+                      row.image_center_longitude)
@@ -0,0 +1,299 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+""" Computes observation geometry for many images at once and writes it
+to the Observation_Geometries table.
+
+All of the angles are computed with NumPy over whole arrays of images,
+and each batch is written with a single bulk insert, so backfilling the
+geometry for a mission phase costs a few array operations and one insert
+per batch rather than trigonometry and a round trip per row.
+
+Vectors are in a Moon-centered, Moon-fixed frame in km. The Sun position
+for each image comes from the caller (e.g. from SPICE), since this
+module carries no ephemeris.
+"""
+
+# Copyright 2022, United States Government as represented by the
+# Administrator of the National Aeronautics and Space Administration.
+# All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+# Reuse is permitted under the terms of the license.
+# The AUTHORS file and the LICENSE file are at the
+# top level of this library.
+
+import argparse
+import logging
+from pathlib import Path
+import time
+import numpy as np
+
+import sys
+import os
+sys.path.insert(1, os.path.join(sys.path[0],'../../../../vipersci/src'))
+from vipersci import util
+
+from bulk_ingest import insert_rows
+from db_utility import new_db
+import spatial_index as si
+import table_raw_observation_geometry as tog
+
+logger = logging.getLogger(__name__)
+
+geometry_table = tog.Observation_Geometry.__table__
+
+"""The arrays that must be in an input .npz file. Vectors are (n, 3)."""
+npz_arrays = (
+    "raw_product_table_id", "position", "boresight", "sun_position",
+    "north_azimuth", "solar_longitude", "local_time",
+)
+
+
+def arg_parser():
+    parser = argparse.ArgumentParser(
+            description=__doc__,
+            formatter_class=argparse.RawDescriptionHelpFormatter,
+            parents=[util.parent_parser()]
+    )
+    parser.add_argument(
+            "-c", "--config",
+            type=Path,
+            required=True,
+            help="Path to database configuration file."
+    )
+    parser.add_argument(
+            "-b", "--batch-size",
+            type=int,
+            default=10000,
+            help="Number of rows written by each insert."
+    )
+    parser.add_argument(
+            "--software-version",
+            required=True,
+            help="Version recorded in the software_version column."
+    )
+    parser.add_argument(
+            "npz",
+            type=Path,
+            nargs="+",
+            help="NumPy .npz files, each with these arrays: " +
+                 ", ".join(npz_arrays) + ". local_time is datetime64."
+    )
+    return parser
+
+
+def _unit(v):
+    return v / np.linalg.norm(v, axis=-1, keepdims=True)
+
+
+def _angle(u, v):
+    """Angle in degrees between rows of two arrays of unit vectors."""
+    return np.degrees(np.arccos(np.clip(np.sum(u * v, axis=-1), -1.0, 1.0)))
+
+
+def _lat_lon(v):
+    """Planetocentric latitude and east longitude in degrees of vectors."""
+    lat = np.degrees(np.arcsin(np.clip(_unit(v)[:, 2], -1.0, 1.0)))
+    lon = np.degrees(np.arctan2(v[:, 1], v[:, 0]))
+    return lat, lon
+
+
+def surface_intercepts(positions, boresights, body_radius_km=si.moon_radius_km):
+    """Returns where each camera boresight meets the surface sphere.
+
+    Rows whose boresight misses the surface (e.g. pointed above the
+    horizon) are NaN.
+    """
+    p = np.asarray(positions, dtype=float)
+    d = _unit(np.asarray(boresights, dtype=float))
+    b = np.sum(p * d, axis=-1)
+    c = np.sum(p * p, axis=-1) - body_radius_km ** 2
+    disc = b * b - c
+    with np.errstate(invalid="ignore"):
+        # The nearer of the two intersections, or the exit point if the
+        # camera is (numerically) just below the sphere.
+        t = -b - np.sqrt(disc)
+        t = np.where(t < 0, -b + np.sqrt(disc), t)
+    t = np.where((disc < 0) | (t < 0), np.nan, t)
+    return p + t[:, None] * d
+
+
+def azimuth(lat1, lon1, lat2, lon2):
+    """Initial great-circle bearing in degrees, clockwise from north, from
+    the first points to the second."""
+    p1, p2 = np.radians(lat1), np.radians(lat2)
+    dl = np.radians(lon2 - lon1)
+    y = np.sin(dl) * np.cos(p2)
+    x = np.cos(p1) * np.sin(p2) - np.sin(p1) * np.cos(p2) * np.cos(dl)
+    return np.degrees(np.arctan2(y, x)) % 360.0
+
+
+def illumination_geometry(
+    positions, boresights, sun_positions, body_radius_km=si.moon_radius_km
+):
+    """Computes the illumination geometry of a batch of images.
+
+    positions are the camera positions, boresights the camera pointing
+    vectors, and sun_positions the Sun positions at each image time, all
+    (n, 3) arrays. Returns a dict of (n,) arrays keyed by
+    Observation_Geometries column name: the image center latitude and
+    longitude; the incidence, emission, and phase angles at the image
+    center; the sub-solar latitude, longitude, and azimuth (the direction
+    of the sub-solar point from the image center); and the solar distance
+    from the Moon's center in km. Angles are in degrees.
+    """
+    p = np.asarray(positions, dtype=float)
+    sun = np.asarray(sun_positions, dtype=float)
+    s = surface_intercepts(p, boresights, body_radius_km)
+
+    normal = _unit(s)
+    to_sun = _unit(sun - s)
+    to_camera = _unit(p - s)
+
+    center_lat, center_lon = _lat_lon(s)
+    sub_lat, sub_lon = _lat_lon(sun)
+
+    return {
+        "image_center_latitude": center_lat,
+        "image_center_longitude": center_lon,
+        "incidence_angle": _angle(normal, to_sun),
+        "emission_angle": _angle(normal, to_camera),
+        "phase_angle": _angle(to_sun, to_camera),
+        "sub_solar_latitude": sub_lat,
+        "sub_solar_longitude": sub_lon,
+        "sub_solar_azimuth": azimuth(center_lat, center_lon, sub_lat, sub_lon),
+        "solar_distance": np.linalg.norm(sun, axis=-1),
+    }
+
+
+def geohash_array(lat, lon, precision=si.default_precision):
+    """Returns the geohashes of arrays of latitudes and longitudes.
+
+    This gives the same strings as spatial_index.geohash_encode(), but
+    interleaves the bits for the whole array at once.
+    """
+    lon_bits = (5 * precision + 1) // 2
+    lat_bits = (5 * precision) // 2
+    lat = np.asarray(lat, dtype=float)
+    lon = (np.asarray(lon, dtype=float) + 180.0) % 360.0
+    lat_i = np.clip(
+        np.floor((lat + 90.0) / 180.0 * 2 ** lat_bits), 0, 2 ** lat_bits - 1
+    ).astype(np.int64)
+    lon_i = np.clip(
+        np.floor(lon / 360.0 * 2 ** lon_bits), 0, 2 ** lon_bits - 1
+    ).astype(np.int64)
+
+    code = np.zeros(lat.shape, dtype=np.int64)
+    for i in range(5 * precision):
+        # Bits alternate longitude, latitude, ..., most significant first.
+        if i % 2 == 0:
+            bit = (lon_i >> (lon_bits - 1 - i // 2)) & 1
+        else:
+            bit = (lat_i >> (lat_bits - 1 - i // 2)) & 1
+        code = (code << 1) | bit
+
+    alphabet = np.array(list(si.base32))
+    chars = np.stack([
+        alphabet[(code >> (5 * (precision - 1 - k))) & 31]
+        for k in range(precision)
+    ], axis=-1)
+    return ["".join(c) for c in chars]
+
+
+def geometry_rows(
+    raw_product_table_ids, positions, boresights, sun_positions,
+    north_azimuths, solar_longitudes, local_times, software_version
+):
+    """Returns Observation_Geometries rows for a batch of images.
+
+    Images whose boresight misses the surface have no image center, and
+    are left out with a warning.
+    """
+    geom = illumination_geometry(positions, boresights, sun_positions)
+    ok = np.isfinite(geom["image_center_latitude"])
+    if not ok.all():
+        logger.warning(
+            f"{np.count_nonzero(~ok)} images do not intersect the surface "
+            "and were skipped."
+        )
+    geom["image_center_geohash"] = np.array(
+        geohash_array(
+            geom["image_center_latitude"][ok],
+            geom["image_center_longitude"][ok]
+        ), dtype=object
+    )
+    columns = {k: v[ok] for k, v in geom.items() if k != "image_center_geohash"}
+    columns["image_center_geohash"] = geom["image_center_geohash"]
+    columns["raw_product_table_id"] = np.asarray(raw_product_table_ids)[ok]
+    columns["north_azimuth"] = np.asarray(north_azimuths, dtype=float)[ok]
+    columns["solar_longitude"] = np.asarray(solar_longitudes, dtype=float)[ok]
+    local_times = np.asarray(local_times)
+    if np.issubdtype(local_times.dtype, np.datetime64):
+        # Only datetime64[us] values become datetimes in tolist(); finer
+        # units become ints, and coarser ones dates.
+        local_times = local_times.astype("datetime64[us]")
+    columns["local_time"] = local_times[ok]
+
+    # tolist() turns NumPy scalars into the Python types the drivers expect.
+    lists = {k: v.tolist() for k, v in columns.items()}
+    n = int(np.count_nonzero(ok))
+    return [
+        dict(
+            {k: lists[k][i] for k in lists},
+            software_version=software_version
+        )
+        for i in range(n)
+    ]
+
+
+def write_geometry(engine, arrays, software_version, batch_size=10000):
+    """Computes and inserts the geometry for arrays of images.
+
+    arrays is a mapping with the npz_arrays keys. Each batch_size slice is
+    computed in one vectorized pass and written with one insert, all in a
+    single transaction. Returns the number of rows written.
+    """
+    n = len(arrays["raw_product_table_id"])
+    written = 0
+    start = time.perf_counter()
+    with engine.begin() as conn:
+        for lo in range(0, n, batch_size):
+            hi = min(lo + batch_size, n)
+            rows = geometry_rows(
+                *[arrays[k][lo:hi] for k in npz_arrays], software_version
+            )
+            if rows:
+                insert_rows(conn, rows, table=geometry_table)
+            written += len(rows)
+    logger.info(
+        f"Wrote {written} geometry rows in {time.perf_counter() - start:.2f} s"
+    )
+    return written
+
+
+if __name__ == "__main__":
+    args = arg_parser().parse_args()
+    util.set_logger(args.verbose)
+
+    Base, engine, db = new_db(args.config)
+
+    for path in args.npz:
+        with np.load(path) as data:
+            arrays = {k: data[k] for k in npz_arrays}
+        print(path, write_geometry(
+            engine, arrays, args.software_version, args.batch_size
+        ))
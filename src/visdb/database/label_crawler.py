@@ -0,0 +1,549 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+""" Crawls a product tree for PDS4 labels and loads them into Raw_Products.
+
+The labels are parsed in a pool of worker processes with a streaming XML
+parser, and each one becomes the keyword arguments of a Raw_Product. The
+rows are passed through a bounded queue to a single writer, which upserts
+them in batches, so the parsers never wait on the database until the
+queue is full, and the crawl slows down rather than filling memory when
+the database falls behind.
+
+With --checkpoint, the position of the crawl is saved after every commit,
+and a later run with the same checkpoint file picks up where the last one
+stopped. Labels that cannot be loaded are listed, with the reason, in the
+--errors file, or logged.
+
+Only raw Product_Observational labels are loaded; other XML files in the
+tree (collection labels, or labels of other product types) are counted as
+ignored.
+"""
+
+# Copyright 2022, United States Government as represented by the
+# Administrator of the National Aeronautics and Space Administration.
+# All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+# Reuse is permitted under the terms of the license.
+# The AUTHORS file and the LICENSE file are at the
+# top level of this library.
+
+import argparse
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from dataclasses import dataclass
+import datetime
+import json
+import logging
+import multiprocessing
+from pathlib import Path
+import queue
+import threading
+import time
+import xml.etree.ElementTree as ET
+from sqlalchemy import DateTime, Float, Integer
+
+import sys
+import os
+sys.path.insert(1, os.path.join(sys.path[0],'../../../../vipersci/src'))
+from vipersci import util
+
+from bulk_ingest import (
+    batched, raw_product_row, raw_table, track_rollups,
+    update_rollups_before_commit, upsert_rows
+)
+from db_utility import new_db
+from partitions import create_raw_products, config_interval
+import rollups
+import table_raw_products as tb
+
+logger = logging.getLogger(__name__)
+
+"""Label elements that map directly onto Raw_Product fields, keyed by the
+local name (without namespace) of the element, or by the local names of
+its parent and itself where the name alone is ambiguous. These follow
+the VIPER VIS raw product label. The first occurrence of each is used,
+converted to the type of the Raw_Products column."""
+label_fields = {
+    ("Identification_Area", "logical_identifier"): "observation_lid",
+    "stop_date_time": "stop_time",
+    "purpose": "purpose",
+    "exposure_duration": "exposure_time",
+    "exposure_type": "exposure_type",
+    "bad_pixel_replacement_table_id": "bad_pixel_table_id",
+    "onboard_compression_type": "compression_type",
+    "temperature_value": "instrument_temperature",
+    "mission_phase_name": "mission_phase",
+    ("Software", "name"): "software_name",
+    "software_version_id": "software_version",
+    "software_type": "software_type",
+    ("Software_Program", "name"): "software_program_name",
+    ("File", "file_name"): "source_file_name",
+    ("File", "creation_date_time"): "file_creation_datetime",
+    "md5_checksum": "file_checksum",
+}
+
+"""The Raw_Product attributes for the lights, which are the
+LED_Illumination_Source names with underscores for spaces and an _On
+suffix. A light that is not in a label was off."""
+light_columns = list(tb.lights)
+
+"""The units that valued label elements must be given in."""
+label_units = {
+    "exposure_duration": "microseconds",
+    "temperature_value": "K",
+}
+
+"""Observing_System_Component types that identify the spacecraft."""
+host_types = ("Host", "Spacecraft")
+
+"""Bits per pixel of the PDS4 Element_Array data types."""
+pixel_bits = {
+    "UnsignedByte": 8, "SignedByte": 8,
+    "UnsignedMSB2": 16, "UnsignedLSB2": 16,
+    "SignedMSB2": 16, "SignedLSB2": 16,
+    "UnsignedMSB4": 32, "UnsignedLSB4": 32,
+    "SignedMSB4": 32, "SignedLSB4": 32,
+    "IEEE754MSBSingle": 32, "IEEE754LSBSingle": 32,
+}
+
+"""Each task sent to a worker process is a group of this many labels."""
+task_labels = 64
+
+"""The writer's queue holds at most this many parsed groups per worker;
+when it is full, no more labels are handed out until the writer catches
+up."""
+queue_groups = 2
+
+
+def arg_parser():
+    parser = argparse.ArgumentParser(
+            description=__doc__,
+            formatter_class=argparse.RawDescriptionHelpFormatter,
+            parents=[util.parent_parser()]
+    )
+    parser.add_argument(
+            "-c", "--config",
+            type=Path,
+            required=True,
+            help="Path to database configuration file."
+    )
+    parser.add_argument(
+            "-j", "--jobs",
+            type=int,
+            default=os.cpu_count(),
+            help="Number of label parsing processes (default: one per core)."
+    )
+    parser.add_argument(
+            "-b", "--batch-size",
+            type=int,
+            default=5000,
+            help="Number of rows written, and committed, at a time."
+    )
+    parser.add_argument(
+            "--checkpoint",
+            type=Path,
+            help="File that records how far the crawl has got. If it "
+                 "exists, the crawl resumes after that point."
+    )
+    parser.add_argument(
+            "--errors",
+            type=Path,
+            help="Tab-separated file of the labels that could not be "
+                 "loaded, and why."
+    )
+    parser.add_argument(
+            "root",
+            type=Path,
+            help="Directory at the top of the product tree."
+    )
+    return parser
+
+
+@dataclass
+class CrawlStats:
+    """Counts and timing from a crawl."""
+    labels: int = 0
+    ignored: int = 0
+    errors: int = 0
+    inserted: int = 0
+    updated: int = 0
+    unchanged: int = 0
+    commits: int = 0
+    seconds: float = 0.0
+
+    def __str__(self):
+        return (
+            f"{self.labels} labels in {self.seconds:.2f} s "
+            f"({self.labels / self.seconds if self.seconds else 0:.0f}/s): "
+            f"{self.inserted} inserted, {self.updated} updated, "
+            f"{self.unchanged} unchanged, {self.ignored} ignored, "
+            f"{self.errors} errors, in {self.commits} commits"
+        )
+
+
+def _local(tag):
+    return tag.rsplit("}", 1)[-1]
+
+
+def _convert(column, text):
+    kind = raw_table.c[column].type
+    if isinstance(kind, Integer):
+        return int(text)
+    if isinstance(kind, Float):
+        return float(text)
+    if isinstance(kind, DateTime):
+        dt = datetime.datetime.fromisoformat(text.replace("Z", "+00:00"))
+        if dt.tzinfo is not None:
+            dt = dt.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+        return dt
+    return text
+
+
+def parse_label(path):
+    """Returns the Raw_Product keyword arguments from a PDS4 label.
+
+    The label is read with iterparse() and each element is discarded once
+    it has been read, so a label is never held as a whole tree. Returns
+    None, having read no further than the identification, if the label
+    is not of a raw Product_Observational. The pathname is the directory
+    the label is in, where its data file is.
+    """
+    record = {"pathname": str(Path(path).parent)}
+    record.update(dict.fromkeys(light_columns, False))
+
+    stack = []
+    component = {}
+    axis = {}
+    light = {}
+    for event, elem in ET.iterparse(path, events=("start", "end")):
+        tag = _local(elem.tag)
+        if event == "start":
+            if not stack and tag != "Product_Observational":
+                return None
+            stack.append(tag)
+            continue
+
+        stack.pop()
+        parent = stack[-1] if stack else None
+        text = (elem.text or "").strip()
+
+        if tag in label_units and elem.get("unit") != label_units[tag]:
+            raise ValueError(
+                f"{tag} is in {elem.get('unit')}, not {label_units[tag]}."
+            )
+
+        column = label_fields.get((parent, tag), label_fields.get(tag))
+        if column is not None and text:
+            if column not in record:
+                record[column] = _convert(column, text)
+            if column == "observation_lid":
+                parts = text.split(":")
+                if len(parts) < 6 or parts[4] != "raw":
+                    return None
+                record["product_id"] = parts[5]
+        elif parent == "Internal_Reference" and tag == "lid_reference":
+            if "Observing_System_Component" in stack:
+                component["lid"] = text
+            elif "Investigation_Area" in stack:
+                record.setdefault("mission_lid", text)
+        elif parent == "Observing_System_Component" and tag == "type":
+            component["type"] = text
+        elif tag == "Observing_System_Component":
+            if component.get("type") in host_types and "lid" in component:
+                record.setdefault("sc_lid", component["lid"])
+            component = {}
+        elif parent == "Axis_Array" and tag in ("axis_name", "elements"):
+            axis[tag] = text
+        elif tag == "Axis_Array":
+            name = axis.get("axis_name", "").lower() + "s"
+            if name in ("lines", "samples"):
+                record.setdefault(name, int(axis["elements"]))
+            axis = {}
+        elif parent == "Element_Array" and tag == "data_type":
+            record.setdefault("pixel_bits", pixel_bits[text])
+        elif parent == "LED_Illumination_Source" and text:
+            light[tag] = text
+        elif tag == "LED_Illumination_Source":
+            name = light.get("name", "").replace(" ", "_") + "_On"
+            if name in light_columns:
+                record[name] = light.get("illumination_state") == "On"
+            light = {}
+
+        elem.clear()
+
+    return record
+
+
+def parse_labels(paths):
+    """Parses a group of labels, in a worker process.
+
+    Returns a list of Raw_Products rows, a list of (path, error message)
+    for the labels that could not be read or were incomplete, and the
+    number of labels that were ignored.
+    """
+    rows = []
+    errors = []
+    ignored = 0
+    for path in paths:
+        try:
+            record = parse_label(path)
+            if record is None:
+                ignored += 1
+            else:
+                rows.append(raw_product_row(record))
+        except Exception as err:
+            errors.append((str(path), f"{type(err).__name__}: {err}"))
+    return rows, errors, ignored
+
+
+def walk_labels(root, after=None, suffix=".xml"):
+    """Yields the paths of the label files under root, in sorted order.
+
+    The tree is walked depth first with the entries of each directory in
+    name order, so the order is that of the paths' parts relative to
+    root. If after is given, as such parts, only the labels after it are
+    yielded, and directories that lie wholly before it are not entered.
+    """
+    after = tuple(after or ())
+
+    def walk(directory, parts):
+        with os.scandir(directory) as it:
+            entries = sorted(it, key=lambda e: e.name)
+        for entry in entries:
+            p = parts + (entry.name,)
+            if entry.is_dir():
+                if p < after and after[:len(p)] != p:
+                    continue
+                yield from walk(entry.path, p)
+            elif entry.name.endswith(suffix) and p > after:
+                yield Path(entry.path)
+
+    yield from walk(root, ())
+
+
+def read_checkpoint(path, root):
+    """Returns the relative parts of the last label a checkpoint recorded,
+    or None if there is no checkpoint."""
+    if path is None or not path.exists():
+        return None
+    with open(path) as f:
+        checkpoint = json.load(f)
+    if checkpoint["root"] != str(root):
+        raise ValueError(
+            f"The checkpoint {path} is for {checkpoint['root']}, not {root}."
+        )
+    return checkpoint["last"]
+
+
+def write_checkpoint(path, root, last):
+    """Records that every label up to and including last has been loaded.
+
+    The file is replaced atomically, so an interrupted write leaves the
+    previous checkpoint.
+    """
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "w") as f:
+        json.dump(
+            {"root": str(root), "last": list(last.relative_to(root).parts)},
+            f
+        )
+    os.replace(tmp, path)
+
+
+class LabelWriter(threading.Thread):
+    """The single database writer for a crawl.
+
+    Parsed groups are put() on a bounded queue, in any order, each with a
+    sequence number and the last label path of the group. Every
+    batch_size rows are upserted, the rollups updated, and the
+    transaction committed; then the errors of the committed
+    groups are reported, and the checkpoint is moved to the end of the
+    longest run of groups, from the first, that are all committed.
+    A group that is written again after a crash is an unchanged upsert.
+    """
+
+    def __init__(
+        self, engine, root, stats, batch_size=5000, maxsize=8,
+        checkpoint=None, report=None
+    ):
+        super().__init__(name="LabelWriter", daemon=True)
+        self.engine = engine
+        self.root = root
+        self.stats = stats
+        self.batch_size = batch_size
+        self.checkpoint = checkpoint
+        self.report = report
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.error = None
+
+        self._rows = []
+        self._groups = []
+        self._next = 0
+        self._done = {}
+        rollups.summary.create(bind=engine, checkfirst=True)
+
+    def put(self, seq, last, rows, errors, ignored):
+        """Queues a parsed group, blocking while the queue is full."""
+        item = (seq, last, rows, errors, ignored)
+        while True:
+            if self.error is not None:
+                raise RuntimeError("The label writer failed.") from self.error
+            try:
+                self.queue.put(item, timeout=1)
+                return
+            except queue.Full:
+                continue
+
+    def close(self):
+        """Writes what is left, and waits for the writer to finish."""
+        self.put(None, None, None, None, None)
+        self.join()
+        if self.error is not None:
+            raise RuntimeError("The label writer failed.") from self.error
+
+    def run(self):
+        try:
+            while True:
+                seq, last, rows, errors, ignored = self.queue.get()
+                if seq is None:
+                    break
+                self._rows.extend(rows)
+                self._groups.append((seq, last, errors, ignored))
+                if len(self._rows) >= self.batch_size:
+                    self._flush()
+            self._flush()
+        except Exception as err:
+            self.error = err
+            # Drain the queue, so that put() sees the error.
+            while True:
+                try:
+                    self.queue.get_nowait()
+                except queue.Empty:
+                    break
+
+    def _flush(self):
+        if self._rows:
+            totals, days = {}, set()
+            with self.engine.begin() as conn:
+                for batch in batched(self._rows, self.batch_size):
+                    counts = upsert_rows(conn, batch)
+                    self.stats.inserted += counts[0]
+                    self.stats.updated += counts[1]
+                    self.stats.unchanged += counts[2]
+                    track_rollups(batch, counts, totals, days)
+                update_rollups_before_commit(conn, totals, days)
+            self.stats.commits += 1
+        self._rows = []
+
+        for seq, last, errors, ignored in self._groups:
+            self.stats.ignored += ignored
+            self.stats.errors += len(errors)
+            for path, message in errors:
+                if self.report is None:
+                    logger.warning(f"{path}: {message}")
+                else:
+                    self.report.write(f"{path}\t{message}\n")
+            self._done[seq] = last
+        self._groups = []
+        if self.report is not None:
+            self.report.flush()
+
+        last = None
+        while self._next in self._done:
+            last = self._done.pop(self._next)
+            self._next += 1
+        if last is not None and self.checkpoint is not None:
+            write_checkpoint(self.checkpoint, self.root, last)
+        logger.info(str(self.stats))
+
+
+def crawl_labels(
+    engine, root, jobs=None, batch_size=5000, checkpoint=None, report=None
+):
+    """Loads every raw product label under root into Raw_Products.
+
+    Groups of task_labels labels are parsed by jobs worker processes.
+    At most two groups per worker are being parsed at once, and the
+    parsed groups wait in a queue of at most queue_groups per worker for
+    the LabelWriter, so a slow database holds back the crawl instead of
+    letting parsed rows pile up in memory.
+
+    If checkpoint is a path, the crawl starts after the label recorded
+    there, and records its own progress there. Labels that fail are
+    written as tab-separated path and message lines to report, if given,
+    or logged. Returns a CrawlStats.
+    """
+    jobs = jobs or os.cpu_count()
+    root = Path(root)
+    stats = CrawlStats()
+    start = time.perf_counter()
+
+    after = read_checkpoint(checkpoint, root)
+    if after is not None:
+        logger.info(f"Resuming after {Path(*after)}")
+
+    writer = LabelWriter(
+        engine, root, stats, batch_size, queue_groups * jobs, checkpoint,
+        report
+    )
+    writer.start()
+
+    def finish(done):
+        for future in done:
+            seq, last = pending.pop(future)
+            writer.put(seq, last, *future.result())
+
+    # The workers are started fresh rather than forked, so that they never
+    # share the parent's pooled database connections.
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=jobs, mp_context=context) as pool:
+        pending = {}
+        groups = batched(walk_labels(root, after), task_labels)
+        for seq, group in enumerate(groups):
+            if len(pending) >= 2 * jobs:
+                finish(wait(pending, return_when=FIRST_COMPLETED).done)
+            pending[pool.submit(parse_labels, group)] = (seq, group[-1])
+            stats.labels += len(group)
+        while pending:
+            finish(wait(pending, return_when=FIRST_COMPLETED).done)
+    writer.close()
+
+    stats.seconds = time.perf_counter() - start
+    logger.info(str(stats))
+    return stats
+
+
+if __name__ == "__main__":
+    args = arg_parser().parse_args()
+    util.set_logger(args.verbose)
+
+    Base, engine, db = new_db(args.config)
+    create_raw_products(engine, config_interval(db))
+
+    report = None
+    if args.errors is not None:
+        resuming = args.checkpoint is not None and args.checkpoint.exists()
+        report = open(args.errors, "a" if resuming else "w")
+    try:
+        stats = crawl_labels(
+            engine, args.root, args.jobs, args.batch_size, args.checkpoint,
+            report
+        )
+    finally:
+        if report is not None:
+            report.close()
+    print(stats)
@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+""" Queries and migration for the Raw_Products lighting bitmask.
+
+The states of the eight NavLights and HazLights are kept in the one
+small integer lighting column, a bit per light, which is indexed, rather
+than in eight Boolean columns. lights_on() builds the filters for frames
+taken with some, or all, of a set of lights on.
+
+Run as a program, this migrates a database whose Raw_Products still has
+the Boolean columns: the lighting column is added and filled from them,
+the index is built, and the Boolean columns are dropped. With
+--keep-columns they are kept for older readers instead, defaulting to
+false, since nothing writes them any more. Migrate before partitioning
+Raw_Products with partitions.py --migrate.
+"""
+
+# Copyright 2022, United States Government as represented by the
+# Administrator of the National Aeronautics and Space Administration.
+# All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+# Reuse is permitted under the terms of the license.
+# The AUTHORS file and the LICENSE file are at the
+# top level of this library.
+
+import argparse
+import logging
+from pathlib import Path
+from sqlalchemy import case, column, inspect, update
+
+import sys
+import os
+sys.path.insert(1, os.path.join(sys.path[0],'../../../../vipersci/src'))
+from vipersci import util
+
+from db_utility import new_db
+import table_raw_products as tb
+
+logger = logging.getLogger(__name__)
+
+raw = tb.Raw_Product.__table__
+
+
+def arg_parser():
+    parser = argparse.ArgumentParser(
+            description=__doc__,
+            formatter_class=argparse.RawDescriptionHelpFormatter,
+            parents=[util.parent_parser()]
+    )
+    parser.add_argument(
+            "-c", "--config",
+            type=Path,
+            required=True,
+            help="Path to database configuration file."
+    )
+    parser.add_argument(
+            "--keep-columns",
+            action='store_true',
+            help="Do not drop the Boolean light columns after migrating them."
+    )
+    return parser
+
+
+def lights_on(*names, all_on=False):
+    """Returns a Raw_Product filter for any of the named lights being on,
+    or, if all_on, all of them. The names are those of tb.lights; with
+    none, any light at all."""
+    mask = sum(tb.light_bits[n] for n in names) if names else tb.all_lights
+    return tb.lighting_filter(tb.Raw_Product.lighting, mask, all_on)
+
+
+def _default_false(conn, name):
+    # Gives a kept Boolean light column a default of false, so that the
+    # inserts, which no longer write it, do not fail its NOT NULL.
+    prep = conn.dialect.identifier_preparer
+    table = prep.format_table(raw)
+    quoted = prep.quote(name)
+    if conn.dialect.name == "sqlite":
+        # SQLite cannot alter a column, so it is replaced by a copy.
+        old = prep.quote(f"{name}_old")
+        conn.exec_driver_sql(
+            f"ALTER TABLE {table} RENAME COLUMN {quoted} TO {old}"
+        )
+        conn.exec_driver_sql(
+            f"ALTER TABLE {table} ADD COLUMN {quoted} BOOLEAN NOT NULL "
+            f"DEFAULT 0"
+        )
+        conn.exec_driver_sql(f"UPDATE {table} SET {quoted} = {old}")
+        conn.exec_driver_sql(f"ALTER TABLE {table} DROP COLUMN {old}")
+    else:
+        conn.exec_driver_sql(
+            f"ALTER TABLE {table} ALTER COLUMN {quoted} SET DEFAULT false"
+        )
+
+
+def migrate_lighting(engine, drop_columns=True):
+    """Fills the lighting column from the old Boolean light columns.
+
+    The lighting column and its index are created if they are missing,
+    and the Boolean columns are dropped afterwards unless drop_columns is
+    False, in which case they are given a default of false, for the rows
+    inserted from then on. A table that no longer has the Boolean
+    columns is left alone, and one whose lighting column was filled by
+    an earlier run is not filled again, so this is safe to run more than
+    once. It all happens in a single transaction, and the fill is a
+    single UPDATE of every row.
+
+    Returns the number of rows filled.
+    """
+    cols = {c["name"]: c for c in inspect(engine).get_columns(raw.name)}
+    old = [n for n in tb.lights if n in cols]
+    if not old:
+        logger.info(f"{raw.name} has no Boolean light columns, skipping.")
+        return 0
+
+    n = 0
+    with engine.begin() as conn:
+        prep = conn.dialect.identifier_preparer
+        table = prep.format_table(raw)
+        if "lighting" not in cols:
+            lighting = raw.c.lighting
+            conn.exec_driver_sql(
+                f"ALTER TABLE {table} ADD COLUMN {prep.quote(lighting.name)} "
+                f"{lighting.type.compile(conn.dialect)} NOT NULL DEFAULT 0"
+            )
+            n = conn.execute(update(raw).values(lighting=sum(
+                case((column(name), tb.light_bits[name]), else_=0)
+                for name in old
+            ))).rowcount
+        for index in raw.indexes:
+            if "lighting" in index.columns:
+                index.create(bind=conn, checkfirst=True)
+
+        for name in old:
+            if drop_columns:
+                conn.exec_driver_sql(
+                    f"ALTER TABLE {table} DROP COLUMN {prep.quote(name)}"
+                )
+            elif cols[name]["default"] is None:
+                _default_false(conn, name)
+    logger.info(f"Packed the lights of {n} {raw.name} rows into lighting.")
+    return n
+
+
+if __name__ == "__main__":
+    args = arg_parser().parse_args()
+    util.set_logger(args.verbose)
+
+    Base, engine, db = new_db(args.config)
+    print(migrate_lighting(engine, drop_columns=not args.keep_columns))
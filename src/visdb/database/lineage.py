@@ -0,0 +1,359 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+""" Resolves the provenance lineage of VIS products.
+
+The product tables form a processing chain: Raw_Products feed
+Calibrated_Products, which feed Undistorted_Products, which feed
+Rectified_Products and Anaglyph_Products, and Rectified_Products feed the
+mosaic, panorama, and hazard map products. Every direct link is an edge,
+and the Product_Lineage closure table holds every (ancestor, descendant)
+pair, so the full upstream or downstream set of any product is one
+indexed query. The closure is kept up to date with record_product() as
+derived products are created, and can be rebuilt from the edges with a
+single recursive query.
+"""
+
+# Copyright 2022, United States Government as represented by the
+# Administrator of the National Aeronautics and Space Administration.
+# All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+# Reuse is permitted under the terms of the license.
+# The AUTHORS file and the LICENSE file are at the
+# top level of this library.
+
+import argparse
+from collections import namedtuple
+import logging
+from pathlib import Path
+from sqlalchemy import Integer, String, func, insert, literal, select, true
+from sqlalchemy import union_all
+from sqlalchemy.dialects import postgresql, sqlite
+
+import sys
+import os
+sys.path.insert(1, os.path.join(sys.path[0],'../../../../vipersci/src'))
+from vipersci import util
+
+from db_utility import new_db
+import table_anaglyph_products as anaglyph
+import table_calibrated_products as calibrated
+import table_hazard_rectified_map as hazard
+import table_mosaic_rectified_map as mosaic
+import table_panorama_rectified_map as panorama
+import table_product_lineage as tpl
+import table_rectified_products as rectified
+import table_undistorted_products as undistorted
+
+logger = logging.getLogger(__name__)
+
+closure = tpl.Product_Lineage.__table__
+
+Relative = namedtuple("Relative", ["product_type", "product_id", "depth"])
+Edge = namedtuple(
+    "Edge",
+    ["parent_type", "parent_id", "child_type", "child_id", "depth"]
+)
+
+"""Guards the recursive queries against cycles from bad data. The real
+chain is only a handful of steps long."""
+max_depth = 16
+
+
+def arg_parser():
+    parser = argparse.ArgumentParser(
+            description=__doc__,
+            formatter_class=argparse.RawDescriptionHelpFormatter,
+            parents=[util.parent_parser()]
+    )
+    parser.add_argument(
+            "-c", "--config",
+            type=Path,
+            required=True,
+            help="Path to database configuration file."
+    )
+    parser.add_argument(
+            "--rebuild",
+            action='store_true',
+            help="Rebuild the Product_Lineage closure table from scratch."
+    )
+    parser.add_argument(
+            "-u", "--upstream",
+            nargs=2,
+            metavar=("TABLE", "ID"),
+            help="Print every product that the given product derives from."
+    )
+    parser.add_argument(
+            "-d", "--downstream",
+            nargs=2,
+            metavar=("TABLE", "ID"),
+            help="Print every product derived from the given product."
+    )
+    return parser
+
+
+def _link(parent_type, parent_id, child_type, child_id, from_obj=None):
+    stmt = select(
+        literal(parent_type, String).label("parent_type"),
+        parent_id.label("parent_id"),
+        literal(child_type, String).label("child_type"),
+        child_id.label("child_id"),
+    ).where(parent_id.isnot(None))
+    if from_obj is not None:
+        stmt = stmt.select_from(from_obj)
+    return stmt
+
+
+def lineage_edges():
+    """Returns a subquery of every direct (parent, child) product link."""
+    cal = calibrated.Calibrated_Product.__table__
+    und = undistorted.Undistorted_Product.__table__
+    rect = rectified.Rectified_Product.__table__
+    ana = anaglyph.Anaglyph_Product.__table__
+
+    links = [
+        _link("Raw_Products", cal.c.raw_table_id, cal.name, cal.c.id),
+        _link(cal.name, und.c.cal_table_id, und.name, und.c.id),
+        _link(und.name, rect.c.undistorted_table_id, rect.name, rect.c.id),
+        _link(und.name, ana.c.left_undistored_table_id, ana.name, ana.c.id),
+        _link(und.name, ana.c.right_undistored_table_id, ana.name, ana.c.id),
+    ]
+    for product_type, map_table, assoc, fk in (
+        ("Mosaic_Products",
+         mosaic.Mosaic_Rectified_Map.__table__,
+         mosaic.mosaic_rectified_sources,
+         "mosaic_product_table_id"),
+        ("Hazard_Products",
+         hazard.Hazard_Rectified_Map.__table__,
+         hazard.hazard_rectified_sources,
+         "hazard_product_table_id"),
+        ("Panorama_Products",
+         panorama.Panorama_Rectified_Map.__table__,
+         panorama.panorama_rectified_sources,
+         "panorma_product_table_id"),
+    ):
+        links.append(_link(
+            rect.name, assoc.c.rectified_product_table_id,
+            product_type, map_table.c[fk],
+            from_obj=assoc.join(map_table, assoc.c.map_id == map_table.c.id)
+        ))
+    return union_all(*links).subquery("lineage_edges")
+
+
+def _insert_ignore(conn, table):
+    """An INSERT that skips rows which already exist, where supported."""
+    if conn.dialect.name == "postgresql":
+        return postgresql.insert(table).on_conflict_do_nothing()
+    if conn.dialect.name == "sqlite":
+        return sqlite.insert(table).on_conflict_do_nothing()
+    return insert(table)
+
+
+def link_products(conn, parent, child):
+    """Records that child is derived from parent in the closure table.
+
+    Both are (product_type, product_id) pairs. Every ancestor of parent
+    (and parent itself) becomes an ancestor of child and of every existing
+    descendant of child, in a single INSERT ... SELECT.
+    """
+    p_type, p_id = parent
+    c_type, c_id = child
+    anc = union_all(
+        select(
+            closure.c.ancestor_type.label("t"),
+            closure.c.ancestor_id.label("i"),
+            closure.c.depth.label("depth"),
+        ).where(
+            closure.c.descendant_type == p_type,
+            closure.c.descendant_id == p_id,
+        ),
+        select(
+            literal(p_type, String), literal(p_id, Integer), literal(0, Integer)
+        ),
+    ).subquery("anc")
+    desc = union_all(
+        select(
+            closure.c.descendant_type.label("t"),
+            closure.c.descendant_id.label("i"),
+            closure.c.depth.label("depth"),
+        ).where(
+            closure.c.ancestor_type == c_type,
+            closure.c.ancestor_id == c_id,
+        ),
+        select(
+            literal(c_type, String), literal(c_id, Integer), literal(0, Integer)
+        ),
+    ).subquery("desc")
+    pairs = select(
+        anc.c.t, anc.c.i, desc.c.t, desc.c.i,
+        anc.c.depth + desc.c.depth + 1
+    ).select_from(anc.join(desc, true()))
+    conn.execute(
+        _insert_ignore(conn, closure).from_select(
+            ["ancestor_type", "ancestor_id",
+             "descendant_type", "descendant_id", "depth"],
+            pairs
+        )
+    )
+
+
+def record_product(conn, product_type, product_id):
+    """Adds a newly created derived product to the closure table.
+
+    Its direct parents are read from the product tables, so call this once
+    the product row (and, for maps, its source rows) has been written.
+    """
+    edges = lineage_edges()
+    parents = conn.execute(
+        select(edges.c.parent_type, edges.c.parent_id).where(
+            edges.c.child_type == product_type,
+            edges.c.child_id == product_id,
+        )
+    ).all()
+    for parent in parents:
+        link_products(conn, tuple(parent), (product_type, product_id))
+    return len(parents)
+
+
+def rebuild_closure(engine):
+    """Replaces the closure table contents with a full recomputation.
+
+    The closure is computed by one recursive query over the edges, so this
+    is a single INSERT ... SELECT after the DELETE.
+    """
+    edges = lineage_edges()
+    base = select(
+        edges.c.parent_type.label("ancestor_type"),
+        edges.c.parent_id.label("ancestor_id"),
+        edges.c.child_type.label("descendant_type"),
+        edges.c.child_id.label("descendant_id"),
+        literal(1, Integer).label("depth"),
+    ).cte("pairs", recursive=True)
+    step = edges.alias("step")
+    pairs = base.union_all(
+        select(
+            base.c.ancestor_type, base.c.ancestor_id,
+            step.c.child_type, step.c.child_id,
+            base.c.depth + 1,
+        ).where(
+            step.c.parent_type == base.c.descendant_type,
+            step.c.parent_id == base.c.descendant_id,
+            base.c.depth < max_depth,
+        )
+    )
+    stmt = select(
+        pairs.c.ancestor_type, pairs.c.ancestor_id,
+        pairs.c.descendant_type, pairs.c.descendant_id,
+        func.min(pairs.c.depth),
+    ).group_by(
+        pairs.c.ancestor_type, pairs.c.ancestor_id,
+        pairs.c.descendant_type, pairs.c.descendant_id,
+    )
+
+    closure.create(bind=engine, checkfirst=True)
+    with engine.begin() as conn:
+        conn.execute(closure.delete())
+        conn.execute(
+            insert(closure).from_select(
+                ["ancestor_type", "ancestor_id",
+                 "descendant_type", "descendant_id", "depth"],
+                stmt
+            )
+        )
+        count = conn.execute(
+            select(func.count()).select_from(closure)
+        ).scalar()
+    logger.info(f"Rebuilt {closure.name} with {count} rows.")
+    return count
+
+
+def upstream(conn, product_type, product_id):
+    """Returns every product the given one derives from, nearest first."""
+    stmt = select(
+        closure.c.ancestor_type, closure.c.ancestor_id, closure.c.depth
+    ).where(
+        closure.c.descendant_type == product_type,
+        closure.c.descendant_id == product_id,
+    ).order_by(closure.c.depth, closure.c.ancestor_type, closure.c.ancestor_id)
+    return [Relative(*row) for row in conn.execute(stmt)]
+
+
+def downstream(conn, product_type, product_id):
+    """Returns every product derived from the given one, nearest first."""
+    stmt = select(
+        closure.c.descendant_type, closure.c.descendant_id, closure.c.depth
+    ).where(
+        closure.c.ancestor_type == product_type,
+        closure.c.ancestor_id == product_id,
+    ).order_by(
+        closure.c.depth, closure.c.descendant_type, closure.c.descendant_id
+    )
+    return [Relative(*row) for row in conn.execute(stmt)]
+
+
+def lineage_tree(conn, product_type, product_id, direction="downstream"):
+    """Returns the edges of a product's lineage tree from one recursive
+    query over the product tables, without using the closure table.
+
+    Each Edge carries its depth from the starting product, so the tree can
+    be rebuilt from the parent and child of each edge.
+    """
+    if direction == "downstream":
+        near, far = "parent", "child"
+    elif direction == "upstream":
+        near, far = "child", "parent"
+    else:
+        raise ValueError("direction must be 'downstream' or 'upstream'.")
+
+    edges = lineage_edges()
+    cols = [edges.c.parent_type, edges.c.parent_id,
+            edges.c.child_type, edges.c.child_id]
+    base = select(*cols, literal(1, Integer).label("depth")).where(
+        edges.c[f"{near}_type"] == product_type,
+        edges.c[f"{near}_id"] == product_id,
+    ).cte("tree", recursive=True)
+    step = edges.alias("step")
+    tree = base.union_all(
+        select(*[step.c[c.name] for c in cols], base.c.depth + 1).where(
+            step.c[f"{near}_type"] == base.c[f"{far}_type"],
+            step.c[f"{near}_id"] == base.c[f"{far}_id"],
+            base.c.depth < max_depth,
+        )
+    )
+    stmt = select(tree).order_by(tree.c.depth)
+    return [Edge(*row) for row in conn.execute(stmt)]
+
+
+if __name__ == "__main__":
+    args = arg_parser().parse_args()
+    util.set_logger(args.verbose)
+
+    Base, engine, db = new_db(args.config)
+
+    if args.rebuild:
+        print(f"{rebuild_closure(engine)} lineage rows.")
+
+    with engine.connect() as conn:
+        if args.upstream:
+            for r in upstream(conn, args.upstream[0], int(args.upstream[1])):
+                print(r.depth, r.product_type, r.product_id)
+
+        if args.downstream:
+            for r in downstream(
+                conn, args.downstream[0], int(args.downstream[1])
+            ):
+                print(r.depth, r.product_type, r.product_id)
@@ -0,0 +1,485 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+""" Range partitioning of the Raw_Products table on start_time.
+
+On PostgreSQL, Raw_Products is created as a partitioned table with one
+partition per interval of start_time (a month unless configured
+otherwise) and a default partition that catches anything outside them.
+Queries bounded by a time window then only touch the partitions that
+overlap it, and vacuum and index maintenance work on one partition at a
+time rather than on the whole mission.
+
+Run this regularly (e.g. daily from cron) to create the partitions for
+the next few intervals before data arrives for them, and to detach old
+ones. Rows that landed in the default partition are moved into their
+partition when it is created.
+
+The interval is read from a partition_interval key in the configuration
+file (in the x-visdb section of a docker-compose.yml), and may be a unit
+(day, week, month, quarter, or year) or a count and a unit, such as
+"2 weeks" or "6 months".
+
+Other databases get an ordinary Raw_Products table.
+"""
+
+# Copyright 2022, United States Government as represented by the
+# Administrator of the National Aeronautics and Space Administration.
+# All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+# Reuse is permitted under the terms of the license.
+# The AUTHORS file and the LICENSE file are at the
+# top level of this library.
+
+import argparse
+from collections import namedtuple
+import datetime
+import logging
+from pathlib import Path
+import re
+from sqlalchemy import Index, MetaData, PrimaryKeyConstraint, Table
+from sqlalchemy import text
+
+import sys
+import os
+sys.path.insert(1, os.path.join(sys.path[0],'../../../../vipersci/src'))
+from vipersci import util
+
+from db_utility import new_db
+import product_notify
+import table_raw_products as tb
+
+logger = logging.getLogger(__name__)
+
+raw = tb.Raw_Product.__table__
+default_partition = f"{raw.name}_default"
+default_interval = "month"
+
+"""How many intervals past the current one to keep partitions ready for."""
+default_ahead = 3
+
+Partition = namedtuple("Partition", ["name", "start", "stop"])
+
+"""Units are aligned to these, so that every run (and every deployment)
+cuts the same partition boundaries. The week anchor is a Monday."""
+_anchor_day = datetime.datetime(2000, 1, 1)
+_anchor_week = datetime.datetime(2000, 1, 3)
+
+_units = {
+    "day": ("day", 1),
+    "week": ("week", 1),
+    "month": ("month", 1),
+    "quarter": ("month", 3),
+    "year": ("month", 12),
+}
+_interval_re = re.compile(r"^\s*(\d+)?\s*([a-z]+?)s?\s*$")
+_bound_re = re.compile(
+    r"FOR VALUES FROM \('([^']+)'\) TO \('([^']+)'\)"
+)
+
+
+def arg_parser():
+    parser = argparse.ArgumentParser(
+            description=__doc__,
+            formatter_class=argparse.RawDescriptionHelpFormatter,
+            parents=[util.parent_parser()]
+    )
+    parser.add_argument(
+            "-c", "--config",
+            type=Path,
+            required=True,
+            help="Path to database configuration file."
+    )
+    parser.add_argument(
+            "-i", "--interval",
+            help="Partition interval, overriding the configuration file "
+                 f"(default: {default_interval})."
+    )
+    parser.add_argument(
+            "-a", "--ahead",
+            type=int,
+            default=default_ahead,
+            help="Number of future intervals to create partitions for."
+    )
+    parser.add_argument(
+            "--detach-before",
+            type=datetime.datetime.fromisoformat,
+            metavar="DATE",
+            help="Detach partitions that end on or before DATE."
+    )
+    parser.add_argument(
+            "--drop",
+            action='store_true',
+            help="Drop detached partitions rather than keeping them as "
+                 "standalone tables."
+    )
+    parser.add_argument(
+            "--migrate",
+            action='store_true',
+            help="Convert an existing unpartitioned Raw_Products table."
+    )
+    parser.add_argument(
+            "-l", "--list",
+            action='store_true',
+            help="List the partitions."
+    )
+    return parser
+
+
+def parse_interval(interval):
+    """Returns the (unit, count) of an interval such as 'month' or
+    '2 weeks', where unit is day, week, or month."""
+    match = _interval_re.match(interval.lower())
+    if match is None or match.group(2) not in _units:
+        raise ValueError(
+            f"Cannot understand the partition interval {interval!r}."
+        )
+    unit, count = _units[match.group(2)]
+    return unit, count * int(match.group(1) or 1)
+
+
+def config_interval(db):
+    """Returns the partition interval from a parsed configuration file."""
+    settings = db.get("x-visdb", {}) if "services" in db else db
+    return settings.get("partition_interval", default_interval)
+
+
+def floor_time(t, interval):
+    """Returns the start of the partition that contains t."""
+    unit, count = parse_interval(interval)
+    t = t.replace(tzinfo=None)
+    if unit == "month":
+        months = (t.year * 12 + t.month - 1) // count * count
+        return datetime.datetime(months // 12, months % 12 + 1, 1)
+    anchor, days = (
+        (_anchor_week, 7 * count) if unit == "week" else (_anchor_day, count)
+    )
+    n = (t - anchor).days // days
+    return anchor + datetime.timedelta(days=n * days)
+
+
+def add_interval(t, interval, n=1):
+    """Returns the partition boundary n intervals after the boundary t."""
+    unit, count = parse_interval(interval)
+    if unit == "month":
+        months = t.year * 12 + t.month - 1 + n * count
+        return datetime.datetime(months // 12, months % 12 + 1, 1)
+    days = 7 * count if unit == "week" else count
+    return t + datetime.timedelta(days=n * days)
+
+
+def partition_name(start):
+    return f"{raw.name}_p{start:%Y%m%d}"
+
+
+def partitioned_table(metadata=None):
+    """Returns the PostgreSQL definition of the partitioned Raw_Products.
+
+    It has the columns and indexes of the ORM table, but its primary key
+    also includes the partition key, as PostgreSQL requires. Since id is
+    unique on its own, the ORM goes on treating id as the primary key.
+    """
+    metadata = MetaData() if metadata is None else metadata
+    key = ("id", tb.Raw_Product.partition_key)
+    columns = [c._copy() for c in raw.columns]
+    for c in columns:
+        c.primary_key = c.name in key
+    table = Table(
+        raw.name, metadata,
+        *columns,
+        PrimaryKeyConstraint(*key),
+        postgresql_partition_by=f"RANGE ({tb.Raw_Product.partition_key})",
+    )
+    for index in raw.indexes:
+        Index(
+            index.name,
+            *[table.c[c.name] for c in index.columns],
+            unique=index.unique,
+            **index.kwargs
+        )
+    return table
+
+
+def is_partitioned(conn):
+    """Returns True if Raw_Products is a partitioned table."""
+    if conn.dialect.name != "postgresql":
+        return False
+    return conn.execute(
+        text(
+            "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table p "
+            "JOIN pg_class c ON c.oid = p.partrelid "
+            "WHERE c.oid = to_regclass(:name))"
+        ),
+        {"name": _quoted(conn, raw.name)}
+    ).scalar()
+
+
+def _quoted(conn, name):
+    return conn.dialect.identifier_preparer.quote(name)
+
+
+def list_partitions(conn):
+    """Returns the range partitions of Raw_Products in start order,
+    leaving out the default partition."""
+    rows = conn.execute(
+        text(
+            "SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) "
+            "FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = to_regclass(:name)"
+        ),
+        {"name": _quoted(conn, raw.name)}
+    )
+    parts = []
+    for name, bound in rows:
+        match = _bound_re.match(bound)
+        if match:
+            parts.append(Partition(
+                name,
+                datetime.datetime.fromisoformat(match.group(1)),
+                datetime.datetime.fromisoformat(match.group(2)),
+            ))
+    return sorted(parts, key=lambda p: p.start)
+
+
+def _data_columns():
+    """The columns that can be written, leaving out the generated ones."""
+    return [c.name for c in raw.columns if c.computed is None]
+
+
+def _add_partition(conn, start, stop):
+    """Creates the partition for [start, stop), first moving any rows in
+    that range out of the default partition."""
+    q = conn.dialect.identifier_preparer.quote
+    name = partition_name(start)
+    key = q(tb.Raw_Product.partition_key)
+    bounds = f"FROM ('{start.isoformat(' ')}') TO ('{stop.isoformat(' ')}')"
+    in_range = f"{key} >= :start AND {key} < :stop"
+    params = {"start": start, "stop": stop}
+
+    stray = conn.execute(
+        text(f"SELECT count(*) FROM {q(default_partition)} WHERE {in_range}"),
+        params
+    ).scalar()
+    if not stray:
+        conn.exec_driver_sql(
+            f"CREATE TABLE {q(name)} PARTITION OF {q(raw.name)} "
+            f"FOR VALUES {bounds}"
+        )
+        return name
+
+    # A partition cannot be created while the default partition holds
+    # rows that belong in it, so build it standalone, move the rows, and
+    # then attach it.
+    cols = ", ".join(q(c) for c in _data_columns())
+    conn.exec_driver_sql(
+        f"CREATE TABLE {q(name)} (LIKE {q(raw.name)} "
+        "INCLUDING DEFAULTS INCLUDING GENERATED)"
+    )
+    conn.execute(
+        text(
+            f"WITH moved AS (DELETE FROM {q(default_partition)} "
+            f"WHERE {in_range} RETURNING {cols}) "
+            f"INSERT INTO {q(name)} ({cols}) SELECT {cols} FROM moved"
+        ),
+        params
+    )
+    conn.exec_driver_sql(
+        f"ALTER TABLE {q(raw.name)} ATTACH PARTITION {q(name)} "
+        f"FOR VALUES {bounds}"
+    )
+    logger.info(f"Moved {stray} rows from {default_partition} into {name}.")
+    return name
+
+
+def ensure_partitions(engine, interval=default_interval, ahead=default_ahead):
+    """Creates any missing partitions up to ahead intervals past now.
+
+    Partitions start with the earliest start_time waiting in the default
+    partition, or the current interval if there is none. Existing
+    partitions are left alone, even if they were cut with a different
+    interval. Returns the names of the new partitions.
+    """
+    q = engine.dialect.identifier_preparer.quote
+    created = []
+    with engine.begin() as conn:
+        existing = list_partitions(conn)
+        earliest = conn.exec_driver_sql(
+            f"SELECT min({q(tb.Raw_Product.partition_key)}) "
+            f"FROM {q(default_partition)}"
+        ).scalar()
+        now = datetime.datetime.utcnow()
+        start = floor_time(min(filter(None, [earliest, now])), interval)
+        stop = add_interval(floor_time(now, interval), interval, ahead + 1)
+
+        while start < stop:
+            end = add_interval(start, interval)
+            if not any(p.start < end and start < p.stop for p in existing):
+                created.append(_add_partition(conn, start, end))
+            start = end
+
+    for name in created:
+        logger.info(f"Created partition {name}.")
+    return created
+
+
+def detach_partitions(engine, before, drop=False):
+    """Detaches the partitions that end on or before the given time.
+
+    The detached partitions become ordinary tables, which can be archived
+    and dropped separately, unless drop is True, in which case they are
+    dropped here. Returns their names.
+    """
+    q = engine.dialect.identifier_preparer.quote
+    before = before.replace(tzinfo=None)
+    detached = []
+    with engine.begin() as conn:
+        for p in list_partitions(conn):
+            if p.stop > before:
+                continue
+            conn.exec_driver_sql(
+                f"ALTER TABLE {q(raw.name)} DETACH PARTITION {q(p.name)}"
+            )
+            if drop:
+                conn.exec_driver_sql(f"DROP TABLE {q(p.name)}")
+            detached.append(p.name)
+            logger.info(f"{'Dropped' if drop else 'Detached'} {p.name}.")
+    return detached
+
+
+def create_raw_products(
+    engine, interval=default_interval, ahead=default_ahead
+):
+    """Creates the Raw_Products table if it does not exist.
+
+    On PostgreSQL it is the partitioned table, with its default partition
+    and partitions through ahead intervals from now, and the trigger
+    that notifies product_notify Subscribers of new rows. Elsewhere it is
+    the ordinary ORM table.
+    """
+    if engine.dialect.name != "postgresql":
+        raw.create(bind=engine, checkfirst=True)
+        return
+
+    q = engine.dialect.identifier_preparer.quote
+    with engine.begin() as conn:
+        if not engine.dialect.has_table(conn, raw.name):
+            partitioned_table().create(bind=conn)
+            conn.exec_driver_sql(
+                f"CREATE TABLE {q(default_partition)} "
+                f"PARTITION OF {q(raw.name)} DEFAULT"
+            )
+            logger.info(f"Created partitioned {raw.name}.")
+    with engine.connect() as conn:
+        partitioned = is_partitioned(conn)
+    if partitioned:
+        ensure_partitions(engine, interval, ahead)
+    product_notify.install_trigger(engine)
+
+
+def migrate_to_partitioned(
+    engine, interval=default_interval, ahead=default_ahead
+):
+    """Converts an existing ordinary Raw_Products table into a partitioned
+    one, in a single transaction.
+
+    The old table, its indexes, and its id sequence are renamed out of
+    the way, the partitioned table is created and filled, the id sequence
+    carries on from the old one, and the old table is dropped. Returns
+    the number of rows copied.
+    """
+    q = engine.dialect.identifier_preparer.quote
+    old = f"{raw.name}_unpartitioned"
+    cols = ", ".join(q(c) for c in _data_columns())
+    with engine.begin() as conn:
+        if is_partitioned(conn):
+            logger.info(f"{raw.name} is already partitioned.")
+            return 0
+
+        seq = conn.execute(
+            text("SELECT pg_get_serial_sequence(:t, 'id')"),
+            {"t": q(raw.name)}
+        ).scalar()
+        conn.exec_driver_sql(f"ALTER TABLE {q(raw.name)} RENAME TO {q(old)}")
+        for index in raw.indexes:
+            conn.exec_driver_sql(
+                f"ALTER INDEX IF EXISTS {q(index.name)} "
+                f"RENAME TO {q(index.name + '_unpartitioned')}"
+            )
+        conn.exec_driver_sql(
+            f"ALTER TABLE {q(old)} RENAME CONSTRAINT "
+            f"{q(raw.name + '_pkey')} TO {q(old + '_pkey')}"
+        )
+        if seq:
+            conn.exec_driver_sql(
+                f"ALTER SEQUENCE {seq} RENAME TO {q(old + '_id_seq')}"
+            )
+
+        partitioned_table().create(bind=conn)
+        conn.exec_driver_sql(
+            f"CREATE TABLE {q(default_partition)} "
+            f"PARTITION OF {q(raw.name)} DEFAULT"
+        )
+        lo = conn.exec_driver_sql(
+            f"SELECT min({q(tb.Raw_Product.partition_key)}) FROM {q(old)}"
+        ).scalar()
+        if lo is not None:
+            start = floor_time(lo, interval)
+            stop = add_interval(
+                floor_time(datetime.datetime.utcnow(), interval),
+                interval, ahead + 1
+            )
+            while start < stop:
+                end = add_interval(start, interval)
+                _add_partition(conn, start, end)
+                start = end
+
+        n = conn.exec_driver_sql(
+            f"INSERT INTO {q(raw.name)} ({cols}) OVERRIDING SYSTEM VALUE "
+            f"SELECT {cols} FROM {q(old)}"
+        ).rowcount
+        conn.exec_driver_sql(
+            f"SELECT setval(pg_get_serial_sequence('{q(raw.name)}', 'id'), "
+            f"coalesce((SELECT max(id) FROM {q(raw.name)}), 0) + 1, false)"
+        )
+        conn.exec_driver_sql(f"DROP TABLE {q(old)}")
+    product_notify.install_trigger(engine)
+    logger.info(f"Copied {n} rows into the partitioned {raw.name}.")
+    return n
+
+
+if __name__ == "__main__":
+    args = arg_parser().parse_args()
+    util.set_logger(args.verbose)
+
+    Base, engine, db = new_db(args.config)
+    if engine.dialect.name != "postgresql":
+        sys.exit("Partitioning requires PostgreSQL.")
+    interval = args.interval or config_interval(db)
+
+    if args.migrate:
+        print(f"Copied {migrate_to_partitioned(engine, interval, args.ahead)} rows.")
+
+    create_raw_products(engine, interval, args.ahead)
+
+    if args.detach_before:
+        for name in detach_partitions(engine, args.detach_before, args.drop):
+            print(f"{'Dropped' if args.drop else 'Detached'} {name}")
+
+    if args.list:
+        with engine.connect() as conn:
+            for p in list_partitions(conn):
+                print(f"{p.name}  {p.start}  {p.stop}")
@@ -0,0 +1,233 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+""" An in-process cache of Raw_Product lookups by product_id.
+
+Processing that resolves the same products over and over (for example
+to find the lines, samples, and pathname of each image it calibrates)
+can ask a ProductCache instead of opening a session and querying for
+each one. Entries are plain, read-only rows of a few columns, not ORM
+objects, so they can be shared freely between threads.
+
+The cache is bounded both in size, evicting the least recently used
+entries, and in age, so that changes made by other processes show up
+within ttl seconds. Changes made in this process through the library,
+by flushing Raw_Product objects or with bulk_ingest.upsert_rows(), are
+removed from every cache as soon as they are written, and again once
+they are committed, since a lookup in between still reads, and may
+cache, the old row.
+"""
+
+# Copyright 2022, United States Government as represented by the
+# Administrator of the National Aeronautics and Space Administration.
+# All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+# Reuse is permitted under the terms of the license.
+# The AUTHORS file and the LICENSE file are at the
+# top level of this library.
+
+from collections import OrderedDict
+import logging
+import threading
+import time
+import weakref
+from sqlalchemy import event, inspect, select
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import Pool
+
+from catalog_query import product_ids_filter
+import table_raw_products as tb
+
+logger = logging.getLogger(__name__)
+
+raw = tb.Raw_Product.__table__
+
+"""The Raw_Products columns that cached rows have by default. Rows
+always have product_id, which they are keyed by."""
+lookup_columns = [
+    "id", "product_id", "instrument_name", "start_time", "lines", "samples",
+    "pixel_bits", "pathname", "source_file_name", "bad_pixel_table_id",
+]
+
+"""Every ProductCache in this process, for invalidate_products()."""
+_caches = weakref.WeakSet()
+
+
+class ProductCache:
+    """A least-recently-used cache of Raw_Products rows by product_id.
+
+    At most maxsize rows are kept, each for at most ttl seconds (None for
+    no limit). The rows have the given Raw_Products columns, as
+    attributes. A product_id that is not in the database is not cached,
+    so it is looked up again on the next request.
+
+    The hits, misses, and evictions counters, and stats(), show how well
+    the cache is doing.
+    """
+
+    def __init__(self, engine, maxsize=4096, ttl=300.0, columns=None):
+        if maxsize < 1:
+            raise ValueError("maxsize must be positive.")
+        self.engine = engine
+        self.maxsize = maxsize
+        self.ttl = ttl
+        names = list(columns or lookup_columns)
+        if "product_id" not in names:
+            names.append("product_id")
+        self.columns = [raw.c[c] for c in names]
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._rows = OrderedDict()
+        self._lock = threading.Lock()
+        # Bumped by every invalidation, so that a fetch that raced with
+        # one does not put back what it removed.
+        self._generation = 0
+        _caches.add(self)
+
+    def __len__(self):
+        return len(self._rows)
+
+    def get(self, product_id):
+        """Returns the row for product_id, or None if there is none."""
+        return self.get_many([product_id]).get(str(product_id))
+
+    def get_many(self, product_ids):
+        """Returns a dict of the rows for product_ids, keyed by product_id.
+
+        The product_ids that are not cached are all fetched with one
+        query. Those that are not in the database are left out.
+        """
+        keys = {str(tb.parse_pid(str(p))) for p in product_ids}
+        found = {}
+        now = time.monotonic()
+        with self._lock:
+            for k in keys:
+                entry = self._rows.get(k)
+                if entry is not None and (
+                    entry[0] is None or entry[0] > now
+                ):
+                    self._rows.move_to_end(k)
+                    found[k] = entry[1]
+                elif entry is not None:
+                    del self._rows[k]
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+            generation = self._generation
+
+        missing = keys - found.keys()
+        if missing:
+            with self.engine.connect() as conn:
+                rows = conn.execute(
+                    select(*self.columns).where(product_ids_filter(missing))
+                ).all()
+            fetched = {row.product_id: row for row in rows}
+            found.update(fetched)
+            self._store(fetched, generation)
+        return found
+
+    def _store(self, rows, generation):
+        expires = None if self.ttl is None else time.monotonic() + self.ttl
+        with self._lock:
+            if generation != self._generation:
+                return
+            for k, row in rows.items():
+                self._rows[k] = (expires, row)
+                self._rows.move_to_end(k)
+            while len(self._rows) > self.maxsize:
+                self._rows.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, product_ids=None):
+        """Removes product_ids from the cache, or everything if None."""
+        with self._lock:
+            self._generation += 1
+            if product_ids is None:
+                self._rows.clear()
+                return
+            for p in product_ids:
+                self._rows.pop(str(p), None)
+
+    def stats(self):
+        """Returns the counters and the size as a dict."""
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._rows),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+def invalidate_products(product_ids=None):
+    """Removes product_ids, or everything if None, from every cache."""
+    if product_ids is not None:
+        product_ids = [str(p) for p in product_ids]
+    for cache in list(_caches):
+        cache.invalidate(product_ids)
+
+
+def invalidate_on_commit(conn, product_ids):
+    """Removes product_ids from every cache now, when they are written on
+    conn, and again once conn's transaction has committed. (Ids written
+    in a transaction that is rolled back are only removed the once.)"""
+    product_ids = [str(p) for p in product_ids]
+    invalidate_products(product_ids)
+    conn.info.setdefault("product_cache_written", set()).update(product_ids)
+
+
+# The commit event comes before the commit itself, so the ids are only
+# invalidated when the connection next begins, or goes back to the pool.
+@event.listens_for(Engine, "commit")
+def _committing(conn):
+    written = conn.info.pop("product_cache_written", None)
+    if written:
+        conn.info.setdefault("product_cache_committed", set()).update(written)
+
+
+@event.listens_for(Engine, "rollback")
+def _rolled_back(conn):
+    conn.info.pop("product_cache_written", None)
+
+
+def _invalidate_committed(info):
+    committed = info.pop("product_cache_committed", None)
+    if committed:
+        invalidate_products(committed)
+
+
+@event.listens_for(Engine, "begin")
+def _begin(conn):
+    _invalidate_committed(conn.info)
+
+
+@event.listens_for(Pool, "checkin")
+def _checkin(dbapi_connection, connection_record):
+    _invalidate_committed(connection_record.info)
+
+
+@event.listens_for(tb.Raw_Product, "after_update")
+@event.listens_for(tb.Raw_Product, "after_delete")
+def _invalidate_flushed(mapper, connection, target):
+    # A product_id that was changed is invalidated under its old value too.
+    history = inspect(target).attrs._pid.history
+    invalidate_on_commit(
+        connection,
+        [target._pid, *(p for p in history.deleted or () if p is not None)]
+    )
@@ -0,0 +1,639 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+""" A database-backed queue of jobs that make derived products.
+
+Each Raw_Product is made into a Calibrated_Product, that into an
+Undistorted_Product, and that into a Rectified_Product. Each step is a
+job in Product_Jobs, keyed by its source product and the level to make,
+and finishing one job queues the next, so the queue can be drained by
+any number of worker processes, on this machine or others:
+
+- Jobs are claimed with SELECT ... FOR UPDATE SKIP LOCKED, so workers
+  never wait on, or take, each other's jobs. On SQLite, which has no
+  row locks, each claim is a single write transaction instead.
+- A claimed job is invisible to other workers for the visibility
+  timeout. If its worker dies, it is claimed again after that.
+- A failed job is tried again after a delay that doubles with each
+  attempt, up to max_attempts, after which it is marked failed.
+- Each claim takes a new lease on its jobs. The product is written in
+  the same transaction that marks the job done, which only succeeds
+  for the holder of the current lease, so a product is never made
+  twice, even by a worker that overran its timeout.
+
+The default handlers write the product rows and their lineage; pass
+others to Worker or run_pool() to do the processing itself.
+
+Run with --backlog to queue the products that are missing from every
+level, and with --workers N to process the queue with N processes, until
+it is empty with --drain, or until interrupted. With --follow, new
+Raw_Products are queued as they arrive (see product_notify.py); this
+needs PostgreSQL.
+"""
+
+# Copyright 2022, United States Government as represented by the
+# Administrator of the National Aeronautics and Space Administration.
+# All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+# Reuse is permitted under the terms of the license.
+# The AUTHORS file and the LICENSE file are at the
+# top level of this library.
+
+import argparse
+from collections import namedtuple
+import contextlib
+import datetime
+import functools
+import logging
+import multiprocessing
+from pathlib import Path
+import random
+import signal
+import socket
+import threading
+import uuid
+from sqlalchemy import Integer, String, DateTime, exists, func, literal
+from sqlalchemy import select, update
+from sqlalchemy.exc import DBAPIError
+
+import sys
+import os
+sys.path.insert(1, os.path.join(sys.path[0],'../../../../vipersci/src'))
+from vipersci import util
+
+import db_engine
+from db_utility import new_db
+import lineage
+import product_notify
+import table_product_jobs as tpj
+import table_raw_products as tb
+
+logger = logging.getLogger(__name__)
+
+jobs = tpj.Product_Job.__table__
+raw = tb.Raw_Product.__table__
+cal = lineage.calibrated.Calibrated_Product.__table__
+und = lineage.undistorted.Undistorted_Product.__table__
+rect = lineage.rectified.Rectified_Product.__table__
+
+Level = namedtuple(
+    "Level", ["source", "product", "source_column", "pid_column", "next"]
+)
+
+"""Each product level: the table its sources are in, the table its
+products go in, the product column that refers to the source, the
+product's product_id column, and the level made from it in turn."""
+levels = {
+    "Calibrated": Level(raw, cal, "raw_table_id", "cal_product_id",
+                        "Undistorted"),
+    "Undistorted": Level(cal, und, "cal_table_id", "undistored_product_id",
+                         "Rectified"),
+    "Rectified": Level(und, rect, "undistorted_table_id",
+                       "rectified_product_id", None),
+}
+
+"""The product_id column of each source table."""
+source_pid_columns = {
+    raw.name: "product_id",
+    cal.name: "cal_product_id",
+    und.name: "undistored_product_id",
+}
+
+"""Seconds a claimed job is hidden from other workers."""
+default_visibility_timeout = 300
+
+"""How many times a job is tried before it is marked failed."""
+default_max_attempts = 5
+
+"""Seconds before the first retry of a failed job, doubling for each
+attempt after, up to max_retry_delay."""
+retry_delay = 10
+max_retry_delay = 3600
+
+"""Jobs claimed at a time by a worker, and the seconds it waits before
+looking again when there are none."""
+default_batch_size = 10
+default_poll_interval = 1.0
+
+
+def arg_parser():
+    parser = argparse.ArgumentParser(
+            description=__doc__,
+            formatter_class=argparse.RawDescriptionHelpFormatter,
+            parents=[util.parent_parser()]
+    )
+    parser.add_argument(
+            "-c", "--config",
+            type=Path,
+            required=True,
+            help="Path to database configuration file."
+    )
+    parser.add_argument(
+            "--backlog",
+            action='store_true',
+            help="Queue jobs for every product missing from a level."
+    )
+    parser.add_argument(
+            "-w", "--workers",
+            type=int,
+            help="Process the queue with this many worker processes."
+    )
+    parser.add_argument(
+            "--drain",
+            action='store_true',
+            help="Stop the workers once there are no jobs left."
+    )
+    parser.add_argument(
+            "--follow",
+            action='store_true',
+            help="Queue new Raw_Products as they arrive, while the workers "
+                 "run."
+    )
+    parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=default_batch_size,
+            help="Number of jobs each worker claims at a time."
+    )
+    parser.add_argument(
+            "--visibility-timeout",
+            type=float,
+            default=default_visibility_timeout,
+            help="Seconds before a job whose worker has not finished it can "
+                 "be claimed again."
+    )
+    parser.add_argument(
+            "--max-attempts",
+            type=int,
+            default=default_max_attempts,
+            help="Number of times a job is tried before it is marked failed."
+    )
+    parser.add_argument(
+            "--software-version",
+            default="unknown",
+            help="The software_version to record on the products made."
+    )
+    parser.add_argument(
+            "--retry-failed",
+            action='store_true',
+            help="Queue the failed jobs again, with fresh attempts."
+    )
+    parser.add_argument(
+            "--status",
+            action='store_true',
+            help="Print the number of jobs of each level and status."
+    )
+    return parser
+
+
+def create_jobs_table(engine):
+    jobs.create(bind=engine, checkfirst=True)
+
+
+def _now():
+    return datetime.datetime.utcnow()
+
+
+def backoff(attempts):
+    """Returns the seconds to wait before retrying a job that has failed
+    attempts times, with some jitter so that jobs which failed together
+    are not all retried together."""
+    delay = min(retry_delay * 2 ** (attempts - 1), max_retry_delay)
+    return delay * random.uniform(0.5, 1.0)
+
+
+@contextlib.contextmanager
+def _begin(engine):
+    # A transaction that, on SQLite, takes the write lock at the start.
+    # Otherwise two workers that have both read could each wait for the
+    # other to let go before writing, which SQLite reports as a locked
+    # database rather than waiting.
+    with engine.begin() as conn:
+        if conn.dialect.name == "sqlite":
+            conn.exec_driver_sql("BEGIN IMMEDIATE")
+        yield conn
+
+
+def enqueue(conn, level, source_ids):
+    """Queues jobs to make products of level from the given source ids.
+    Sources that already have a job for that level are skipped."""
+    now = _now()
+    rows = [
+        {
+            "source_type": levels[level].source.name,
+            "source_id": i,
+            "level": level,
+            "status": "pending",
+            "attempts": 0,
+            "visible_at": now,
+            "created_at": now,
+        }
+        for i in source_ids
+    ]
+    if rows:
+        conn.execute(lineage._insert_ignore(conn, jobs), rows)
+    return len(rows)
+
+
+def enqueue_backlog(engine, level_names=None):
+    """Queues a job for every source that has no product, and no job, of
+    its level. Returns the number of jobs queued for each level."""
+    now = _now()
+    counts = {}
+    create_jobs_table(engine)
+    for name in level_names or levels:
+        level = levels[name]
+        source, product = level.source, level.product
+        missing = select(
+            literal(source.name, String),
+            source.c.id,
+            literal(name, String),
+            literal("pending", String),
+            literal(0, Integer),
+            literal(now, DateTime),
+            literal(now, DateTime),
+        ).where(
+            ~exists().where(product.c[level.source_column] == source.c.id)
+        )
+        with engine.begin() as conn:
+            counts[name] = conn.execute(
+                lineage._insert_ignore(conn, jobs).from_select(
+                    ["source_type", "source_id", "level", "status",
+                     "attempts", "visible_at", "created_at"],
+                    missing
+                )
+            ).rowcount
+    logger.info(f"Queued jobs: {counts}")
+    return counts
+
+
+def claim(engine, worker, n=default_batch_size,
+          visibility_timeout=default_visibility_timeout,
+          max_attempts=default_max_attempts):
+    """Claims up to n visible jobs for worker, and returns them.
+
+    Jobs whose last worker ran out of time and attempts are marked failed
+    first. The jobs are taken oldest-visible first, skipping any that
+    another worker is claiming at the same moment.
+    """
+    now = _now()
+    lease = uuid.uuid4().hex
+    with _begin(engine) as conn:
+        conn.execute(
+            update(jobs).where(
+                jobs.c.status == "running",
+                jobs.c.visible_at <= now,
+                jobs.c.attempts >= max_attempts,
+            ).values(
+                status="failed", finished_at=now, lease=None,
+                error="The visibility timeout expired.",
+            )
+        )
+        ready = select(jobs.c.id).where(
+            jobs.c.status.in_(("pending", "running")),
+            jobs.c.visible_at <= now,
+            jobs.c.attempts < max_attempts,
+        ).order_by(
+            jobs.c.visible_at, jobs.c.id
+        ).limit(n).with_for_update(skip_locked=True)
+        claimed = conn.execute(
+            update(jobs).where(jobs.c.id.in_(ready.scalar_subquery())).values(
+                status="running",
+                attempts=jobs.c.attempts + 1,
+                visible_at=now + datetime.timedelta(seconds=visibility_timeout),
+                claimed_at=now,
+                worker=worker,
+                lease=lease,
+            )
+        ).rowcount
+        if not claimed:
+            return []
+        return conn.execute(
+            select(jobs).where(jobs.c.lease == lease).order_by(jobs.c.id)
+        ).all()
+
+
+def _held(job):
+    return (jobs.c.id == job.id) & (jobs.c.lease == job.lease)
+
+
+def complete(conn, job, product_id):
+    """Marks a claimed job done, and queues the job for the next level.
+    Returns False, doing neither, if the job's lease has been lost to
+    another claim; the caller should then roll back its work."""
+    done = conn.execute(
+        update(jobs).where(_held(job)).values(
+            status="done", finished_at=_now(), product_id=product_id,
+            lease=None, error=None,
+        )
+    ).rowcount
+    if not done:
+        return False
+    next_level = levels[job.level].next
+    if next_level is not None and product_id is not None:
+        enqueue(conn, next_level, [product_id])
+    return True
+
+
+def fail(engine, job, error, max_attempts=default_max_attempts):
+    """Puts a claimed job back for a retry after backoff(), or, once it
+    has had max_attempts, marks it failed. Returns the new status, or
+    None if the lease had been lost."""
+    now = _now()
+    if job.attempts >= max_attempts:
+        values = {"status": "failed", "finished_at": now}
+    else:
+        values = {
+            "status": "pending",
+            "visible_at": now + datetime.timedelta(
+                seconds=backoff(job.attempts)
+            ),
+        }
+    with _begin(engine) as conn:
+        changed = conn.execute(
+            update(jobs).where(_held(job)).values(
+                lease=None, error=error, **values
+            )
+        ).rowcount
+    return values["status"] if changed else None
+
+
+def release(engine, claimed):
+    """Hands back claimed jobs that were not started, without using up
+    one of their attempts."""
+    if not claimed:
+        return
+    with _begin(engine) as conn:
+        for job in claimed:
+            conn.execute(
+                update(jobs).where(_held(job)).values(
+                    status="pending", visible_at=_now(),
+                    attempts=jobs.c.attempts - 1, lease=None, worker=None,
+                )
+            )
+
+
+def retry_failed(engine, level=None):
+    """Queues the failed jobs (of a level, or all) again, with their
+    attempts reset. Returns how many there were."""
+    stmt = update(jobs).where(jobs.c.status == "failed")
+    if level is not None:
+        stmt = stmt.where(jobs.c.level == level)
+    with engine.begin() as conn:
+        return conn.execute(
+            stmt.values(status="pending", attempts=0, visible_at=_now())
+        ).rowcount
+
+
+def outstanding(conn):
+    """Returns the number of jobs that are pending or running."""
+    return conn.execute(
+        select(func.count()).select_from(jobs).where(
+            jobs.c.status.in_(("pending", "running"))
+        )
+    ).scalar()
+
+
+def status_counts(conn):
+    """Returns {(level, status): number of jobs}."""
+    return {
+        (level, status): n
+        for level, status, n in conn.execute(
+            select(jobs.c.level, jobs.c.status, func.count()).group_by(
+                jobs.c.level, jobs.c.status
+            ).order_by(jobs.c.level, jobs.c.status)
+        )
+    }
+
+
+def make_product(conn, job, software_version="unknown"):
+    """The default handler: writes the product row of job's level, with
+    the product_id of its source, and records its lineage. Returns the
+    new product's id."""
+    level = levels[job.level]
+    source = conn.execute(
+        select(level.source).where(level.source.c.id == job.source_id)
+    ).one()
+    values = {
+        level.source_column: job.source_id,
+        level.pid_column: source._mapping[source_pid_columns[level.source.name]],
+        "software_version": software_version,
+    }
+    if "raw_table_id" in level.product.c and "raw_table_id" in source._mapping:
+        values["raw_table_id"] = source.raw_table_id
+    product_id = conn.execute(
+        level.product.insert(), values
+    ).inserted_primary_key[0]
+    # The parent is the job's source, so there is no need for
+    # lineage.record_product() to look it up.
+    lineage.link_products(
+        conn, (job.source_type, job.source_id), (level.product.name, product_id)
+    )
+    return product_id
+
+
+def default_handlers(software_version="unknown"):
+    """Returns {level: handler} with make_product() for every level."""
+    handler = functools.partial(make_product, software_version=software_version)
+    return {name: handler for name in levels}
+
+
+class LeaseLost(Exception):
+    """A job was claimed by another worker while this one ran it."""
+
+
+class Worker:
+    """Claims and runs jobs from one engine.
+
+    Each handler is called as handler(conn, job) in the transaction that
+    will mark the job done, and returns the id of the product it made.
+    If it raises, the transaction is rolled back and the job is retried
+    later.
+    """
+
+    def __init__(self, engine, handlers=None, name=None,
+                 batch_size=default_batch_size,
+                 visibility_timeout=default_visibility_timeout,
+                 max_attempts=default_max_attempts,
+                 poll_interval=default_poll_interval):
+        self.engine = engine
+        self.handlers = handlers or default_handlers()
+        self.name = name or f"{socket.gethostname()}:{os.getpid()}"
+        self.batch_size = batch_size
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        self.poll_interval = poll_interval
+        self.counts = {"done": 0, "retried": 0, "failed": 0, "lost": 0}
+        self.stop = threading.Event()
+
+    def process(self, job):
+        """Runs one claimed job, and returns what became of it: done,
+        retried, failed, or lost (to another claim)."""
+        if job.visible_at <= _now():
+            # Out of time before starting; it may be claimed again.
+            return "lost"
+        try:
+            with _begin(self.engine) as conn:
+                product_id = self.handlers[job.level](conn, job)
+                if not complete(conn, job, product_id):
+                    raise LeaseLost()
+        except LeaseLost:
+            logger.warning(f"{self.name} lost job {job.id} to another claim.")
+            return "lost"
+        except Exception as e:
+            logger.exception(f"Job {job.id} ({job.level} from "
+                             f"{job.source_type} {job.source_id}) failed.")
+            status = fail(self.engine, job, repr(e), self.max_attempts)
+            if status is None:
+                return "lost"
+            return "retried" if status == "pending" else "failed"
+        return "done"
+
+    def run_once(self):
+        """Claims a batch of jobs and runs them. Returns the number of
+        jobs claimed."""
+        claimed = claim(
+            self.engine, self.name, self.batch_size,
+            self.visibility_timeout, self.max_attempts
+        )
+        for i, job in enumerate(claimed):
+            if self.stop.is_set():
+                release(self.engine, claimed[i:])
+                break
+            self.counts[self.process(job)] += 1
+        return len(claimed)
+
+    def run(self, stop=None, drain=False):
+        """Runs jobs until stop (an Event) is set, or, if drain, until
+        there are none left pending or running. Returns the counts of
+        what became of the jobs."""
+        if stop is not None:
+            self.stop = stop
+        while not self.stop.is_set():
+            try:
+                if self.run_once():
+                    continue
+                if drain:
+                    with self.engine.connect() as conn:
+                        if not outstanding(conn):
+                            break
+            except DBAPIError as e:
+                # Such as a locked SQLite database, or a lost connection.
+                # Any jobs left claimed are claimed again once visible.
+                logger.warning(f"{self.name}: {e.orig!r}")
+            self.stop.wait(self.poll_interval)
+        logger.info(f"{self.name}: {self.counts}")
+        return self.counts
+
+
+def _work(url, options, handlers, name, stop, drain, worker_options,
+          log_level):
+    # The body of a worker process.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    logging.basicConfig(level=log_level)
+    engine = db_engine.get_engine(url, **options)
+    Worker(engine, handlers, name, **worker_options).run(stop, drain)
+
+
+def run_pool(url, options, workers, handlers=None, drain=False, follow=False,
+             **worker_options):
+    """Runs jobs with a number of worker processes, each with its own
+    engine from url and options, until interrupted, or, if drain, until
+    there are no jobs left.
+
+    If follow, the backlog is queued and, until interrupted, so are new
+    Raw_Products as product_notify reports them. This needs PostgreSQL,
+    the only database whose reports of other processes' inserts reach
+    this one.
+    """
+    ctx = multiprocessing.get_context("spawn")
+    stop = ctx.Event()
+    engine = db_engine.get_engine(url, **options)
+    if follow and engine.dialect.name != "postgresql":
+        raise NotImplementedError(
+            f"Following new Raw_Products is not supported for "
+            f"{engine.dialect.name}."
+        )
+    create_jobs_table(engine)
+    with contextlib.ExitStack() as stack:
+        if follow:
+            # Subscribe first, so nothing arrives between the backlog and
+            # the notifications unqueued.
+            subscriber = stack.enter_context(
+                product_notify.Subscriber(engine)
+            )
+            enqueue_backlog(engine)
+        procs = [
+            ctx.Process(
+                target=_work,
+                args=(url, options, handlers,
+                      f"{socket.gethostname()}:{os.getpid()}-{i}", stop,
+                      drain and not follow, worker_options,
+                      logging.getLogger().level),
+                daemon=True,
+            )
+            for i in range(workers)
+        ]
+        for p in procs:
+            p.start()
+        try:
+            while any(p.is_alive() for p in procs):
+                if follow:
+                    ids = subscriber.get(default_poll_interval)
+                    if ids:
+                        with engine.begin() as conn:
+                            enqueue(conn, "Calibrated", ids)
+                else:
+                    for p in procs:
+                        p.join(default_poll_interval)
+        except KeyboardInterrupt:
+            logger.info("Stopping the workers.")
+        finally:
+            stop.set()
+            for p in procs:
+                p.join()
+
+
+if __name__ == "__main__":
+    parser = arg_parser()
+    args = parser.parse_args()
+    util.set_logger(args.verbose)
+
+    Base, engine, db = new_db(args.config)
+    if args.follow and engine.dialect.name != "postgresql":
+        parser.error(
+            f"--follow is not supported for {engine.dialect.name}."
+        )
+    create_jobs_table(engine)
+    if args.retry_failed:
+        print(f"Queued {retry_failed(engine)} failed jobs again.")
+    if args.backlog and not args.follow:
+        enqueue_backlog(engine)
+    if args.workers:
+        url, options, db = db_engine.read_config(args.config)
+        run_pool(
+            url, options, args.workers,
+            handlers=default_handlers(args.software_version),
+            drain=args.drain, follow=args.follow,
+            batch_size=args.batch_size,
+            visibility_timeout=args.visibility_timeout,
+            max_attempts=args.max_attempts,
+        )
+    if args.status:
+        with engine.connect() as conn:
+            for (level, status), n in status_counts(conn).items():
+                print(f"{level:12} {status:8} {n}")
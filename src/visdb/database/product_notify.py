@@ -0,0 +1,393 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+""" Notifications of new Raw_Products, for processing to react to.
+
+Rather than polling Raw_Products for ids it has not seen, a process can
+hold a Subscriber, which hands it the ids of newly inserted rows in
+batches, within milliseconds of the inserting transaction committing.
+
+On PostgreSQL, a statement-level trigger on Raw_Products sends the ids
+of the rows that each INSERT (or COPY) added with NOTIFY, so every way
+of ingesting is covered, and the ids are delivered only if, and when,
+the transaction commits. create_raw_products() installs the trigger;
+run this with --install to add it to an existing database.
+
+SQLite has no NOTIFY, so there the notifications only reach Subscribers
+in the same process as the ingest, and only for inserts made through the
+same engine (which db_engine.get_engine() shares). A temporary trigger
+on each of the engine's connections collects the new ids, which are
+handed on once the transaction has committed.
+
+Run with --listen to print the ids as they arrive.
+"""
+
+# Copyright 2022, United States Government as represented by the
+# Administrator of the National Aeronautics and Space Administration.
+# All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+# Reuse is permitted under the terms of the license.
+# The AUTHORS file and the LICENSE file are at the
+# top level of this library.
+
+import argparse
+import logging
+from pathlib import Path
+import queue
+import select
+import threading
+import time
+import weakref
+from sqlalchemy import event, text
+
+import sys
+import os
+sys.path.insert(1, os.path.join(sys.path[0],'../../../../vipersci/src'))
+from vipersci import util
+
+from db_utility import new_db
+import table_raw_products as tb
+
+logger = logging.getLogger(__name__)
+
+raw = tb.Raw_Product.__table__
+
+"""The PostgreSQL NOTIFY channel for new Raw_Products."""
+channel = "visdb_raw_products"
+
+"""How many ids each notification carries at most, which keeps the
+payload well under PostgreSQL's 8000 byte limit."""
+ids_per_notification = 500
+
+trigger_name = "visdb_notify_raw_products"
+
+_notify_function = f"""
+CREATE OR REPLACE FUNCTION {trigger_name}() RETURNS trigger AS $$
+DECLARE
+    ids text;
+BEGIN
+    FOR ids IN
+        SELECT string_agg(id::text, ',' ORDER BY id)
+        FROM (
+            SELECT id, (row_number() OVER (ORDER BY id) - 1)
+                / {ids_per_notification} AS chunk
+            FROM new_rows
+        ) AS numbered
+        GROUP BY chunk ORDER BY chunk
+    LOOP
+        PERFORM pg_notify('{channel}', ids);
+    END LOOP;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql
+"""
+
+"""The Subscribers to SQLite databases in this process, by engine URL."""
+_local_subscribers = {}
+_local_lock = threading.Lock()
+
+
+def arg_parser():
+    parser = argparse.ArgumentParser(
+            description=__doc__,
+            formatter_class=argparse.RawDescriptionHelpFormatter,
+            parents=[util.parent_parser()]
+    )
+    parser.add_argument(
+            "-c", "--config",
+            type=Path,
+            required=True,
+            help="Path to database configuration file."
+    )
+    parser.add_argument(
+            "--install",
+            action='store_true',
+            help="Install the PostgreSQL notification trigger."
+    )
+    parser.add_argument(
+            "--listen",
+            action='store_true',
+            help="Print the ids of new Raw_Products as they arrive."
+    )
+    return parser
+
+
+def install_trigger(engine):
+    """Installs the trigger that notifies of new Raw_Products, if it is
+    not there already. This is only needed, and only done, on
+    PostgreSQL."""
+    if engine.dialect.name != "postgresql":
+        return
+    q = engine.dialect.identifier_preparer.quote
+    with engine.begin() as conn:
+        exists = conn.execute(
+            text(
+                "SELECT 1 FROM pg_trigger "
+                "WHERE tgname = :name AND tgrelid = to_regclass(:table)"
+            ),
+            {"name": trigger_name, "table": q(raw.name)}
+        ).first()
+        if exists:
+            return
+        conn.exec_driver_sql(_notify_function)
+        conn.exec_driver_sql(
+            f"CREATE TRIGGER {trigger_name} AFTER INSERT ON {q(raw.name)} "
+            f"REFERENCING NEW TABLE AS new_rows "
+            f"FOR EACH STATEMENT EXECUTE FUNCTION {trigger_name}()"
+        )
+    logger.info(f"Installed the {trigger_name} trigger.")
+
+
+def _parse(payload):
+    return [int(i) for i in payload.split(",") if i]
+
+
+class Subscriber:
+    """Receives the ids of new Raw_Products.
+
+    Use it as a context manager, or call close() when done. get() returns
+    the next batch of ids; batches() yields them for as long as the
+    Subscriber is open. Ids inserted before the Subscriber was created
+    are not delivered, so read those first.
+
+    On PostgreSQL the Subscriber holds one connection of its own, outside
+    the engine's pool, on which it LISTENs.
+    """
+
+    def __init__(self, engine, max_batch=1000, max_wait=0.05):
+        self.engine = engine
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._pending = []
+        self._closed = False
+        if engine.dialect.name == "postgresql":
+            # Detached, so that a LISTENing connection is never handed
+            # out by the pool.
+            self._conn = engine.raw_connection()
+            self._conn.detach()
+            self._conn.dbapi_connection.autocommit = True
+            cursor = self._conn.cursor()
+            cursor.execute(f"LISTEN {channel}")
+            cursor.close()
+        elif engine.dialect.name == "sqlite":
+            self._conn = None
+            self._queue = queue.Queue()
+            watch_sqlite(engine)
+            with _local_lock:
+                _local_subscribers.setdefault(
+                    str(engine.url), weakref.WeakSet()
+                ).add(self)
+        else:
+            raise NotImplementedError(
+                f"Notifications are not supported for {engine.dialect.name}."
+            )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def close(self):
+        self._closed = True
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+        else:
+            with _local_lock:
+                _local_subscribers.get(str(self.engine.url), set()).discard(self)
+
+    def _receive(self, timeout):
+        # Adds whatever arrives within timeout (None to wait forever) to
+        # the pending ids.
+        if self._conn is None:
+            try:
+                self._pending.extend(self._queue.get(timeout=timeout))
+                while True:
+                    self._pending.extend(self._queue.get_nowait())
+            except queue.Empty:
+                pass
+            return
+        dbapi = self._conn.dbapi_connection
+        if not dbapi.notifies:
+            select.select([dbapi], [], [], timeout)
+            dbapi.poll()
+        while dbapi.notifies:
+            self._pending.extend(_parse(dbapi.notifies.pop(0).payload))
+
+    def get(self, timeout=None):
+        """Returns the next batch of new ids, in ascending order.
+
+        Waits up to timeout seconds (forever if None) for the first id,
+        returning [] if none arrives; then for up to max_wait seconds more
+        for others, so that ids inserted together are delivered together.
+        A batch has at most max_batch ids.
+        """
+        if not self._pending:
+            self._receive(timeout)
+            if not self._pending:
+                return []
+        deadline = time.monotonic() + self.max_wait
+        while len(self._pending) < self.max_batch:
+            left = deadline - time.monotonic()
+            if left <= 0:
+                break
+            self._receive(left)
+        batch = sorted(self._pending[:self.max_batch])
+        del self._pending[:self.max_batch]
+        return batch
+
+    def batches(self, timeout=1.0):
+        """Yields the batches of new ids until the Subscriber is closed,
+        checking for that every timeout seconds."""
+        while not self._closed:
+            batch = self.get(timeout)
+            if batch:
+                yield batch
+
+
+def _publish(url, ids):
+    with _local_lock:
+        subscribers = list(_local_subscribers.get(url, ()))
+    for s in subscribers:
+        s._queue.put(ids)
+
+
+"""The SQLite engines whose inserts are being collected."""
+_watched = weakref.WeakSet()
+
+
+def watch_sqlite(engine):
+    """Collects the ids of the Raw_Products that engine inserts into a
+    SQLite database, and hands them to the Subscribers in this process
+    once they are committed. Subscriber() calls this.
+
+    Each connection gets a temporary trigger, which adds the new ids to
+    those pending in its transaction. On commit they are held back until
+    the commit is done, and delivered when the connection next starts a
+    transaction or statement, or goes back to the pool; on rollback they
+    are dropped.
+    """
+    with _local_lock:
+        if engine in _watched:
+            return
+        _watched.add(engine)
+    url = str(engine.url)
+
+    def info(conn):
+        return conn.connection.info
+
+    @event.listens_for(engine, "begin")
+    def begin(conn):
+        i = info(conn)
+        _flush(i, url)
+        i["notify_pending"] = []
+        i["notify_savepoints"] = []
+        if not i.get("notify_trigger"):
+            i["notify_trigger"] = _add_trigger(conn.connection.dbapi_connection, i)
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, *args):
+        _flush(info(conn), url)
+
+    # Savepoints nest, so their marks in the pending ids are a stack.
+    @event.listens_for(engine, "savepoint")
+    def savepoint(conn, name):
+        i = info(conn)
+        i.setdefault("notify_savepoints", []).append(
+            len(i.get("notify_pending", ()))
+        )
+
+    @event.listens_for(engine, "release_savepoint")
+    def release_savepoint(conn, name, context):
+        marks = info(conn).get("notify_savepoints")
+        if marks:
+            marks.pop()
+
+    @event.listens_for(engine, "rollback_savepoint")
+    def rollback_savepoint(conn, name, context):
+        i = info(conn)
+        marks = i.get("notify_savepoints")
+        if marks and "notify_pending" in i:
+            del i["notify_pending"][marks.pop():]
+
+    @event.listens_for(engine, "commit")
+    def commit(conn):
+        i = info(conn)
+        pending = i.pop("notify_pending", None)
+        if pending:
+            i.setdefault("notify_committed", []).extend(pending)
+
+    @event.listens_for(engine, "rollback")
+    def rollback(conn):
+        info(conn).pop("notify_pending", None)
+
+    @event.listens_for(engine.pool, "checkin")
+    def checkin(dbapi_connection, connection_record):
+        _flush(connection_record.info, url)
+
+
+def _add_trigger(dbapi_connection, info):
+    # Returns whether the temporary trigger is in place; it cannot be
+    # until Raw_Products exists.
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute(
+            "SELECT 1 FROM main.sqlite_master "
+            "WHERE type = 'table' AND name = ?", (raw.name,)
+        )
+        if cursor.fetchone() is None:
+            return False
+
+        def collect(product_id):
+            pending = info.get("notify_pending")
+            if pending is not None:
+                pending.append(product_id)
+
+        dbapi_connection.create_function(f"{trigger_name}", 1, collect)
+        cursor.execute(
+            f"CREATE TEMP TRIGGER IF NOT EXISTS {trigger_name} "
+            f'AFTER INSERT ON main."{raw.name}" '
+            f"BEGIN SELECT {trigger_name}(NEW.id); END"
+        )
+        return True
+    finally:
+        cursor.close()
+
+
+def _flush(info, url):
+    # Delivers the ids of the last committed transaction, if any.
+    ids = info.pop("notify_committed", None)
+    if ids:
+        _publish(url, ids)
+
+
+if __name__ == "__main__":
+    args = arg_parser().parse_args()
+    util.set_logger(args.verbose)
+
+    Base, engine, db = new_db(args.config)
+    if args.install:
+        install_trigger(engine)
+    if args.listen:
+        with Subscriber(engine) as subscriber:
+            try:
+                for batch in subscriber.batches():
+                    print(" ".join(str(i) for i in batch), flush=True)
+            except KeyboardInterrupt:
+                pass
@@ -0,0 +1,393 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+""" Captures, stores, and compares the plans of catalog queries.
+
+explain() returns the plan of a SQLAlchemy statement, and Capture is a
+profiling mode: while it is active, every SELECT run through an engine
+is first run under EXPLAIN, and the plans are stored in the Query_Plans
+table under a run name when it ends. On PostgreSQL the plans are those
+of EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON), so they include the actual
+times, row counts, and buffer use; on SQLite they are those of EXPLAIN
+QUERY PLAN, as a tree of the same shape. Sequential scans of tables with
+at least min_rows rows are flagged, and logged as warnings.
+
+diff() compares two plans, and diff_runs() the plans of the same
+statements in two runs, to show whether an index or a partitioning
+change helped. db_utility's --profile, --plans, and --diff-plans use
+these.
+"""
+
+# Copyright 2022, United States Government as represented by the
+# Administrator of the National Aeronautics and Space Administration.
+# All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+# Reuse is permitted under the terms of the license.
+# The AUTHORS file and the LICENSE file are at the
+# top level of this library.
+
+import datetime
+import difflib
+import json
+import logging
+import re
+from sqlalchemy import event, func, insert, inspect, select
+
+import db_metrics
+import table_query_plan as tqp
+
+logger = logging.getLogger(__name__)
+
+plans_table = tqp.Query_Plan.__table__
+
+"""Sequential scans of tables with fewer rows than this are not flagged."""
+default_min_rows = 10000
+
+_sqlite_scan = re.compile(r"^SCAN (?:TABLE )?(.+?)(?: USING .*)?$")
+
+# SQLite also SCANs the results of subqueries, CTEs, and constant rows.
+_sqlite_subquery = re.compile(r"^(?:MATERIALIZE|CO-ROUTINE) (.+)$")
+_sqlite_not_table = re.compile(r"^(?:CONSTANT ROW|(?:LIST )?SUBQUERY \d+|\(.*)$")
+
+
+def _sqlite_plan(rows):
+    # EXPLAIN QUERY PLAN rows are (id, parent, notused, detail). A
+    # subquery or CTE is set up before it is scanned.
+    root = {"Node Type": "Query", "Plans": []}
+    nodes = {0: root}
+    subqueries = set()
+    for id_, parent, _, detail in rows:
+        node = {"Node Type": detail}
+        m = _sqlite_subquery.match(detail)
+        if m is not None:
+            subqueries.add(m.group(1))
+        m = _sqlite_scan.match(detail)
+        if m is not None:
+            name = m.group(1)
+            if name not in subqueries and not _sqlite_not_table.match(name):
+                node["Relation Name"] = name
+        nodes[id_] = node
+        nodes.get(parent, root).setdefault("Plans", []).append(node)
+    return {"Plan": root}
+
+
+def explain_dbapi(dbapi_conn, dialect_name, statement, parameters):
+    """Returns the plan of statement, a string in the DBAPI's paramstyle,
+    run on a DBAPI connection.
+
+    On PostgreSQL the statement is run, under EXPLAIN ANALYZE, inside a
+    savepoint that is then rolled back.
+    """
+    cursor = dbapi_conn.cursor()
+    try:
+        if dialect_name == "postgresql":
+            savepoint = not getattr(dbapi_conn, "autocommit", False)
+            if savepoint:
+                cursor.execute("SAVEPOINT visdb_explain")
+            try:
+                cursor.execute(
+                    "EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + statement,
+                    parameters
+                )
+                doc = cursor.fetchone()[0]
+            finally:
+                if savepoint:
+                    cursor.execute("ROLLBACK TO SAVEPOINT visdb_explain")
+            if isinstance(doc, str):
+                doc = json.loads(doc)
+            return doc[0]
+        elif dialect_name == "sqlite":
+            cursor.execute("EXPLAIN QUERY PLAN " + statement, parameters)
+            return _sqlite_plan(cursor.fetchall())
+        else:
+            raise NotImplementedError(
+                f"Query plans are not supported for {dialect_name}."
+            )
+    finally:
+        cursor.close()
+
+
+def compile_statement(stmt, dialect):
+    """Returns the SQL string and DBAPI parameters of a SQLAlchemy
+    statement, with any expanding IN lists rendered."""
+    compiled = stmt.compile(
+        dialect=dialect, compile_kwargs={"render_postcompile": True}
+    )
+    params = compiled.params
+    if compiled.positiontup is not None:
+        params = tuple(params[k] for k in compiled.positiontup)
+    return compiled.string, params
+
+
+def explain(engine, stmt):
+    """Returns the plan of a SQLAlchemy statement.
+
+    On PostgreSQL the statement is run, under EXPLAIN ANALYZE, in a
+    transaction that is rolled back, so this is safe for any statement.
+    """
+    sql, params = compile_statement(stmt, engine.dialect)
+    with engine.connect() as conn:
+        with conn.begin() as trans:
+            doc = explain_dbapi(
+                conn.connection, engine.dialect.name, sql, params
+            )
+            trans.rollback()
+    return doc
+
+
+def nodes(doc):
+    """Yields (depth, node) for the nodes of a plan, depth first."""
+    stack = [(0, doc["Plan"])]
+    while stack:
+        depth, node = stack.pop()
+        yield depth, node
+        for child in reversed(node.get("Plans", ())):
+            stack.append((depth + 1, child))
+
+
+def _is_seq_scan(node):
+    if "Relation Name" not in node:
+        return False
+    return node["Node Type"] == "Seq Scan" or (
+        _sqlite_scan.match(node["Node Type"]) is not None
+        and "USING" not in node["Node Type"]
+    )
+
+
+def _table_rows(dbapi_conn, dialect_name, names):
+    # Only the names that are tables are returned. SQLite names a table
+    # in a plan by its alias, if it has one, which cannot be counted.
+    cursor = dbapi_conn.cursor()
+    try:
+        if dialect_name == "postgresql":
+            cursor.execute(
+                "SELECT relname, reltuples FROM pg_class "
+                "WHERE relname = ANY(%(names)s)",
+                {"names": list(names)}
+            )
+            return {name: int(n) for name, n in cursor.fetchall()}
+        cursor.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table'"
+        )
+        tables = {name for name, in cursor.fetchall()}
+        rows = {}
+        for name in tables.intersection(names):
+            quoted = name.replace('"', '""')
+            cursor.execute(f'SELECT count(*) FROM "{quoted}"')
+            rows[name] = cursor.fetchone()[0]
+        return rows
+    finally:
+        cursor.close()
+
+
+def seq_scans(dbapi_conn, dialect_name, doc, min_rows=default_min_rows):
+    """Returns the sequential scans in a plan of tables with at least
+    min_rows rows, as a list of {"table": name, "rows": n}.
+
+    A table's size is the planner's estimate on PostgreSQL, or the rows
+    that the scan actually read if that is more (as it is for a table
+    that has never been analyzed); on SQLite, it is counted. Scans of
+    anything that is not a table are left out.
+    """
+    scanned = {}
+    for _, node in nodes(doc):
+        if _is_seq_scan(node):
+            read = (
+                node.get("Actual Rows", 0) + node.get("Rows Removed by Filter", 0)
+            ) * node.get("Actual Loops", 1)
+            name = node["Relation Name"]
+            scanned[name] = max(scanned.get(name, 0), read)
+    if not scanned:
+        return []
+    sizes = _table_rows(dbapi_conn, dialect_name, scanned)
+    found = []
+    for name, read in sorted(scanned.items()):
+        if name not in sizes:
+            continue
+        n = max(sizes[name], read)
+        if n >= min_rows:
+            found.append({"table": name, "rows": n})
+    return found
+
+
+def describe(node):
+    """A one line description of a plan node, without its numbers."""
+    s = node["Node Type"]
+    if "Index Name" in node:
+        s += f" using {node['Index Name']}"
+    if "Relation Name" in node and not _sqlite_scan.match(s):
+        s += f" on {node['Relation Name']}"
+    return s
+
+
+def outline(doc):
+    """Returns the shape of a plan as indented lines."""
+    return ["  " * depth + describe(node) for depth, node in nodes(doc)]
+
+
+def _buffers(doc):
+    plan = doc["Plan"]
+    return plan.get("Shared Hit Blocks"), plan.get("Shared Read Blocks")
+
+
+def _change(name, old, new, unit=""):
+    if old is None and new is None:
+        return None
+    s = f"{name}: {old}{unit} -> {new}{unit}"
+    if old and new is not None:
+        s += f" ({(new - old) / old:+.0%})"
+    return s
+
+
+def diff(old, new, old_scans=None, new_scans=None):
+    """Returns lines comparing two plans: their times and buffer use, the
+    large tables each scans in full, and a diff of their shapes."""
+    lines = [
+        _change("planning", old.get("Planning Time"),
+                new.get("Planning Time"), " ms"),
+        _change("execution", old.get("Execution Time"),
+                new.get("Execution Time"), " ms"),
+    ]
+    (old_hit, old_read), (new_hit, new_read) = _buffers(old), _buffers(new)
+    lines.append(_change("shared buffers hit", old_hit, new_hit))
+    lines.append(_change("shared buffers read", old_read, new_read))
+    if old_scans is not None or new_scans is not None:
+        tables = [
+            ", ".join(s["table"] for s in scans or ()) or "none"
+            for scans in (old_scans, new_scans)
+        ]
+        lines.append(f"sequential scans: {tables[0]} -> {tables[1]}")
+    shape = list(difflib.unified_diff(
+        outline(old), outline(new), "old", "new", lineterm=""
+    ))
+    lines.extend(shape if shape else ["plan shape unchanged"])
+    return [line for line in lines if line is not None]
+
+
+class Capture:
+    """A profiling mode for an engine, used as a context manager.
+
+    Every SELECT run through the engine in the with block is explained
+    first, and when the block ends the plans are stored in Query_Plans
+    under the name run (the start time if None). The plans are also kept
+    in the plans attribute, as dicts of the Query_Plans columns.
+    """
+
+    def __init__(self, engine, run=None, min_rows=default_min_rows):
+        self.engine = engine
+        self.run = run or datetime.datetime.utcnow().isoformat()
+        self.min_rows = min_rows
+        self.plans = []
+
+    def _before(self, conn, cursor, statement, parameters, context,
+                executemany):
+        words = statement.split(None, 1)
+        if executemany or not words or words[0].lower() not in (
+            "select", "with"
+        ):
+            return
+        dialect_name = conn.dialect.name
+        try:
+            doc = explain_dbapi(
+                conn.connection, dialect_name, statement, parameters
+            )
+            scans = seq_scans(
+                conn.connection, dialect_name, doc, self.min_rows
+            )
+        except Exception as e:
+            logger.warning(f"Could not explain {statement!r}: {e}")
+            return
+        for s in scans:
+            logger.warning(
+                f"Sequential scan of {s['table']} ({s['rows']} rows) in: "
+                f"{db_metrics.normalize(statement)}"
+            )
+        self.plans.append({
+            "run": self.run,
+            "captured_at": datetime.datetime.utcnow(),
+            "statement": statement,
+            "parameters": repr(parameters),
+            "plan": doc,
+            "planning_ms": doc.get("Planning Time"),
+            "execution_ms": doc.get("Execution Time"),
+            "seq_scans": scans,
+        })
+
+    def __enter__(self):
+        event.listen(self.engine, "before_cursor_execute", self._before)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(self.engine, "before_cursor_execute", self._before)
+        if self.plans:
+            save(self.engine, self.plans)
+            logger.info(f"Stored {len(self.plans)} plans as {self.run}")
+        return False
+
+
+def save(engine, plans):
+    """Stores plans, dicts of the Query_Plans columns."""
+    plans_table.create(bind=engine, checkfirst=True)
+    with engine.begin() as conn:
+        conn.execute(insert(plans_table), plans)
+
+
+def runs(engine):
+    """Returns the stored runs, with their first capture time and number
+    of plans, oldest first."""
+    if not inspect(engine).has_table(plans_table.name):
+        return []
+    with engine.connect() as conn:
+        return conn.execute(
+            select(
+                plans_table.c.run,
+                func.min(plans_table.c.captured_at).label("captured_at"),
+                func.count().label("plans"),
+            ).group_by(plans_table.c.run).order_by("captured_at")
+        ).all()
+
+
+def load_run(engine, run):
+    """Returns the stored plans of a run, in the order they were run."""
+    if not inspect(engine).has_table(plans_table.name):
+        return []
+    with engine.connect() as conn:
+        return conn.execute(
+            select(plans_table).where(plans_table.c.run == run)
+            .order_by(plans_table.c.captured_at, plans_table.c.id)
+        ).all()
+
+
+def diff_runs(engine, old_run, new_run):
+    """Returns lines comparing the plans of the statements that are in both
+    runs, matched by their normalized text (the last plan of each)."""
+    def by_statement(run):
+        return {
+            db_metrics.normalize(p.statement): p
+            for p in load_run(engine, run)
+        }
+    old, new = by_statement(old_run), by_statement(new_run)
+    lines = []
+    for statement in sorted(old.keys() & new.keys()):
+        o, n = old[statement], new[statement]
+        lines.append(f"== {statement}")
+        lines.extend(diff(o.plan, n.plan, o.seq_scans, n.seq_scans))
+    for statement in sorted(old.keys() - new.keys()):
+        lines.append(f"== only in {old_run}: {statement}")
+    for statement in sorted(new.keys() - old.keys()):
+        lines.append(f"== only in {new_run}: {statement}")
+    return lines
@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+""" Queries and migration for the rectified map association tables.
+
+The Mosaic, Hazard, and Panorama rectified maps record their source
+Rectified_Products in association tables keyed on (map_id,
+rectified_product_table_id) with a reverse index on the rectified product,
+so both directions of the lookup are a single indexed query.
+
+Run as a program, this migrates databases that still have the old pickled
+rectified_product_table_ids columns into the association tables.
+"""
+
+# Copyright 2022, United States Government as represented by the
+# Administrator of the National Aeronautics and Space Administration.
+# All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+# Reuse is permitted under the terms of the license.
+# The AUTHORS file and the LICENSE file are at the
+# top level of this library.
+
+import argparse
+import logging
+from pathlib import Path
+import pickle
+from sqlalchemy import column, exists, inspect, literal, select, union_all
+
+import sys
+import os
+sys.path.insert(1, os.path.join(sys.path[0],'../../../../vipersci/src'))
+from vipersci import util
+
+from bulk_ingest import batched
+from db_utility import new_db
+import table_hazard_rectified_map as hazard
+import table_mosaic_rectified_map as mosaic
+import table_panorama_rectified_map as panorama
+
+logger = logging.getLogger(__name__)
+
+"""The map kinds, each with its map table and association table."""
+map_tables = {
+    "mosaic": (mosaic.Mosaic_Rectified_Map.__table__,
+               mosaic.mosaic_rectified_sources),
+    "hazard": (hazard.Hazard_Rectified_Map.__table__,
+               hazard.hazard_rectified_sources),
+    "panorama": (panorama.Panorama_Rectified_Map.__table__,
+                 panorama.panorama_rectified_sources),
+}
+
+legacy_column = "rectified_product_table_ids"
+
+
+def arg_parser():
+    parser = argparse.ArgumentParser(
+            description=__doc__,
+            formatter_class=argparse.RawDescriptionHelpFormatter,
+            parents=[util.parent_parser()]
+    )
+    parser.add_argument(
+            "-c", "--config",
+            type=Path,
+            required=True,
+            help="Path to database configuration file."
+    )
+    parser.add_argument(
+            "--keep-column",
+            action='store_true',
+            help="Do not drop the pickled column after migrating it."
+    )
+    parser.add_argument(
+            "-b", "--batch-size",
+            type=int,
+            default=5000,
+            help="Number of association rows inserted per statement."
+    )
+    return parser
+
+
+def rectified_products_for_map(conn, kind, map_id):
+    """Returns the sorted Rectified_Products ids used by one map."""
+    assoc = map_tables[kind][1]
+    stmt = (
+        select(assoc.c.rectified_product_table_id)
+        .where(assoc.c.map_id == map_id)
+        .order_by(assoc.c.rectified_product_table_id)
+    )
+    return list(conn.execute(stmt).scalars())
+
+
+def maps_using_rectified_product(conn, rectified_product_table_id):
+    """Returns (kind, map_id) tuples for every map that uses a rectified
+    product, across all three kinds of map, from a single query."""
+    stmt = union_all(*[
+        select(literal(kind).label("kind"), assoc.c.map_id)
+        .where(assoc.c.rectified_product_table_id == rectified_product_table_id)
+        for kind, (_, assoc) in map_tables.items()
+    ])
+    return [(row.kind, row.map_id) for row in conn.execute(stmt)]
+
+
+def add_rectified_products(conn, kind, map_id, rectified_product_table_ids):
+    """Records rectified products as sources of a map."""
+    assoc = map_tables[kind][1]
+    rows = [
+        {"map_id": map_id, "rectified_product_table_id": r}
+        for r in sorted(set(rectified_product_table_ids))
+    ]
+    if rows:
+        conn.execute(assoc.insert(), rows)
+
+
+def migrate_pickled_maps(engine, drop_column=True, batch_size=5000):
+    """Copies the pickled rectified_product_table_ids lists into the
+    association tables.
+
+    Tables that no longer have the pickled column, and maps that already
+    have association rows, are skipped, so this is safe to run more than
+    once. The column is dropped afterwards unless
+    drop_column is False.  Note that the pickled values are unpickled, so
+    only run this against a database you trust.
+
+    Returns a dict of kind to the number of association rows written.
+    """
+    counts = {}
+    for kind, (map_table, assoc) in map_tables.items():
+        assoc.create(bind=engine, checkfirst=True)
+        cols = [c["name"] for c in inspect(engine).get_columns(map_table.name)]
+        if legacy_column not in cols:
+            logger.info(f"{map_table.name} has no {legacy_column}, skipping.")
+            continue
+
+        def assoc_rows(conn):
+            legacy = select(map_table.c.id, column(legacy_column)).select_from(
+                map_table
+            ).where(~exists().where(assoc.c.map_id == map_table.c.id))
+            for map_id, pickled in conn.execute(legacy):
+                if pickled is None:
+                    continue
+                for r in sorted(set(pickle.loads(pickled))):
+                    yield {"map_id": map_id, "rectified_product_table_id": r}
+
+        counts[kind] = 0
+        with engine.begin() as conn:
+            for batch in batched(assoc_rows(conn), batch_size):
+                conn.execute(assoc.insert(), batch)
+                counts[kind] += len(batch)
+
+            if drop_column:
+                prep = conn.dialect.identifier_preparer
+                conn.exec_driver_sql(
+                    f"ALTER TABLE {prep.format_table(map_table)} "
+                    f"DROP COLUMN {prep.quote(legacy_column)}"
+                )
+        logger.info(
+            f"Migrated {counts[kind]} {kind} map sources into {assoc.name}."
+        )
+    return counts
+
+
+if __name__ == "__main__":
+    args = arg_parser().parse_args()
+    util.set_logger(args.verbose)
+
+    Base, engine, db = new_db(args.config)
+    counts = migrate_pickled_maps(
+        engine, drop_column=not args.keep_column, batch_size=args.batch_size
+    )
+    print(counts)
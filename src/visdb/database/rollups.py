@@ -0,0 +1,325 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+""" Maintains, and reports from, the Catalog_Summaries rollups.
+
+Catalog_Summaries holds the frame count, total exposure time, and
+instrument temperature range of the Raw_Products of each instrument, UTC
+day, mission phase, and compression. The bulk loader and the label
+crawler keep it up to date before each commit: the totals of newly
+inserted rows are added to the rollups, and the days in which existing
+rows were updated are summarized again from Raw_Products, which only
+reads the rows of those days. Reports then read the rollups, whose size
+grows with the number of days rather than the number of images.
+
+Run with --rebuild to summarize all of Raw_Products from scratch, for
+example after Raw_Products has been changed by other means. Otherwise
+the daily summary over the given range is printed.
+"""
+
+# Copyright 2022, United States Government as represented by the
+# Administrator of the National Aeronautics and Space Administration.
+# All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+# Reuse is permitted under the terms of the license.
+# The AUTHORS file and the LICENSE file are at the
+# top level of this library.
+
+import argparse
+import datetime
+import logging
+from pathlib import Path
+import time
+from sqlalchemy import BigInteger, and_, cast, delete, func, insert, or_
+from sqlalchemy import select
+from sqlalchemy.dialects import postgresql, sqlite
+
+import sys
+import os
+sys.path.insert(1, os.path.join(sys.path[0],'../../../../vipersci/src'))
+from vipersci import util
+
+from db_utility import new_db
+import table_catalog_summary as tcs
+import table_raw_products as tb
+
+logger = logging.getLogger(__name__)
+
+raw = tb.Raw_Product.__table__
+summary = tcs.Catalog_Summary.__table__
+
+"""The Catalog_Summaries columns that identify a rollup."""
+group_columns = [
+    "instrument_name", "day", "mission_phase", "compression_type",
+    "compression_ratio",
+]
+
+"""How daily_summary() groups by default."""
+default_by = ("instrument_name", "day", "mission_phase")
+
+
+def arg_parser():
+    parser = argparse.ArgumentParser(
+            description=__doc__,
+            formatter_class=argparse.RawDescriptionHelpFormatter,
+            parents=[util.parent_parser()]
+    )
+    parser.add_argument(
+            "-c", "--config",
+            type=Path,
+            required=True,
+            help="Path to database configuration file."
+    )
+    parser.add_argument(
+            "--rebuild",
+            action='store_true',
+            help="Summarize all of Raw_Products again."
+    )
+    parser.add_argument(
+            "-s", "--start",
+            type=datetime.date.fromisoformat,
+            help="First day (YYYY-MM-DD) to report."
+    )
+    parser.add_argument(
+            "-e", "--end",
+            type=datetime.date.fromisoformat,
+            help="Day (YYYY-MM-DD) to report up to, but not including."
+    )
+    parser.add_argument(
+            "-i", "--instrument",
+            help="Instrument name to report."
+    )
+    parser.add_argument(
+            "-p", "--mission-phase",
+            help="Mission phase to report."
+    )
+    return parser
+
+
+def summarize(where=None):
+    """Returns an INSERT of the rollups of the Raw_Products selected by
+    where (all of them if None)."""
+    day = func.date(raw.c.start_time)
+    stmt = select(
+        raw.c.instrument_name,
+        day,
+        raw.c.mission_phase,
+        raw.c.compression_type,
+        raw.c.compression_ratio,
+        func.count(),
+        func.sum(raw.c.exposure_time),
+        func.min(raw.c.instrument_temperature),
+        func.max(raw.c.instrument_temperature),
+        func.sum(raw.c.instrument_temperature),
+    ).group_by(
+        raw.c.instrument_name, day, raw.c.mission_phase,
+        raw.c.compression_type, raw.c.compression_ratio,
+    )
+    if where is not None:
+        stmt = stmt.where(where)
+    return insert(summary).from_select(
+        [c.name for c in summary.columns], stmt
+    )
+
+
+def aggregate(rows, into=None):
+    """Adds up Raw_Products rows into rollups, keyed like group_columns.
+
+    The totals are added to the dict into, if given, which is returned.
+    """
+    totals = {} if into is None else into
+    for r in rows:
+        key = (
+            r["instrument_name"], r["start_time"].replace(tzinfo=None).date(),
+            r["mission_phase"], r["compression_type"], r["compression_ratio"],
+        )
+        t = r["instrument_temperature"]
+        total = totals.get(key)
+        if total is None:
+            totals[key] = [1, r["exposure_time"], t, t, t]
+        else:
+            total[0] += 1
+            total[1] += r["exposure_time"]
+            total[2] = min(total[2], t)
+            total[3] = max(total[3], t)
+            total[4] += t
+    return totals
+
+
+def add(conn, totals):
+    """Adds the totals from aggregate() to the rollups.
+
+    This is only right for rows that are new to Raw_Products; rows that
+    replace others need refresh() instead.
+    """
+    if not totals:
+        return
+    if conn.dialect.name == "postgresql":
+        stmt = postgresql.insert(summary)
+        least, greatest = func.least, func.greatest
+    elif conn.dialect.name == "sqlite":
+        stmt = sqlite.insert(summary)
+        # SQLite's min() and max() of more than one value are scalar.
+        least, greatest = func.min, func.max
+    else:
+        raise NotImplementedError(
+            f"Adding to rollups is not supported for {conn.dialect.name}."
+        )
+    c, new = summary.c, stmt.excluded
+    stmt = stmt.on_conflict_do_update(
+        index_elements=group_columns,
+        set_={
+            "frames": c.frames + new.frames,
+            "exposure_time": c.exposure_time + new.exposure_time,
+            "temperature_min": least(c.temperature_min, new.temperature_min),
+            "temperature_max": greatest(c.temperature_max, new.temperature_max),
+            "temperature_sum": c.temperature_sum + new.temperature_sum,
+        }
+    )
+    names = [col.name for col in summary.columns]
+    conn.execute(
+        stmt, [dict(zip(names, k + tuple(v))) for k, v in totals.items()]
+    )
+
+
+def touched_days(rows):
+    """Returns the (instrument_name, day) pairs of Raw_Products rows."""
+    return {
+        (r["instrument_name"], r["start_time"].replace(tzinfo=None).date())
+        for r in rows
+    }
+
+
+def refresh(conn, days):
+    """Summarizes again the given (instrument_name, day) pairs.
+
+    Their rollups are deleted and rebuilt from the Raw_Products of those
+    instruments and days, in conn's transaction, so that the rollups
+    commit, or not, with the rows they summarize. Each day is a range on
+    the instrument and start_time index.
+    """
+    if not days:
+        return
+    one = datetime.timedelta(days=1)
+    summary_where = or_(*[
+        and_(summary.c.instrument_name == i, summary.c.day == d)
+        for i, d in days
+    ])
+    raw_where = or_(*[
+        and_(
+            raw.c.instrument_name == i,
+            raw.c.start_time >= datetime.datetime.combine(d, datetime.time()),
+            raw.c.start_time < datetime.datetime.combine(d + one, datetime.time()),
+        )
+        for i, d in days
+    ])
+    conn.execute(delete(summary).where(summary_where))
+    conn.execute(summarize(raw_where))
+
+
+def rebuild(engine):
+    """Replaces all of the rollups with a summary of all of Raw_Products."""
+    start = time.perf_counter()
+    summary.create(bind=engine, checkfirst=True)
+    with engine.begin() as conn:
+        conn.execute(delete(summary))
+        conn.execute(summarize())
+        n = conn.execute(select(func.count()).select_from(summary)).scalar()
+    logger.info(
+        f"Rebuilt {n} rollups in {time.perf_counter() - start:.2f} s"
+    )
+    return n
+
+
+def _filtered(stmt, start, end, instrument_name, mission_phase):
+    if start is not None:
+        stmt = stmt.where(summary.c.day >= start)
+    if end is not None:
+        stmt = stmt.where(summary.c.day < end)
+    if instrument_name is not None:
+        stmt = stmt.where(summary.c.instrument_name == tb.vis_instruments.get(
+            instrument_name, instrument_name
+        ))
+    if mission_phase is not None:
+        stmt = stmt.where(summary.c.mission_phase == mission_phase)
+    return stmt
+
+
+def daily_summary(
+    conn, start=None, end=None, instrument_name=None, mission_phase=None,
+    by=default_by
+):
+    """Returns the rollups for the days from start up to end, combined
+    over every column not in by.
+
+    Each row has the by columns, frames, exposure_time (the total),
+    and temperature_min, temperature_max, and temperature_mean.
+    """
+    keys = [summary.c[c] for c in by]
+    frames = cast(func.sum(summary.c.frames), BigInteger)
+    stmt = select(
+        *keys,
+        frames.label("frames"),
+        # PostgreSQL sums bigints as numeric.
+        cast(func.sum(summary.c.exposure_time), BigInteger).label(
+            "exposure_time"
+        ),
+        func.min(summary.c.temperature_min).label("temperature_min"),
+        func.max(summary.c.temperature_max).label("temperature_max"),
+        (func.sum(summary.c.temperature_sum) / frames).label(
+            "temperature_mean"
+        ),
+    ).group_by(*keys).order_by(*keys)
+    return conn.execute(
+        _filtered(stmt, start, end, instrument_name, mission_phase)
+    ).all()
+
+
+def compression_mix(
+    conn, start=None, end=None, instrument_name=None, mission_phase=None,
+    by=("instrument_name",)
+):
+    """Returns the number of frames of each compression type and ratio,
+    for the days from start up to end, for each combination of by."""
+    keys = [summary.c[c] for c in by]
+    compression = [summary.c.compression_type, summary.c.compression_ratio]
+    stmt = select(
+        *keys, *compression,
+        cast(func.sum(summary.c.frames), BigInteger).label("frames")
+    ).group_by(*keys, *compression).order_by(*keys, *compression)
+    return conn.execute(
+        _filtered(stmt, start, end, instrument_name, mission_phase)
+    ).all()
+
+
+if __name__ == "__main__":
+    args = arg_parser().parse_args()
+    util.set_logger(args.verbose)
+
+    Base, engine, db = new_db(args.config)
+
+    if args.rebuild:
+        print(f"{rebuild(engine)} rollups")
+    else:
+        with engine.connect() as conn:
+            rows = daily_summary(
+                conn, args.start, args.end, args.instrument,
+                args.mission_phase
+            )
+        print("\t".join(rows[0]._fields if rows else default_by))
+        for row in rows:
+            print("\t".join(str(v) for v in row))
@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+""" Geohash encoding for indexing lunar surface positions.
+
+A geohash interleaves the bits of the longitude and latitude into a short
+base-32 string, so points that are close together usually share a long
+common prefix, and every prefix is a latitude/longitude cell. Storing the
+geohash in an ordinary B-tree indexed column lets any database answer
+area searches with a few range scans, with no spatial extension needed.
+
+Positions are planetocentric degrees. Longitudes may be given in either
+the -180 to 180 or the 0 to 360 convention.
+"""
+
+# Copyright 2022, United States Government as represented by the
+# Administrator of the National Aeronautics and Space Administration.
+# All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+# Reuse is permitted under the terms of the license.
+# The AUTHORS file and the LICENSE file are at the
+# top level of this library.
+
+import math
+
+base32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+_decode = {c: i for i, c in enumerate(base32)}
+
+"""Nine characters is a cell of about 1.3 m of latitude on the Moon."""
+default_precision = 9
+
+moon_radius_km = 1737.4
+
+
+def normalize_longitude(lon):
+    """Returns lon in the range [-180, 180)."""
+    return ((lon + 180.0) % 360.0) - 180.0
+
+
+def longitude_range(min_lon, max_lon):
+    """Returns a longitude range normalized to [-180, 180].
+
+    A range that spans 360 degrees or more becomes [-180, 180]. Otherwise
+    the result has min_lon greater than max_lon when the range crosses
+    the antimeridian.
+    """
+    if max_lon - min_lon >= 360.0:
+        return -180.0, 180.0
+    min_lon = normalize_longitude(min_lon)
+    max_lon = normalize_longitude(max_lon)
+    if max_lon == -180.0 and min_lon != -180.0:
+        max_lon = 180.0
+    return min_lon, max_lon
+
+
+def geohash_encode(lat, lon, precision=default_precision):
+    """Returns the geohash string of a latitude and longitude."""
+    if not -90.0 <= lat <= 90.0:
+        raise ValueError(f"Latitude {lat} is outside of [-90, 90].")
+    lon = normalize_longitude(lon)
+    lat_lo, lat_hi = -90.0, 90.0
+    lon_lo, lon_hi = -180.0, 180.0
+    chars = []
+    bits = 0
+    n = 0
+    even = True
+    while len(chars) < precision:
+        if even:
+            mid = (lon_lo + lon_hi) / 2
+            if lon >= mid:
+                bits = (bits << 1) | 1
+                lon_lo = mid
+            else:
+                bits <<= 1
+                lon_hi = mid
+        else:
+            mid = (lat_lo + lat_hi) / 2
+            if lat >= mid:
+                bits = (bits << 1) | 1
+                lat_lo = mid
+            else:
+                bits <<= 1
+                lat_hi = mid
+        even = not even
+        n += 1
+        if n == 5:
+            chars.append(base32[bits])
+            bits = 0
+            n = 0
+    return "".join(chars)
+
+
+def geohash_bounds(geohash):
+    """Returns the (min_lat, min_lon, max_lat, max_lon) of a geohash cell."""
+    lat_lo, lat_hi = -90.0, 90.0
+    lon_lo, lon_hi = -180.0, 180.0
+    even = True
+    for c in geohash:
+        value = _decode[c]
+        for shift in range(4, -1, -1):
+            bit = (value >> shift) & 1
+            if even:
+                mid = (lon_lo + lon_hi) / 2
+                if bit:
+                    lon_lo = mid
+                else:
+                    lon_hi = mid
+            else:
+                mid = (lat_lo + lat_hi) / 2
+                if bit:
+                    lat_lo = mid
+                else:
+                    lat_hi = mid
+            even = not even
+    return lat_lo, lon_lo, lat_hi, lon_hi
+
+
+def cell_size(precision):
+    """Returns the (latitude, longitude) size in degrees of a geohash cell."""
+    lon_bits = (5 * precision + 1) // 2
+    lat_bits = (5 * precision) // 2
+    return 180.0 / 2 ** lat_bits, 360.0 / 2 ** lon_bits
+
+
+def prefix_successor(prefix):
+    """Returns the smallest geohash prefix that sorts after every geohash
+    starting with prefix, or None if there is none.
+
+    The range [prefix, prefix_successor(prefix)) then selects exactly the
+    geohashes with that prefix, using only characters of the geohash
+    alphabet, so it does not depend on how the database collates
+    punctuation.
+    """
+    chars = list(prefix)
+    while chars:
+        i = _decode[chars[-1]]
+        if i + 1 < len(base32):
+            chars[-1] = base32[i + 1]
+            return "".join(chars)
+        chars.pop()
+    return None
+
+
+def covering_prefixes(min_lat, min_lon, max_lat, max_lon, max_cells=32):
+    """Returns the geohash prefixes of cells that cover a bounding box.
+
+    The precision is the finest one at which the box is covered by no more
+    than max_cells cells. The box may cross the antimeridian, in which case
+    min_lon is greater than max_lon.
+    """
+    min_lon, max_lon = longitude_range(min_lon, max_lon)
+    if min_lon > max_lon:
+        return covering_prefixes(
+            min_lat, min_lon, max_lat, 180.0, max_cells
+        ) | covering_prefixes(
+            min_lat, -180.0, max_lat, max_lon, max_cells
+        )
+
+    precision = 1
+    for p in range(default_precision, 0, -1):
+        dlat, dlon = cell_size(p)
+        n_lat = math.floor(max_lat / dlat) - math.floor(min_lat / dlat) + 1
+        n_lon = math.floor(max_lon / dlon) - math.floor(min_lon / dlon) + 1
+        if n_lat * n_lon <= max_cells:
+            precision = p
+            break
+
+    dlat, dlon = cell_size(precision)
+    prefixes = set()
+    lat = min_lat
+    while True:
+        lon = min_lon
+        while True:
+            prefixes.add(geohash_encode(
+                min(lat, 90.0), min(lon, 180.0 - 1e-9), precision
+            ))
+            if lon >= max_lon:
+                break
+            lon = min(lon + dlon, max_lon)
+        if lat >= max_lat:
+            break
+        lat = min(lat + dlat, max_lat)
+    return prefixes
+
+
+def radius_bounds(lat, lon, radius_km, body_radius_km=moon_radius_km):
+    """Returns a (min_lat, min_lon, max_lat, max_lon) box that contains the
+    circle of radius_km around a point.
+
+    Near a pole, where the circle reaches the pole or the meridians
+    converge too much, the box spans every longitude.
+    """
+    dlat = math.degrees(radius_km / body_radius_km)
+    min_lat = max(lat - dlat, -90.0)
+    max_lat = min(lat + dlat, 90.0)
+    cos_lat = math.cos(math.radians(max(abs(min_lat), abs(max_lat))))
+    if min_lat <= -90.0 or max_lat >= 90.0 or dlat / cos_lat >= 180.0:
+        return min_lat, -180.0, max_lat, 180.0
+    dlon = dlat / cos_lat
+    return (
+        min_lat, normalize_longitude(lon - dlon),
+        max_lat, normalize_longitude(lon + dlon)
+    )
+
+
+def surface_distance(lat1, lon1, lat2, lon2, body_radius_km=moon_radius_km):
+    """Returns the great-circle distance in km between two points."""
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    dp = p2 - p1
+    dl = math.radians(lon2 - lon1)
+    a = (
+        math.sin(dp / 2) ** 2 +
+        math.cos(p1) * math.cos(p2) * math.sin(dl / 2) ** 2
+    )
+    return 2 * body_radius_km * math.asin(min(1.0, math.sqrt(a)))
@@ -29,7 +29,7 @@ sqlAlchemy ORM as much as possible."""
 import argparse
 import sqlalchemy as sql
 from sqlalchemy import orm
-from sqlalchemy import Integer, String, Text, Column, Boolean, Float, Identity, DateTime
+from sqlalchemy import Integer, String, Text, Column, Boolean, Float, Identity, DateTime, ForeignKey
 from sqlalchemy import select, table, create_engine
 from sqlalchemy.exc import OperationalError
 from sqlalchemy.orm import validates
@@ -38,6 +38,8 @@ import yaml
 from sqlalchemy_utils import database_exists, create_database
 from sqlalchemy.ext.declarative import as_declarative, declared_attr
 
+import table_undistorted_products as undistorted
+
 Base = orm.declarative_base()
 
 class Anaglyph_Product(Base):
@@ -48,8 +50,12 @@ class Anaglyph_Product(Base):
     """We need two rows from the undistorted table. The left and right looks.
     This doesn't require a separate mapping table, I don't think."""
     
-    left_undistored_table_id = Column(Integer, ForeignKey("Undistorted_Product.id"))
-    right_undistored_table_id = Column(Integer, ForeignKey("Undistorted_Product.id"))
+    left_undistored_table_id = Column(
+        Integer, ForeignKey(undistorted.Undistorted_Product.__table__.c.id)
+    )
+    right_undistored_table_id = Column(
+        Integer, ForeignKey(undistorted.Undistorted_Product.__table__.c.id)
+    )
 
     """What other data are required to be stored in this table?
     * Obviously the left and right undistored (or is it rectified) images.
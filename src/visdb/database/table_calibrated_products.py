@@ -28,7 +28,7 @@
 import argparse
 import sqlalchemy as sql
 from sqlalchemy import orm
-from sqlalchemy import Integer, String, Text, Column, Boolean, Float, Identity, DateTime
+from sqlalchemy import Integer, String, Text, Column, Boolean, Float, Identity, DateTime, ForeignKey
 from sqlalchemy import select, table, create_engine
 from sqlalchemy.exc import OperationalError
 from sqlalchemy.orm import validates
@@ -44,7 +44,9 @@ class Calibrated_Product(Base):
 
     id = Column(Integer, Identity(start=1), primary_key = True)
     cal_product_id = Column(String, nullable=False)
-    raw_table_id = Column(Integer, ForeignKey("Raw_Product.id"))
+    # Not a foreign key: on PostgreSQL, Raw_Products is partitioned, and
+    # its primary key also includes start_time.
+    raw_table_id = Column(Integer)
     software_version = Column(String, nullable=False)
 
     def emit_pds_label():
@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+""" Builds the Catalog_Summaries table object using the
+sqlAlchemy ORM as much as possible."""
+
+# Copyright 2022, United States Government as represented by the
+# Administrator of the National Aeronautics and Space Administration.
+# All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+# Reuse is permitted under the terms of the license.
+# The AUTHORS file and the LICENSE file are at the
+# top level of this library.
+
+from sqlalchemy import orm
+from sqlalchemy import BigInteger, Column, Date, Float, Index, Integer, String
+
+Base = orm.declarative_base()
+
+class Catalog_Summary(Base):
+    """Rollups of the Raw_Products of one instrument on one UTC day, in one
+    mission phase, with one kind of compression.
+
+    The temperature mean is temperature_sum / frames; the sum is kept
+    instead of the mean so that rows can be added together. These rows
+    are derived from Raw_Products by rollups.py, and are never edited
+    directly.
+    """
+    __tablename__ = 'Catalog_Summaries'
+
+    instrument_name = Column(String, primary_key=True)
+    day = Column(Date, primary_key=True)
+    mission_phase = Column(String, primary_key=True)
+    compression_type = Column(String, primary_key=True)
+    compression_ratio = Column(Float, primary_key=True)
+    frames = Column(Integer, nullable=False)
+    exposure_time = Column(BigInteger, nullable=False)
+    temperature_min = Column(Float, nullable=False)
+    temperature_max = Column(Float, nullable=False)
+    temperature_sum = Column(Float, nullable=False)
+
+    """Reports over a range of days, for every instrument."""
+    __table_args__ = (
+        Index("ix_Catalog_Summaries_day", day),
+    )
@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+""" Builds the File_Verifications table object using the
+sqlAlchemy ORM as much as possible."""
+
+# Copyright 2022, United States Government as represented by the
+# Administrator of the National Aeronautics and Space Administration.
+# All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+# Reuse is permitted under the terms of the license.
+# The AUTHORS file and the LICENSE file are at the
+# top level of this library.
+
+from sqlalchemy import orm
+from sqlalchemy import BigInteger, Column, DateTime, Float, Index, Integer
+from sqlalchemy import String
+
+Base = orm.declarative_base()
+
+class File_Verification(Base):
+    """The result of the last checksum verification of each Raw_Product's
+    file on disk.
+
+    The size and mtime are those of the file when it was hashed, so a
+    later pass can skip a file that verified correctly and has not
+    changed since. The status is one of 'ok', 'mismatch', 'missing', or
+    'error'.
+    """
+    __tablename__ = 'File_Verifications'
+
+    raw_product_table_id = Column(Integer, primary_key=True)
+    path = Column(String, nullable=False)
+    size = Column(BigInteger)
+    mtime = Column(Float)
+    checksum = Column(String)
+    status = Column(String, nullable=False)
+    verified_at = Column(DateTime, nullable=False)
+
+    """Audits list the failures, which should be few."""
+    __table_args__ = (
+        Index("ix_File_Verifications_status", status),
+    )
@@ -29,9 +29,8 @@ sqlAlchemy ORM as much as possible."""
 import argparse
 import sqlalchemy as sql
 from sqlalchemy import orm
-from sqlalchemy import Integer, String, Text, Column, Boolean, Float, 
-from sqlalchemy import Identity, DateTime, PickleType
-from sqlalchemy.ext.mutable import MutableList
+from sqlalchemy import Integer, String, Text, Column, Boolean, Float
+from sqlalchemy import Identity, DateTime, ForeignKey, Index, Table
 from sqlalchemy import select, table, create_engine 
 from sqlalchemy.exc import OperationalError
 from sqlalchemy.orm import validates
@@ -40,19 +39,37 @@ import yaml
 from sqlalchemy_utils import database_exists, create_database
 from sqlalchemy.ext.declarative import as_declarative, declared_attr
 
+import table_hazard_products as hazard
+import table_rectified_products as rectified
+
 Base = orm.declarative_base()
 
 class Hazard_Rectified_Map(Base):
     __tablename__ = 'Hazard_Rectified_Maps'
 
     id = Column(Integer, Identity(start=1), primary_key = True)
-    hazard_product_table_id = Column(Integer, ForeignKey("Hazard_Product.id"))
-
-    """Note that the following column is not stored in the database as a python list
-    object, but rather as a pickled MutableList object from sqlalchemy, so more 
-    care probably needs to be taken when reading/writing this, but it's especially
-    important to know that it's not necessarily accessible outside of sqlalchemy."""
-    rectified_product_table_ids = Column(MutableList.as_mutable(PickleType), 
-                                         default=[])
-    
+    hazard_product_table_id = Column(
+        Integer, ForeignKey(hazard.Hazard_Product.__table__.c.id)
+    )
+
     software_version = Column(String, nullable=False)
+
+    """The source Rectified_Products of this map are rows in the
+    Hazard_Rectified_Sources association table, one row per source product.
+    These were once a pickled list in a rectified_product_table_ids column;
+    see rectified_maps.py for the migration and the lookup queries."""
+
+
+hazard_rectified_sources = Table(
+    'Hazard_Rectified_Sources', Base.metadata,
+    Column("map_id", Integer,
+           ForeignKey("Hazard_Rectified_Maps.id", ondelete="CASCADE"),
+           primary_key=True),
+    Column("rectified_product_table_id", Integer,
+           ForeignKey(rectified.Rectified_Product.__table__.c.id),
+           primary_key=True),
+    # The composite primary key serves map -> rectified product lookups,
+    # this index serves rectified product -> map lookups.
+    Index("ix_Hazard_Rectified_Sources_rectified_product",
+          "rectified_product_table_id", "map_id"),
+)
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+""" Builds the Product_Jobs table object using the
+sqlAlchemy ORM as much as possible."""
+
+# Copyright 2022, United States Government as represented by the
+# Administrator of the National Aeronautics and Space Administration.
+# All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+# Reuse is permitted under the terms of the license.
+# The AUTHORS file and the LICENSE file are at the
+# top level of this library.
+
+from sqlalchemy import orm
+from sqlalchemy import Column, DateTime, Index, Integer, String, Text
+from sqlalchemy import UniqueConstraint
+
+Base = orm.declarative_base()
+
+class Product_Job(Base):
+    """A job to make the derived product of one level from a source
+    product, run by the workers of product_jobs.py.
+
+    The source is named like a lineage product, by its table and id, and
+    level is the kind of product to make from it. A job is pending until
+    a worker claims it, which makes it running until visible_at, when, if
+    the worker has not finished it, it may be claimed again. Each claim
+    sets a new lease, and only the holder of the current lease can finish
+    the job, as done (with the id of the product made) or, once its
+    attempts are used up, as failed.
+    """
+    __tablename__ = 'Product_Jobs'
+
+    id = Column(Integer, primary_key=True)
+    source_type = Column(String, nullable=False)
+    source_id = Column(Integer, nullable=False)
+    level = Column(String, nullable=False)
+    status = Column(String, nullable=False, default="pending")
+    attempts = Column(Integer, nullable=False, default=0)
+    visible_at = Column(DateTime, nullable=False)
+    created_at = Column(DateTime, nullable=False)
+    claimed_at = Column(DateTime)
+    finished_at = Column(DateTime)
+    worker = Column(String)
+    lease = Column(String)
+    product_id = Column(Integer)
+    error = Column(Text)
+
+    """There is one job per source and level, and workers look for jobs
+    by status and visible_at."""
+    __table_args__ = (
+        UniqueConstraint(source_type, source_id, level),
+        Index("ix_Product_Jobs_ready", status, visible_at),
+    )
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+""" Builds the Product_Lineage closure table object using the
+sqlAlchemy ORM as much as possible."""
+
+# Copyright 2022, United States Government as represented by the
+# Administrator of the National Aeronautics and Space Administration.
+# All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+# Reuse is permitted under the terms of the license.
+# The AUTHORS file and the LICENSE file are at the
+# top level of this library.
+
+from sqlalchemy import orm
+from sqlalchemy import Integer, String, Column, Index
+
+Base = orm.declarative_base()
+
+class Product_Lineage(Base):
+    """One row for every (ancestor, descendant) pair of products in the
+    processing chain, not just for direct parents, so that the whole
+    upstream or downstream set of a product is a single indexed lookup.
+
+    Products live in different tables, so each one is identified by the
+    name of its table (e.g. 'Raw_Products') and its id in that table.
+    The depth is the number of processing steps between the two.
+    """
+    __tablename__ = 'Product_Lineage'
+
+    ancestor_type = Column(String, primary_key=True)
+    ancestor_id = Column(Integer, primary_key=True)
+    descendant_type = Column(String, primary_key=True)
+    descendant_id = Column(Integer, primary_key=True)
+    depth = Column(Integer, nullable=False)
+
+    """The primary key serves downstream lookups, this index serves
+    upstream lookups."""
+    __table_args__ = (
+        Index(
+            "ix_Product_Lineage_descendant",
+            descendant_type, descendant_id, depth
+        ),
+    )
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+""" Builds the Query_Plans table object using the
+sqlAlchemy ORM as much as possible."""
+
+# Copyright 2022, United States Government as represented by the
+# Administrator of the National Aeronautics and Space Administration.
+# All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+# Reuse is permitted under the terms of the license.
+# The AUTHORS file and the LICENSE file are at the
+# top level of this library.
+
+from sqlalchemy import orm
+from sqlalchemy import JSON, Column, DateTime, Float, Index, Integer, String
+
+Base = orm.declarative_base()
+
+class Query_Plan(Base):
+    """A query plan captured by query_plans.py.
+
+    The run names the capture that the plan was part of, so that the
+    plans of one run can be compared with those of another. The plan is
+    PostgreSQL's EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) output, or the
+    EXPLAIN QUERY PLAN of SQLite as a tree of the same shape. The
+    seq_scans are the large tables that the plan reads in full.
+    """
+    __tablename__ = 'Query_Plans'
+
+    id = Column(Integer, primary_key=True)
+    run = Column(String, nullable=False)
+    captured_at = Column(DateTime, nullable=False)
+    statement = Column(String, nullable=False)
+    parameters = Column(String)
+    plan = Column(JSON, nullable=False)
+    planning_ms = Column(Float)
+    execution_ms = Column(Float)
+    seq_scans = Column(JSON)
+
+    """Plans are looked up by run."""
+    __table_args__ = (
+        Index("ix_Query_Plans_run", run, captured_at),
+    )
@@ -31,7 +31,8 @@ import sqlalchemy as sql
 from sqlalchemy.sql import func
 from sqlalchemy import orm
 from sqlalchemy import Integer, String, Text, Column, Boolean, Float
-from sqlalchemy import Identity, DateTime, PickleType
+from sqlalchemy import Identity, DateTime, PickleType, ForeignKey, Index
+from sqlalchemy import event
 from sqlalchemy.ext.mutable import MutableList
 from sqlalchemy import select, table, create_engine 
 from sqlalchemy.exc import OperationalError
@@ -41,13 +42,17 @@ import yaml
 from sqlalchemy_utils import database_exists, create_database
 from sqlalchemy.ext.declarative import as_declarative, declared_attr
 
+from spatial_index import geohash_encode
+
 Base = orm.declarative_base()
 
 class Observation_Geometry(Base):
     __tablename__ = 'Observation_Geometries'
 
     id = Column(Integer, Identity(start=1), primary_key = True)
-    raw_product_table_id = Column(Integer, ForeignKey("Raw_Product.id"))
+    # Not a foreign key: on PostgreSQL, Raw_Products is partitioned, and
+    # its primary key also includes start_time.
+    raw_product_table_id = Column(Integer)
     software_version = Column(String, nullable=False)
     emission_angle = Column(Float, nullable=False)
     incidence_angle = Column(Float, nullable=False)
@@ -62,6 +67,19 @@ class Observation_Geometry(Base):
     solar_longitude = Column(Float, nullable=False)
     local_time = Column(DateTime, nullable=False)
 
+    """The geohash of the image center, which is kept in step with the
+    latitude and longitude on every insert and update. Nearby points share
+    geohash prefixes, so the B-tree index on it turns "which images cover
+    this spot?" into a handful of range scans; see footprint_query.py."""
+    image_center_geohash = Column(String(12), nullable=True)
+
+    __table_args__ = (
+        Index(
+            "ix_Observation_Geometries_image_center_geohash",
+            image_center_geohash
+        ),
+    )
+
     """
     What other geometries are valid?
     For this table, it's a map to the Raw_Products table, so it should not include
@@ -80,5 +98,17 @@ class Observation_Geometry(Base):
     function itself, but we don’t invoke it ourselves. In the case of a SQL 
     function, invoking func.now() returns the SQL expression object that will 
     render the “NOW” function into the SQL being emitted."""
-    last_update = Column(DateTime, onupdate=func.utc_timestamp(), nullable=False)
+    last_update = Column(DateTime, default=func.now(), onupdate=func.now(),
+                         nullable=False)
+
 
+@event.listens_for(Observation_Geometry, "before_insert")
+@event.listens_for(Observation_Geometry, "before_update")
+def _set_geohash(mapper, connection, target):
+    if (
+        target.image_center_latitude is not None and
+        target.image_center_longitude is not None
+    ):
+        target.image_center_geohash = geohash_encode(
+            target.image_center_latitude, target.image_center_longitude
+        )
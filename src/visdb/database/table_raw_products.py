@@ -25,10 +25,12 @@
 # The AUTHORS file and the LICENSE file are at the
 # top level of this library.
 
+import functools
 import sys
 import os
 from sqlalchemy import orm
-from sqlalchemy import Integer, String, Text, Column, Boolean, Float, Identity, DateTime
+from sqlalchemy import Integer, String, Text, Column, Float, Identity, DateTime
+from sqlalchemy import Computed, Index, SmallInteger, or_
 from sqlalchemy.ext.hybrid import hybrid_property
 
 sys.path.insert(1, os.path.join(sys.path[0], '../..'))
@@ -37,6 +39,166 @@ from vipersci.pds.pid import VISID, vis_instruments, vis_compression
 
 Base = orm.declarative_base()
 
+"""The mission phase that most operational queries are restricted to. The
+Raw_Products partial index covers only rows from this phase, so it should
+be updated (and the index rebuilt) when the mission moves to a new phase."""
+active_mission_phase = "PSP"
+
+
+@functools.lru_cache(maxsize=4096)
+def parse_pid(pid):
+    """Returns the VISID for a product_id string.
+
+    Parsed VISIDs are cached, so repeated product_id access on the same
+    rows does not re-run the regex parse. The returned VISID is shared, so
+    treat it as read-only.
+    """
+    return VISID(pid)
+
+
+def resolve_product_id(kwargs):
+    """Returns the VISID for a set of Raw_Product keyword arguments.
+
+    Either product_id must be given, in which case any start_time,
+    instrument_name, or compression_ratio also given must agree with it,
+    or each of start_time, instrument_name, and compression_ratio must be
+    given so that a VISID can be built from them.  The kwargs are not
+    modified.
+    """
+    if "product_id" in kwargs:
+        pid = VISID(kwargs["product_id"])
+
+        if "start_time" in kwargs and pid.datetime() != kwargs["start_time"]:
+            raise ValueError(
+                f"The product_id datetime ({pid.datetime()}) and the "
+                f"provided start_time ({kwargs['start_time']}) disagree."
+            )
+
+        if (
+            "instrument_name" in kwargs and not (
+                vis_instruments[pid.instrument] == kwargs["instrument_name"] or
+                pid.instrument == kwargs["instrument_name"]
+            )
+        ):
+            raise ValueError(
+                f"The product_id instrument code ({pid.instrument}) and "
+                f"the provided instrument_name "
+                f"({kwargs['instrument_name']}) disagree."
+            )
+
+        if (
+            "compression_ratio" in kwargs and not (
+                vis_compression[pid.compression] == kwargs["compression_ratio"] or
+                pid.compression == kwargs["compression_ratio"]
+            )
+        ):
+            raise ValueError(
+                f"The product_id compression code ({pid.compression}) and "
+                f"the provided compression_ratio "
+                f"({kwargs['compression_ratio']}) disagree."
+            )
+
+        # Need another one of these if-statements for compression_type, but
+        # need to modify pid.py first.
+    elif (
+        kwargs.keys() >= {
+            "start_time", "instrument_name", "compression_ratio"
+        }
+    ):
+        pid = VISID(
+            kwargs["start_time"].date(),
+            kwargs["start_time"].time(),
+            # Need to update pid.py to take long-form of these two params.
+            kwargs["instrument_name"],
+            kwargs["compression_ratio"]
+        )
+    else:
+        raise ValueError(
+            "Either product_id must be given, or each of start_time, "
+            "instrument_name, and compression_ratio."
+        )
+
+    return pid
+
+
+"""The lights whose on/off states are packed, in this bit order, into the
+Raw_Products lighting bitmask. The hazard lights have the high bits, so
+any of them being on is the single range lighting >= 4."""
+lights = (
+    "NavLight_Left_On", "NavLight_Right_On",
+    "HazLight_U_On", "HazLight_V_On", "HazLight_W_On",
+    "HazLight_X_On", "HazLight_Y_On", "HazLight_Z_On",
+)
+light_bits = {name: 1 << i for i, name in enumerate(lights)}
+navlight_mask = light_bits["NavLight_Left_On"] | light_bits["NavLight_Right_On"]
+hazlight_mask = sum(b for n, b in light_bits.items() if n.startswith("Haz"))
+all_lights = (1 << len(lights)) - 1
+
+
+def lighting_mask(record):
+    """Returns the lighting bitmask for a mapping of light names (as in
+    lights) to on/off states. Lights that are not in it are off."""
+    return sum(bit for name, bit in light_bits.items() if record.get(name))
+
+
+def lighting_filter(column, mask, all_on=False):
+    """Returns a filter on a lighting column for any of the lights in mask
+    being on, or, if all_on, all of them.
+
+    The filter lists the lighting values that match, as ranges where
+    they are contiguous and otherwise with IN, rather than testing bits,
+    so that the lighting index can be used either way.
+    """
+    values = [
+        v for v in range(all_lights + 1)
+        if (v & mask == mask if all_on else v & mask)
+    ]
+    ranges = []
+    for v in values:
+        if ranges and ranges[-1][1] == v - 1:
+            ranges[-1][1] = v
+        else:
+            ranges.append([v, v])
+    if len(ranges) > 4:
+        return column.in_(values)
+    return or_(*[
+        column == lo if lo == hi else column.between(lo, hi)
+        for lo, hi in ranges
+    ])
+
+
+def _light(name):
+    # A hybrid property for one light, in place of its old Boolean column.
+    bit = light_bits[name]
+
+    def get(self):
+        return bool((self.lighting or 0) & bit)
+
+    def set(self, on):
+        lighting = self.lighting or 0
+        self.lighting = lighting | bit if on else lighting & ~bit
+
+    def expr(cls):
+        return lighting_filter(cls.lighting, bit)
+
+    return hybrid_property(get, set, expr=expr)
+
+
+def product_id_columns(pid):
+    """Returns the column values that are derived from a product_id.
+
+    These are the same values that the Raw_Product.product_id setter
+    assigns, keyed by database column name, so that Core inserts which
+    bypass the ORM stay consistent with it.
+    """
+    vid = parse_pid(str(pid))
+    return {
+        "product_id": str(vid),
+        "start_time": vid.datetime(),
+        "instrument_name": vis_instruments[vid.instrument],
+        "compression_ratio": vis_compression[vid.compression],
+    }
+
 
 class Raw_Product(Base):
     """ Note that SQLAlchemy will default the table name to the name of the
@@ -46,6 +208,10 @@ class Raw_Product(Base):
     """
     __tablename__ = 'Raw_Products'
 
+    """The column that Raw_Products is range partitioned on, where it is
+    partitioned."""
+    partition_key = "start_time"
+
     id = Column(Integer, Identity(start=1), primary_key=True)
     _pid = Column("product_id", String, nullable=False)
     instrument_name = Column(String, nullable=False)
@@ -57,14 +223,23 @@ class Raw_Product(Base):
     bad_pixel_table_id = Column(Integer, nullable=False)
     exposure_time = Column(Integer, nullable=False)
     exposure_type = Column(String, nullable=False)
-    NavLight_Left_On = Column(Boolean, nullable=False)
-    NavLight_Right_On = Column(Boolean, nullable=False)
-    HazLight_U_On = Column(Boolean, nullable=False)
-    HazLight_V_On = Column(Boolean, nullable=False)
-    HazLight_W_On = Column(Boolean, nullable=False)
-    HazLight_X_On = Column(Boolean, nullable=False)
-    HazLight_Y_On = Column(Boolean, nullable=False)
-    HazLight_Z_On = Column(Boolean, nullable=False)
+
+    """The states of the lights, one bit each (see lights). The old Boolean
+    attributes are hybrid properties over it, which in SQL are filters:
+    where(Raw_Product.HazLight_U_On), or lighting_filter() for several
+    lights at once."""
+    lighting = Column(
+        SmallInteger, nullable=False, default=0, server_default="0"
+    )
+    NavLight_Left_On = _light("NavLight_Left_On")
+    NavLight_Right_On = _light("NavLight_Right_On")
+    HazLight_U_On = _light("HazLight_U_On")
+    HazLight_V_On = _light("HazLight_V_On")
+    HazLight_W_On = _light("HazLight_W_On")
+    HazLight_X_On = _light("HazLight_X_On")
+    HazLight_Y_On = _light("HazLight_Y_On")
+    HazLight_Z_On = _light("HazLight_Z_On")
+
     purpose = Column(String, nullable=False)
     compression_type = Column(String, nullable=False)
     compression_ratio = Column(Float, nullable=False)
@@ -83,63 +258,66 @@ class Raw_Product(Base):
     source_file_name = Column(String, nullable=False)
     pixel_bits = Column(Integer, nullable=False)
 
+    """The VISID components of the product_id, generated by the database so
+    that they can be indexed and filtered on in SQL. A product_id is
+    YYMMDD-hhmmss[fff]-iii-c, so the date leads, the instrument code and
+    compression code trail, and the time is whatever lies between."""
+    pid_date = Column(
+        String, Computed("substr(product_id, 1, 6)", persisted=True)
+    )
+    pid_time = Column(
+        String,
+        Computed("substr(product_id, 8, length(product_id) - 13)", persisted=True)
+    )
+    pid_instrument = Column(
+        String,
+        Computed("substr(product_id, length(product_id) - 4, 3)", persisted=True)
+    )
+    pid_compression = Column(
+        String,
+        Computed("substr(product_id, length(product_id), 1)", persisted=True)
+    )
+
+    """Indexes for the common lookups: by product_id, by instrument over a
+    time range, by time range alone (a BRIN index is tiny and suits
+    start_time, which grows with insertion order), by instrument and
+    time within the active mission phase, and by lighting. The BRIN and partial options
+    only apply to PostgreSQL; other databases get plain B-tree indexes.
+
+    On PostgreSQL the table may be range partitioned on start_time (see
+    partitions.py), and a unique index on a partitioned table must
+    include the partition key. The product_id determines the start_time,
+    so the product_id index carries start_time too without weakening
+    the uniqueness of product_id."""
+    __table_args__ = (
+        Index("ix_Raw_Products_product_id", _pid, start_time, unique=True),
+        Index(
+            "ix_Raw_Products_instrument_start_time",
+            instrument_name, start_time
+        ),
+        Index(
+            "ix_Raw_Products_start_time_brin",
+            start_time,
+            postgresql_using="brin"
+        ),
+        Index(
+            "ix_Raw_Products_active_phase",
+            instrument_name, start_time,
+            postgresql_where=(mission_phase == active_mission_phase),
+            sqlite_where=(mission_phase == active_mission_phase)
+        ),
+        Index("ix_Raw_Products_pid_date", pid_date),
+        Index(
+            "ix_Raw_Products_pid_instrument_date", pid_instrument, pid_date
+        ),
+        Index("ix_Raw_Products_pid_compression", pid_compression),
+        Index("ix_Raw_Products_lighting", lighting),
+    )
+
     def __init__(self, **kwargs):
-        print("in init")
-        if "product_id" in kwargs:
-            pid = VISID(kwargs["product_id"])
-
-            if "start_time" in kwargs and pid.datetime() != kwargs["start_time"]:
-                raise ValueError(
-                    f"The product_id datetime ({pid.datetime()}) and the "
-                    f"provided start_time ({kwargs['start_time']}) disagree."
-                )
-
-            if (
-                "instrument_name" in kwargs and not (
-                    vis_instruments[pid.instrument] == kwargs["instrument_name"] or
-                    pid.instrument == kwargs["instrument_name"]
-                )
-            ):
-                raise ValueError(
-                    f"The product_id instrument code ({pid.instrument}) and "
-                    f"the provided instrument_name "
-                    f"({kwargs['instrument_name']}) disagree."
-                )
-
-            if (
-                "compression_ratio" in kwargs and not (
-                    vis_compression[pid.compression] == kwargs["compression_ratio"] or
-                    pid.compression == kwargs["compression_ratio"]
-                )
-            ):
-                raise ValueError(
-                    f"The product_id compression code ({pid.compression}) and "
-                    f"the provided compression_ratio "
-                    f"({kwargs['compression_ratio']}) disagree."
-                )
-
-            # Need another one of these if-statements for compression_type, but
-            # need to modify pid.py first.
-
-            # Final cleanup so that super() works later.
-            del kwargs["product_id"]
-        elif (
-            kwargs.keys() >= {
-                "start_time", "instrument_name", "compression_ratio"
-            }
-        ):
-            pid = VISID(
-                kwargs["start_time"].date(),
-                kwargs["start_time"].time(),
-                # Need to update pid.py to take long-form of these two params.
-                kwargs["instrument_name"],
-                kwargs["compression_ratio"]
-            )
-        else:
-            raise ValueError(
-                "Either product_id must be given, or each of start_time, "
-                "instrument_name, and compression_ratio."
-            )
+        pid = resolve_product_id(kwargs)
+        # Final cleanup so that super() works later.
+        kwargs.pop("product_id", None)
 
         super().__init__(**kwargs)
         self.product_id = pid
@@ -148,15 +326,19 @@ class Raw_Product(Base):
 
     @hybrid_property
     def product_id(self):
-        return VISID(self._pid)
+        return parse_pid(self._pid)
+
+    @product_id.expression
+    def product_id(cls):
+        return cls._pid
 
     @product_id.setter
     def product_id(self, pid):
-        vid = VISID(pid)
-        self._pid = str(vid)
-        self.start_time = vid.datetime()
-        self.instrument_name = vis_instruments[vid.instrument]
-        self.compression_ratio = vis_compression[vid.compression]
+        cols = product_id_columns(pid)
+        self._pid = cols["product_id"]
+        self.start_time = cols["start_time"]
+        self.instrument_name = cols["instrument_name"]
+        self.compression_ratio = cols["compression_ratio"]
 
     def emit_pds_label():
         """This should pull from Ross's code when it's been updated."""
@@ -164,6 +346,4 @@ class Raw_Product(Base):
         pass
 
     def __repr__(self):
-        # This is not what a __repr__() should do.  Let's remove for now.
-        print(f"<VISDS Raw Product with raw_product_ID: {self.raw_product_id}>")
-        return(f"<VISDS Raw Product with raw_product_ID: {self.raw_product_id}>")
+        return f"<VISDS Raw Product {self.id}: {self._pid}>"
@@ -27,14 +27,16 @@
 import argparse
 import sqlalchemy as sql
 from sqlalchemy import orm
-from sqlalchemy import Integer, String, Text, Column, Boolean, Float, 
-from sqlalchemy import Identity, DateTime
+from sqlalchemy import Integer, String, Text, Column, Boolean, Float
+from sqlalchemy import Identity, DateTime, ForeignKey
 from sqlalchemy import select, table, create_engine
 from sqlalchemy.exc import OperationalError
 from sqlalchemy.orm import validates
 import datetime
 from sqlalchemy.ext.declarative import as_declarative, declared_attr
 
+import table_undistorted_products as undistorted
+
 Base = orm.declarative_base()
 
 class Rectified_Product(Base):
@@ -42,7 +44,9 @@ class Rectified_Product(Base):
 
     id = Column(Integer, Identity(start=1), primary_key = True)
     rectified_product_id = Column(String, nullable=False)
-    undistorted_table_id = Column(Integer, ForeignKey("Undistorted_Product.id"))
+    undistorted_table_id = Column(
+        Integer, ForeignKey(undistorted.Undistorted_Product.__table__.c.id)
+    )
     software_version = Column(String, nullable=False)
 
     def emit_pds_label():
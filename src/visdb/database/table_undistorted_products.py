@@ -28,7 +28,7 @@
 import argparse
 import sqlalchemy as sql
 from sqlalchemy import orm
-from sqlalchemy import Integer, String, Text, Column, Boolean, Float, Identity, DateTime
+from sqlalchemy import Integer, String, Text, Column, Boolean, Float, Identity, DateTime, ForeignKey
 from sqlalchemy import select, table, create_engine
 from sqlalchemy.exc import OperationalError
 from sqlalchemy.orm import validates
@@ -37,6 +37,8 @@ import yaml
 from sqlalchemy_utils import database_exists, create_database
 from sqlalchemy.ext.declarative import as_declarative, declared_attr
 
+import table_calibrated_products as calibrated
+
 Base = orm.declarative_base()
 
 class Undistorted_Product(Base):
@@ -44,8 +46,12 @@ class Undistorted_Product(Base):
 
     id = Column(Integer, Identity(start=1), primary_key = True)
     undistored_product_id = Column(String, nullable=False)
-    raw_table_id = Column(Integer, ForeignKey("Raw_Product.id"))
-    cal_table_id = Column(Integer, ForeignKey("Calibrated_Product.id"))
+    # Not a foreign key: on PostgreSQL, Raw_Products is partitioned, and
+    # its primary key also includes start_time.
+    raw_table_id = Column(Integer)
+    cal_table_id = Column(
+        Integer, ForeignKey(calibrated.Calibrated_Product.__table__.c.id)
+    )
     software_version = Column(String, nullable=False)
 
     def emit_pds_label():
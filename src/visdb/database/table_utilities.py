@@ -10,11 +10,13 @@ from sqlalchemy_utils import database_exists, create_database
 from sqlalchemy.ext.declarative import as_declarative, declared_attr
 from sqlalchemy import MetaData
 from table_raw_products import *
+from partitions import create_raw_products, config_interval
+import db_engine
 
 def get_engine(url):
     if not database_exists(url):
         create_database(url)
-    engine = create_engine(url, echo=True)
+    engine = db_engine.get_engine(url)
     return(engine)
 
 if __name__ == "__main__":
@@ -86,7 +88,7 @@ if __name__ == "__main__":
     """ Build the session to connect to the database."""
     with orm.Session(engine) as session:
         session.begin()
-        Raw_Product.__table__.create(bind=engine, checkfirst=True)
+        create_raw_products(engine, config_interval(db))
         try:
             print("Adding row...\n")
             session.add(test_raw)
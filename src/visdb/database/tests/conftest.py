@@ -0,0 +1,109 @@
+# Copyright 2022, United States Government as represented by the
+# Administrator of the National Aeronautics and Space Administration.
+# All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+# Reuse is permitted under the terms of the license.
+# The AUTHORS file and the LICENSE file are at the
+# top level of this library.
+
+"""Fixtures for the database module tests.
+
+The modules in the database directory import each other by their bare
+names, so that directory is put on sys.path. Every test that takes the
+engine fixture runs against a new SQLite file, and also against
+PostgreSQL if VISDB_TEST_POSTGRES_URL names a database whose public
+tables the tests may drop.
+"""
+
+import os
+from pathlib import Path
+import sys
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import db_engine  # noqa: E402
+import table_anaglyph_products  # noqa: E402
+import table_calibrated_products  # noqa: E402
+import table_hazard_products  # noqa: E402
+import table_hazard_rectified_map  # noqa: E402
+import table_mosaic_products  # noqa: E402
+import table_mosaic_rectified_map  # noqa: E402
+import table_panorama_products  # noqa: E402
+import table_panorama_rectified_map  # noqa: E402
+import table_product_lineage  # noqa: E402
+import table_rectified_products  # noqa: E402
+import table_undistorted_products  # noqa: E402
+
+postgres_url = os.environ.get("VISDB_TEST_POSTGRES_URL")
+
+
+def _drop_public_tables(engine):
+    with engine.begin() as conn:
+        names = conn.exec_driver_sql(
+            "SELECT tablename FROM pg_tables WHERE schemaname = 'public'"
+        ).scalars().all()
+        for name in names:
+            conn.exec_driver_sql(f'DROP TABLE IF EXISTS "{name}" CASCADE')
+
+
+@pytest.fixture
+def sqlite_engine(tmp_path):
+    engine = db_engine.get_engine(f"sqlite:///{tmp_path / 'test.db'}")
+    yield engine
+    db_engine.dispose_all()
+
+
+@pytest.fixture
+def postgresql_engine():
+    if not postgres_url:
+        pytest.skip("VISDB_TEST_POSTGRES_URL is not set.")
+    engine = db_engine.get_engine(postgres_url)
+    _drop_public_tables(engine)
+    yield engine
+    db_engine.dispose_all()
+
+
+@pytest.fixture(params=["sqlite", "postgresql"])
+def engine(request):
+    return request.getfixturevalue(f"{request.param}_engine")
+
+
+"""The modules of the derived product tables, each after those its
+foreign keys refer to."""
+product_modules = [
+    table_calibrated_products,
+    table_undistorted_products,
+    table_rectified_products,
+    table_anaglyph_products,
+    table_hazard_products,
+    table_mosaic_products,
+    table_panorama_products,
+    table_hazard_rectified_map,
+    table_mosaic_rectified_map,
+    table_panorama_rectified_map,
+    table_product_lineage,
+]
+
+
+@pytest.fixture
+def product_tables(engine):
+    """The engine, with the derived product tables made by create_all."""
+    for module in product_modules:
+        module.Base.metadata.create_all(engine)
+    return engine
@@ -0,0 +1,52 @@
+# Copyright 2022, United States Government as represented by the
+# Administrator of the National Aeronautics and Space Administration.
+# All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+# Reuse is permitted under the terms of the license.
+# The AUTHORS file and the LICENSE file are at the
+# top level of this library.
+
+from sqlalchemy import func, select
+
+import bench_raw_product_indexes as bench
+import table_raw_products as tb
+
+
+def test_fill_table(postgresql_engine):
+    table = bench.bench_table()
+    table.indexes.clear()
+    with postgresql_engine.begin() as conn:
+        conn.exec_driver_sql(f"CREATE SCHEMA {bench.bench_schema}")
+        try:
+            table.create(bind=conn)
+            bench.fill_table(conn, table, 70)
+
+            lighting = conn.execute(
+                select(table.c.lighting, func.count())
+                .group_by(table.c.lighting)
+                .order_by(table.c.lighting)
+            ).all()
+            assert lighting == [(0, 60), (tb.all_lights, 10)]
+            assert conn.scalar(
+                select(func.count()).select_from(table).where(
+                    tb.lighting_filter(table.c.lighting, tb.navlight_mask)
+                )
+            ) == 10
+        finally:
+            conn.exec_driver_sql(
+                f"DROP SCHEMA {bench.bench_schema} CASCADE"
+            )
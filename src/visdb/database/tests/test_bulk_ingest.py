@@ -0,0 +1,80 @@
+# Copyright 2022, United States Government as represented by the
+# Administrator of the National Aeronautics and Space Administration.
+# All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+# Reuse is permitted under the terms of the license.
+# The AUTHORS file and the LICENSE file are at the
+# top level of this library.
+
+from sqlalchemy import func, select
+
+import benchmark
+import bulk_ingest
+import partitions
+import table_raw_products as tb
+
+raw = tb.Raw_Product.__table__
+
+
+def count(engine):
+    with engine.connect() as conn:
+        return conn.execute(select(func.count()).select_from(raw)).scalar()
+
+
+def test_copy_supported(engine):
+    with engine.connect() as conn:
+        assert bulk_ingest.copy_supported(conn) == (
+            engine.dialect.name == "postgresql"
+        )
+
+
+def test_bulk_insert(engine):
+    partitions.create_raw_products(engine)
+    stats = bulk_ingest.bulk_insert_raw_products(
+        engine, benchmark.synthetic_records(250), batch_size=100,
+        commit_interval=200
+    )
+    assert stats.rows == stats.inserted == count(engine) == 250
+    assert stats.batches == 3
+    assert stats.commits == 2
+
+
+def test_upsert_counts(engine, monkeypatch):
+    partitions.create_raw_products(engine)
+    bulk_ingest.bulk_insert_raw_products(
+        engine, benchmark.synthetic_records(100)
+    )
+
+    def no_copy(*args, **kwargs):
+        raise AssertionError("COPY was used with use_copy=False.")
+    monkeypatch.setattr(bulk_ingest, "copy_rows", no_copy)
+
+    changed = list(benchmark.synthetic_records(10, start=40))
+    for r in changed:
+        r["purpose"] = "changed"
+    records = (
+        list(benchmark.synthetic_records(50, start=50))
+        + list(benchmark.synthetic_records(10, start=60))
+        + changed
+    )
+    stats = bulk_ingest.bulk_insert_raw_products(
+        engine, records, batch_size=1000, use_copy=False, upsert=True
+    )
+    assert (stats.inserted, stats.updated, stats.unchanged) == (0, 10, 50)
+    assert stats.duplicates == 10
+    assert stats.rows == stats.inserted + stats.updated + stats.unchanged
+    assert count(engine) == 100
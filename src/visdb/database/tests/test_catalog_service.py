@@ -0,0 +1,183 @@
+# Copyright 2022, United States Government as represented by the
+# Administrator of the National Aeronautics and Space Administration.
+# All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+# Reuse is permitted under the terms of the license.
+# The AUTHORS file and the LICENSE file are at the
+# top level of this library.
+
+import asyncio
+import json
+
+import benchmark
+import bulk_ingest
+import catalog_service
+import db_engine
+import db_metrics
+import lineage
+import partitions
+import product_jobs
+
+
+async def _get(engine, target, **options):
+    # Returns the status and body of one request to a CatalogService.
+    service = catalog_service.CatalogService(engine, **options)
+    server = await asyncio.start_server(service.handle, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    try:
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(
+            f"GET {target} HTTP/1.1\r\nConnection: close\r\n\r\n".encode()
+        )
+        response = await reader.read()
+        writer.close()
+    finally:
+        server.close()
+        await server.wait_closed()
+        await engine.dispose()
+    head, body = response.split(b"\r\n\r\n", 1)
+    if b"Transfer-Encoding: chunked" in head:
+        chunks = []
+        while True:
+            size, body = body.split(b"\r\n", 1)
+            if not int(size, 16):
+                break
+            chunks.append(body[:int(size, 16)])
+            body = body[int(size, 16) + 2:]
+        body = b"".join(chunks)
+    return int(head.split(b" ")[1]), body
+
+
+def get(url, target, **options):
+    return asyncio.run(
+        _get(db_engine.get_async_engine(url), target, **options)
+    )
+
+
+def catalog(engine, n=20):
+    # Loads n synthetic Raw_Products, and makes the products derived from
+    # them, with their lineage. Returns the engine's URL.
+    partitions.create_raw_products(engine)
+    for level in product_jobs.levels.values():
+        level.product.create(bind=engine)
+    lineage.closure.create(bind=engine)
+    bulk_ingest.bulk_insert_raw_products(
+        engine, benchmark.synthetic_records(n)
+    )
+    product_jobs.enqueue_backlog(engine)
+    product_jobs.Worker(engine, poll_interval=0).run(drain=True)
+    return engine.url.render_as_string(hide_password=False)
+
+
+def test_unknown_instrument(engine):
+    partitions.create_raw_products(engine)
+    url = engine.url.render_as_string(hide_password=False)
+    window = "start=2024-01-01T00:00:00&stop=2024-01-02T00:00:00"
+
+    status, body = asyncio.run(_get(
+        db_engine.get_async_engine(url), f"/products?instrument=xyz&{window}"
+    ))
+    assert status == 400
+    assert "xyz" in json.loads(body)["error"]
+
+    for instrument in ("ncl", "NavCam%20Left"):
+        status, body = asyncio.run(_get(
+            db_engine.get_async_engine(url),
+            f"/products?instrument={instrument}&{window}"
+        ))
+        assert status == 200
+
+
+def test_product(engine):
+    url = catalog(engine)
+    pid = benchmark.synthetic_pid(3)
+
+    status, body = get(url, f"/products/{pid}")
+    assert status == 200
+    row = json.loads(body)
+    assert row["product_id"] == pid
+    assert row["start_time"] == "2024-01-01T00:00:00"
+
+    assert get(url, "/products/nope")[0] == 400
+    status, body = get(url, "/products/240101-000000-ncl-z")
+    assert status == 404
+    assert get(url, "/nope")[0] == 404
+
+
+def test_products(engine):
+    url = catalog(engine)
+    window = "start=2024-01-01T00:00:00&stop=2024-01-02T00:00:00"
+
+    status, body = get(
+        url, f"/products?instrument=ncl&{window}&columns=product_id,lighting",
+        page_size=2
+    )
+    assert status == 200
+    rows = [json.loads(line) for line in body.decode().splitlines()]
+    # Rows 0, 9, and 18 are from the left NavCam.
+    assert rows == [
+        {"product_id": benchmark.synthetic_pid(i), "lighting": lighting}
+        for i, lighting in ((0, 255), (9, 0), (18, 0))
+    ]
+
+    status, body = get(url, f"/products?instrument=ncl&{window}&limit=2")
+    assert [json.loads(line)["id"] for line in body.decode().splitlines()] \
+        == [1, 10]
+    assert get(url, f"/products?instrument=ncl&{window}&columns=x")[0] == 400
+    assert get(url, "/products?instrument=ncl")[0] == 400
+
+
+def test_lineage(engine):
+    url = catalog(engine)
+    pid = benchmark.synthetic_pid(3)
+
+    status, body = get(url, f"/products/{pid}/lineage")
+    assert status == 200
+    assert [
+        (r["product_type"], r["depth"]) for r in json.loads(body)
+    ] == [
+        ("Calibrated_Products", 1),
+        ("Undistorted_Products", 2),
+        ("Rectified_Products", 3),
+    ]
+    assert json.loads(
+        get(url, f"/products/{pid}/lineage?direction=upstream")[1]
+    ) == []
+
+    rect = json.loads(body)[-1]["product_id"]
+    status, body = get(
+        url, f"/lineage/Rectified_Products/{rect}?direction=upstream"
+    )
+    assert status == 200
+    assert json.loads(body)[-1] == {
+        "product_type": "Raw_Products", "product_id": 4, "depth": 3
+    }
+    assert get(url, "/lineage/Raw_Products/4?direction=sideways")[0] == 400
+    assert get(url, "/lineage/Raw_Products/four")[0] == 400
+
+
+def test_health_and_metrics(engine):
+    url = catalog(engine, 1)
+    status, body = get(url, "/health")
+    assert status == 200
+    assert json.loads(body) == {"status": "ok"}
+
+    db_metrics.instrument(db_engine.get_async_engine(url).sync_engine)
+    get(url, "/health")
+    status, body = get(url, "/metrics")
+    assert status == 200
+    assert b"visdb_db_statement_duration_seconds_count" in body
@@ -0,0 +1,47 @@
+# Copyright 2022, United States Government as represented by the
+# Administrator of the National Aeronautics and Space Administration.
+# All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+# Reuse is permitted under the terms of the license.
+# The AUTHORS file and the LICENSE file are at the
+# top level of this library.
+
+import os
+
+import db_engine
+
+
+def backend_pid(engine):
+    with engine.connect() as conn:
+        return conn.exec_driver_sql("SELECT pg_backend_pid()").scalar()
+
+
+def test_dispose_all_after_fork(postgresql_engine):
+    url = postgresql_engine.url.render_as_string(hide_password=False)
+    before = backend_pid(postgresql_engine)
+    pid = os.fork()
+    if pid == 0:
+        status = 1
+        try:
+            db_engine.dispose_all(close=False)
+            if backend_pid(db_engine.get_engine(url)) != before:
+                status = 0
+        finally:
+            os._exit(status)
+    assert os.waitpid(pid, 0)[1] == 0
+    # The parent's pooled connection was left open.
+    assert backend_pid(postgresql_engine) == before
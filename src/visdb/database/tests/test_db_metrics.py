@@ -0,0 +1,53 @@
+# Copyright 2022, United States Government as represented by the
+# Administrator of the National Aeronautics and Space Administration.
+# All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+# Reuse is permitted under the terms of the license.
+# The AUTHORS file and the LICENSE file are at the
+# top level of this library.
+
+from sqlalchemy import text
+
+import db_metrics
+
+
+def _rows(engine, statement):
+    m = db_metrics.metrics(engine)
+    return m.statements[db_metrics.normalize(statement)].rows
+
+
+def test_select_rows(engine):
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE metrics_test (id INTEGER)"))
+        conn.execute(
+            text("INSERT INTO metrics_test (id) VALUES (:id)"),
+            [{"id": i} for i in range(25)]
+        )
+        conn.execute(text("UPDATE metrics_test SET id = id + 1 WHERE id < 5"))
+
+    select = "SELECT id FROM metrics_test"
+    with engine.connect() as conn:
+        assert len(conn.execute(text(select)).all()) == 25
+        # Server-side, where the dialect has them.
+        result = conn.execution_options(stream_results=True).execute(
+            text(select)
+        )
+        assert len(result.fetchmany(10)) == 10
+        result.close()
+
+    assert _rows(engine, select) == 35
+    assert _rows(engine, "UPDATE metrics_test SET id = id + 1 WHERE id < 5") == 5
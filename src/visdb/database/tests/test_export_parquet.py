@@ -0,0 +1,73 @@
+# Copyright 2022, United States Government as represented by the
+# Administrator of the National Aeronautics and Space Administration.
+# All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+# Reuse is permitted under the terms of the license.
+# The AUTHORS file and the LICENSE file are at the
+# top level of this library.
+
+import datetime
+
+import pyarrow.parquet as pq
+
+import benchmark
+import bulk_ingest
+import export_parquet
+import partitions
+import table_raw_observation_geometry as tog
+
+
+def test_export(engine, tmp_path):
+    partitions.create_raw_products(engine)
+    tog.Base.metadata.create_all(engine)
+    bulk_ingest.bulk_insert_raw_products(
+        engine, benchmark.synthetic_records(30)
+    )
+    with engine.begin() as conn:
+        conn.execute(export_parquet.geometry.insert(), [
+            dict(
+                raw_product_table_id=i, software_version="1",
+                emission_angle=0.0, incidence_angle=80.0, phase_angle=80.0,
+                image_center_latitude=-85.0, image_center_longitude=10.0,
+                north_azimuth=0.0, sub_solar_azimuth=0.0,
+                sub_solar_latitude=0.0, sub_solar_longitude=0.0,
+                solar_distance=1.5e8, solar_longitude=0.0,
+                local_time=datetime.datetime(2024, 1, 1),
+            )
+            for i in range(1, 11)
+        ])
+
+    # The output directory is made as needed.
+    output = tmp_path / "export" / "catalog"
+    for table, n in [
+        (export_parquet.raw, 30), (export_parquet.geometry, 10)
+    ]:
+        assert export_parquet.export_table(
+            engine, table, output, batch_size=7
+        ) == n
+        assert pq.read_table(output / table.name).num_rows == n
+
+    bulk_ingest.bulk_insert_raw_products(
+        engine, benchmark.synthetic_records(5, start=30)
+    )
+    assert export_parquet.export_table(
+        engine, export_parquet.raw, output, incremental=True
+    ) == 5
+    assert pq.read_table(output / export_parquet.raw.name).num_rows == 35
+    assert export_parquet.read_state(output)[export_parquet.raw.name][
+        "last_id"
+    ] == 35
@@ -0,0 +1,100 @@
+# Copyright 2022, United States Government as represented by the
+# Administrator of the National Aeronautics and Space Administration.
+# All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+# Reuse is permitted under the terms of the license.
+# The AUTHORS file and the LICENSE file are at the
+# top level of this library.
+
+import datetime
+
+from sqlalchemy import orm
+
+import benchmark
+import bulk_ingest
+import footprint_query
+import partitions
+import table_raw_observation_geometry as tog
+
+geometry = tog.Observation_Geometry.__table__
+
+"""Image centers of Raw_Products 1 to 4: two close together, one across
+the antimeridian, and one far away."""
+centers = [(-85.0, 10.0), (-85.01, 10.02), (-85.0, 179.99), (10.0, 90.0)]
+
+
+def geometry_values(raw_id, lat, lon):
+    return dict(
+        raw_product_table_id=raw_id, software_version="1",
+        emission_angle=0.0, incidence_angle=80.0, phase_angle=80.0,
+        image_center_latitude=lat, image_center_longitude=lon,
+        north_azimuth=0.0, sub_solar_azimuth=0.0, sub_solar_latitude=0.0,
+        sub_solar_longitude=0.0, solar_distance=1.5e8, solar_longitude=0.0,
+        local_time=datetime.datetime(2024, 1, 1),
+    )
+
+
+def add_raw_products(engine):
+    partitions.create_raw_products(engine)
+    bulk_ingest.bulk_insert_raw_products(
+        engine, benchmark.synthetic_records(len(centers))
+    )
+
+
+def found(rows):
+    return sorted(row.id for row in rows)
+
+
+def test_search(engine):
+    add_raw_products(engine)
+    tog.Base.metadata.create_all(engine)
+    with orm.Session(engine) as session:
+        session.add_all(
+            tog.Observation_Geometry(**geometry_values(i, lat, lon))
+            for i, (lat, lon) in enumerate(centers, start=1)
+        )
+        session.commit()
+
+    with engine.connect() as conn:
+        assert found(footprint_query.images_near(conn, -85.0, 10.0, 5)) == [
+            1, 2
+        ]
+        assert found(footprint_query.images_in_bbox(
+            conn, -86.0, 179.0, -84.0, -179.0
+        )) == [3]
+    assert footprint_query.backfill_geohash(engine) == 0
+
+
+def test_backfill_old_table(engine):
+    add_raw_products(engine)
+    tog.Base.metadata.create_all(engine)
+    column = geometry.c.image_center_geohash
+    with engine.begin() as conn:
+        # The table as it was before the geohash column.
+        for index in geometry.indexes:
+            index.drop(bind=conn)
+        prep = conn.dialect.identifier_preparer
+        conn.exec_driver_sql(
+            f"ALTER TABLE {prep.format_table(geometry)} "
+            f"DROP COLUMN {prep.quote(column.name)}"
+        )
+        conn.execute(geometry.insert(), geometry_values(1, *centers[0]))
+
+    assert footprint_query.backfill_geohash(engine) == 1
+    assert not footprint_query.add_geohash_column(engine)
+    with engine.connect() as conn:
+        assert found(footprint_query.images_near(conn, -85.0, 10.0, 5)) == [1]
@@ -0,0 +1,85 @@
+# Copyright 2022, United States Government as represented by the
+# Administrator of the National Aeronautics and Space Administration.
+# All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+# Reuse is permitted under the terms of the license.
+# The AUTHORS file and the LICENSE file are at the
+# top level of this library.
+
+import datetime
+
+import numpy as np
+from sqlalchemy import select
+
+import geometry_batch
+import table_raw_observation_geometry as tog
+
+"""The inputs of three images. The second looks away from the Moon."""
+arrays = {
+    "raw_product_table_id": np.array([1, 2, 3]),
+    "position": np.array(
+        [[0.0, 0.0, 2000.0], [0.0, 0.0, 2000.0], [2000.0, 0.0, 0.0]]
+    ),
+    "boresight": np.array(
+        [[0.0, 0.0, -1.0], [0.0, 0.0, 1.0], [-1.0, 0.0, 0.0]]
+    ),
+    "sun_position": np.array([[1.5e8, 0.0, 0.0]] * 3),
+    "north_azimuth": np.array([0.0, 0.0, 0.0]),
+    "solar_longitude": np.array([10.0, 10.0, 10.0]),
+    "local_time": np.array(
+        ["2024-01-02T03:04:05.123456789", "2024-01-02T03:04:06",
+         "2024-01-02T03:04:07"],
+        dtype="datetime64[ns]"
+    ),
+}
+
+
+def test_geometry_rows_local_time_datetimes():
+    rows = geometry_batch.geometry_rows(
+        *[arrays[k][:2] for k in geometry_batch.npz_arrays],
+        software_version="1",
+    )
+    assert len(rows) == 1
+    row = rows[0]
+    assert row["raw_product_table_id"] == 1
+    assert row["local_time"] == datetime.datetime(2024, 1, 2, 3, 4, 5, 123456)
+    assert abs(row["image_center_latitude"] - 90) < 1e-6
+    assert isinstance(row["image_center_geohash"], str)
+
+
+def test_write_geometry(engine):
+    tog.Base.metadata.create_all(engine)
+    assert geometry_batch.write_geometry(
+        engine, arrays, "1", batch_size=2
+    ) == 2
+
+    table = geometry_batch.geometry_table
+    with engine.connect() as conn:
+        rows = conn.execute(
+            select(table).order_by(table.c.raw_product_table_id)
+        ).all()
+    assert [r.raw_product_table_id for r in rows] == [1, 3]
+    assert rows[0].local_time == datetime.datetime(2024, 1, 2, 3, 4, 5, 123456)
+    assert abs(rows[0].image_center_latitude - 90) < 1e-6
+    assert abs(rows[1].image_center_latitude) < 1e-6
+    assert abs(rows[1].image_center_longitude) < 1e-6
+    for r in rows:
+        assert r.image_center_geohash == tog.geohash_encode(
+            r.image_center_latitude, r.image_center_longitude
+        )
+        assert r.software_version == "1"
+        assert r.last_update is not None
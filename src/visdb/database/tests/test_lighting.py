@@ -0,0 +1,103 @@
+# Copyright 2022, United States Government as represented by the
+# Administrator of the National Aeronautics and Space Administration.
+# All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+# Reuse is permitted under the terms of the license.
+# The AUTHORS file and the LICENSE file are at the
+# top level of this library.
+
+from sqlalchemy import Boolean, Column, MetaData, Table, inspect, select
+
+import benchmark
+import bulk_ingest
+import lighting
+import table_raw_products as tb
+
+raw = tb.Raw_Product.__table__
+
+
+def legacy_raw_products(engine, n):
+    """Creates Raw_Products as it was, with a Boolean column per light
+    rather than the lighting bitmask, holding n synthetic records."""
+    legacy = Table(
+        raw.name, MetaData(),
+        *[
+            Column(c.name, c.type, primary_key=c.primary_key,
+                   nullable=c.nullable)
+            for c in raw.columns if c.name != "lighting"
+        ],
+        *[Column(name, Boolean, nullable=False) for name in tb.lights],
+    )
+    legacy.create(bind=engine)
+    records = []
+    for record in benchmark.synthetic_records(n):
+        record = bulk_ingest.raw_product_row(record)
+        mask = record.pop("lighting")
+        for name, bit in tb.light_bits.items():
+            record[name] = bool(mask & bit)
+        records.append(record)
+    with engine.begin() as conn:
+        conn.execute(legacy.insert(), records)
+
+
+def lighting_by_id(engine):
+    with engine.connect() as conn:
+        return dict(conn.execute(select(raw.c.id, raw.c.lighting)).all())
+
+
+def expected(start, n):
+    return {
+        i + 1: r["lighting"]
+        for i, r in enumerate(benchmark.synthetic_records(n, start), start)
+    }
+
+
+def test_migrate(engine):
+    legacy_raw_products(engine, 20)
+    assert lighting.migrate_lighting(engine) == 20
+    assert lighting_by_id(engine) == expected(0, 20)
+    cols = {c["name"] for c in inspect(engine).get_columns(raw.name)}
+    assert not cols.intersection(tb.lights)
+    assert lighting.migrate_lighting(engine) == 0
+
+
+def test_ingest_after_keeping_columns(engine):
+    legacy_raw_products(engine, 20)
+    assert lighting.migrate_lighting(engine, drop_columns=False) == 20
+
+    # Through COPY, where there is one, and through inserts.
+    bulk_ingest.bulk_insert_raw_products(
+        engine, benchmark.synthetic_records(10, start=20)
+    )
+    bulk_ingest.bulk_insert_raw_products(
+        engine, benchmark.synthetic_records(10, start=30), use_copy=False
+    )
+    assert lighting_by_id(engine) == expected(0, 40)
+
+    # A second run neither fills lighting again from the kept columns,
+    # which are false for the new rows, nor loses their values.
+    assert lighting.migrate_lighting(engine, drop_columns=False) == 0
+    assert lighting_by_id(engine) == expected(0, 40)
+    with engine.connect() as conn:
+        assert conn.execute(
+            select(Column("NavLight_Left_On")).select_from(raw)
+            .where(raw.c.id == 1)
+        ).scalar()
+
+    assert lighting.migrate_lighting(engine) == 0
+    cols = {c["name"] for c in inspect(engine).get_columns(raw.name)}
+    assert not cols.intersection(tb.lights)
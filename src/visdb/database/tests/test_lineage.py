@@ -0,0 +1,102 @@
+# Copyright 2022, United States Government as represented by the
+# Administrator of the National Aeronautics and Space Administration.
+# All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+# Reuse is permitted under the terms of the license.
+# The AUTHORS file and the LICENSE file are at the
+# top level of this library.
+
+from sqlalchemy import select
+
+import lineage
+import rectified_maps
+import table_calibrated_products as calibrated
+import table_mosaic_products as mosaic
+import table_mosaic_rectified_map as mosaic_map
+import table_rectified_products as rectified
+import table_undistorted_products as undistorted
+
+cal = calibrated.Calibrated_Product.__table__
+und = undistorted.Undistorted_Product.__table__
+rect = rectified.Rectified_Product.__table__
+mosaic_products = mosaic.Mosaic_Product.__table__
+mosaic_maps = mosaic_map.Mosaic_Rectified_Map.__table__
+
+
+def add_products(conn):
+    # Raw_Product 7 -> Calibrated 1 -> Undistorted 1 -> Rectified 1 and 2,
+    # which are the sources of Mosaic 1.
+    products = [
+        (cal, {"cal_product_id": "c1", "raw_table_id": 7}),
+        (und, {"undistored_product_id": "u1", "cal_table_id": 1}),
+        (rect, {"rectified_product_id": "r1", "undistorted_table_id": 1}),
+        (rect, {"rectified_product_id": "r2", "undistorted_table_id": 1}),
+        (mosaic_products, {}),
+        (mosaic_maps, {"mosaic_product_table_id": 1}),
+    ]
+    for table, values in products:
+        conn.execute(table.insert(), dict(values, software_version="1"))
+    rectified_maps.add_rectified_products(conn, "mosaic", 1, [1, 2])
+
+
+def closure_rows(conn):
+    return set(conn.execute(select(lineage.closure)).all())
+
+
+def test_closure(product_tables):
+    engine = product_tables
+    with engine.begin() as conn:
+        add_products(conn)
+        for product_type, product_id in [
+            (cal.name, 1), (und.name, 1), (rect.name, 1), (rect.name, 2),
+            (mosaic_products.name, 1),
+        ]:
+            assert lineage.record_product(conn, product_type, product_id)
+        recorded = closure_rows(conn)
+
+    assert lineage.rebuild_closure(engine) == len(recorded)
+    with engine.connect() as conn:
+        assert closure_rows(conn) == recorded
+        assert lineage.upstream(conn, mosaic_products.name, 1) == [
+            (rect.name, 1, 1), (rect.name, 2, 1), (und.name, 1, 2),
+            (cal.name, 1, 3), ("Raw_Products", 7, 4),
+        ]
+        assert [
+            (r.product_type, r.product_id)
+            for r in lineage.downstream(conn, "Raw_Products", 7)
+        ] == [
+            (cal.name, 1), (und.name, 1), (rect.name, 1), (rect.name, 2),
+            (mosaic_products.name, 1),
+        ]
+
+
+def test_lineage_tree(product_tables):
+    engine = product_tables
+    with engine.begin() as conn:
+        add_products(conn)
+    with engine.connect() as conn:
+        tree = lineage.lineage_tree(conn, und.name, 1)
+        assert sorted(tree, key=lambda e: (e.depth, e.child_id)) == [
+            (und.name, 1, rect.name, 1, 1),
+            (und.name, 1, rect.name, 2, 1),
+            (rect.name, 1, mosaic_products.name, 1, 2),
+            (rect.name, 2, mosaic_products.name, 1, 2),
+        ]
+        assert [
+            (e.parent_type, e.parent_id)
+            for e in lineage.lineage_tree(conn, und.name, 1, "upstream")
+        ] == [(cal.name, 1), ("Raw_Products", 7)]
@@ -0,0 +1,81 @@
+# Copyright 2022, United States Government as represented by the
+# Administrator of the National Aeronautics and Space Administration.
+# All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+# Reuse is permitted under the terms of the license.
+# The AUTHORS file and the LICENSE file are at the
+# top level of this library.
+
+from sqlalchemy import select
+
+import benchmark
+import bulk_ingest
+import db_engine
+import partitions
+import product_cache
+import table_raw_products as tb
+
+
+def load(engine, n=5):
+    partitions.create_raw_products(engine)
+    records = list(benchmark.synthetic_records(n))
+    bulk_ingest.bulk_insert_raw_products(engine, records)
+    return [str(r["product_id"]) for r in records]
+
+
+def test_columns_without_product_id(engine):
+    pids = load(engine)
+    cache = product_cache.ProductCache(engine, columns=["id", "lines"])
+    rows = cache.get_many(pids[:2])
+    assert sorted(rows) == sorted(pids[:2])
+    assert cache.get(pids[0]).lines == rows[pids[0]].lines
+
+
+def test_upsert_read_before_commit(engine):
+    pids = load(engine)
+    cache = product_cache.ProductCache(
+        engine, ttl=None, columns=["id", "purpose"]
+    )
+    assert cache.get(pids[0]).purpose != "changed"
+
+    record = next(benchmark.synthetic_records(1))
+    record["purpose"] = "changed"
+    with engine.connect() as conn:
+        with conn.begin():
+            bulk_ingest.upsert_rows(
+                conn, [bulk_ingest.raw_product_row(record)]
+            )
+            # Between the write and the commit, a lookup misses, and reads
+            # and caches the row as it was.
+            assert cache.get(pids[0]).purpose != "changed"
+    assert cache.get(pids[0]).purpose == "changed"
+
+
+def test_flush_read_before_commit(engine):
+    pids = load(engine)
+    cache = product_cache.ProductCache(engine, ttl=None)
+    assert cache.get(pids[1]).lines != 7
+
+    with db_engine.session(engine) as session:
+        product = session.execute(
+            select(tb.Raw_Product).where(tb.Raw_Product.product_id == pids[1])
+        ).scalar_one()
+        product.lines = 7
+        session.flush()
+        assert cache.get(pids[1]).lines != 7
+        session.commit()
+    assert cache.get(pids[1]).lines == 7
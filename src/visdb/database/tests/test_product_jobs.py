@@ -0,0 +1,173 @@
+# Copyright 2022, United States Government as represented by the
+# Administrator of the National Aeronautics and Space Administration.
+# All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+# Reuse is permitted under the terms of the license.
+# The AUTHORS file and the LICENSE file are at the
+# top level of this library.
+
+import pytest
+from sqlalchemy import func, select, update
+
+import benchmark
+import bulk_ingest
+import lineage
+import partitions
+import product_jobs
+
+
+def test_drain(engine):
+    partitions.create_raw_products(engine)
+    for level in product_jobs.levels.values():
+        level.product.create(bind=engine)
+    lineage.closure.create(bind=engine)
+    bulk_ingest.bulk_insert_raw_products(
+        engine, benchmark.synthetic_records(20)
+    )
+
+    assert product_jobs.enqueue_backlog(engine) == {
+        "Calibrated": 20, "Undistorted": 0, "Rectified": 0
+    }
+    worker = product_jobs.Worker(engine, poll_interval=0)
+    assert worker.run(drain=True) == {
+        "done": 60, "retried": 0, "failed": 0, "lost": 0
+    }
+    with engine.connect() as conn:
+        for level in product_jobs.levels.values():
+            sources = level.product.c[level.source_column]
+            assert conn.execute(
+                select(func.count(sources.distinct()))
+            ).scalar() == 20
+
+
+def _make_visible(engine):
+    # Brings every job's visible_at forward to now, as if the backoff or
+    # visibility timeout had passed.
+    with engine.begin() as conn:
+        conn.execute(update(product_jobs.jobs).values(
+            visible_at=product_jobs._now()
+        ))
+
+
+def test_claim_complete_fail(engine):
+    partitions.create_raw_products(engine)
+    for level in product_jobs.levels.values():
+        level.product.create(bind=engine)
+    lineage.closure.create(bind=engine)
+    bulk_ingest.bulk_insert_raw_products(
+        engine, benchmark.synthetic_records(3)
+    )
+    product_jobs.enqueue_backlog(engine, ["Calibrated"])
+
+    first = product_jobs.claim(engine, "w1", n=2)
+    assert [(j.status, j.attempts) for j in first] == [("running", 1)] * 2
+    (stale,) = product_jobs.claim(engine, "w2")
+    assert {j.source_id for j in first + [stale]} == {1, 2, 3}
+    assert product_jobs.claim(engine, "w2") == []
+
+    # Done, which queues the next level's job.
+    with product_jobs._begin(engine) as conn:
+        cal_id = product_jobs.make_product(conn, first[0])
+        assert product_jobs.complete(conn, first[0], cal_id)
+    # Put back for a retry, so not visible again until the backoff has
+    # passed.
+    assert product_jobs.fail(engine, first[1], "boom", max_attempts=2) \
+        == "pending"
+    claimed = product_jobs.claim(engine, "w1")
+    assert [(j.level, j.source_id) for j in claimed] == [
+        ("Undistorted", cal_id)
+    ]
+    # Handed back without using up an attempt.
+    product_jobs.release(engine, claimed)
+
+    # Once visible, the job w2 is still running is claimed again, and w2
+    # can neither complete nor fail it.
+    _make_visible(engine)
+    claimed = {
+        (j.level, j.source_id): j
+        for j in product_jobs.claim(engine, "w1", max_attempts=2)
+    }
+    assert {k: j.attempts for k, j in claimed.items()} == {
+        ("Calibrated", first[1].source_id): 2,
+        ("Calibrated", stale.source_id): 2,
+        ("Undistorted", cal_id): 1,
+    }
+    with product_jobs._begin(engine) as conn:
+        assert not product_jobs.complete(conn, stale, None)
+    assert product_jobs.fail(engine, stale, "late") is None
+
+    # Failed, once out of attempts, or out of time on the last attempt.
+    assert product_jobs.fail(
+        engine, claimed["Calibrated", first[1].source_id], "boom",
+        max_attempts=2
+    ) == "failed"
+    _make_visible(engine)
+    assert [
+        j.level for j in product_jobs.claim(engine, "w2", max_attempts=2)
+    ] == ["Undistorted"]
+
+    with engine.connect() as conn:
+        assert product_jobs.status_counts(conn) == {
+            ("Calibrated", "done"): 1,
+            ("Calibrated", "failed"): 2,
+            ("Undistorted", "running"): 1,
+        }
+    assert product_jobs.retry_failed(engine, "Calibrated") == 2
+    with engine.connect() as conn:
+        assert conn.execute(
+            select(product_jobs.jobs.c.status, product_jobs.jobs.c.attempts)
+            .where(product_jobs.jobs.c.id == stale.id)
+        ).one() == ("pending", 0)
+
+
+def test_worker_failures(engine):
+    partitions.create_raw_products(engine)
+    for level in product_jobs.levels.values():
+        level.product.create(bind=engine)
+    lineage.closure.create(bind=engine)
+    bulk_ingest.bulk_insert_raw_products(
+        engine, benchmark.synthetic_records(2)
+    )
+    product_jobs.enqueue_backlog(engine, ["Calibrated"])
+
+    def broken(conn, job):
+        product_jobs.make_product(conn, job)
+        raise ValueError("broken")
+
+    worker = product_jobs.Worker(
+        engine, {"Calibrated": broken}, max_attempts=2, poll_interval=0
+    )
+    assert worker.run_once() == 2
+    assert worker.counts["retried"] == 2
+    _make_visible(engine)
+    assert worker.run_once() == 2
+    assert worker.counts == {"done": 0, "retried": 2, "failed": 2, "lost": 0}
+    with engine.connect() as conn:
+        # The failed handler's product was rolled back with it.
+        assert conn.execute(
+            select(func.count()).select_from(
+                product_jobs.levels["Calibrated"].product
+            )
+        ).scalar() == 0
+        assert product_jobs.outstanding(conn) == 0
+        errors = conn.execute(select(product_jobs.jobs.c.error)).scalars()
+        assert set(errors) == {"ValueError('broken')"}
+
+
+def test_follow_needs_postgresql(sqlite_engine):
+    with pytest.raises(NotImplementedError):
+        product_jobs.run_pool(str(sqlite_engine.url), {}, 1, follow=True)
@@ -0,0 +1,51 @@
+# Copyright 2022, United States Government as represented by the
+# Administrator of the National Aeronautics and Space Administration.
+# All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+# Reuse is permitted under the terms of the license.
+# The AUTHORS file and the LICENSE file are at the
+# top level of this library.
+
+from sqlalchemy import text
+
+import query_plans
+
+
+def test_capture_subqueries(engine):
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE plan_test (id INTEGER, x INTEGER)"))
+        conn.execute(
+            text("INSERT INTO plan_test (id, x) VALUES (:id, :x)"),
+            [{"id": i, "x": i % 3} for i in range(20)]
+        )
+
+    statements = [
+        "SELECT * FROM (SELECT id FROM plan_test LIMIT 5) AS sub",
+        "WITH c AS MATERIALIZED (SELECT id FROM plan_test) "
+        "SELECT * FROM c, c AS d",
+        "SELECT 1",
+    ]
+    with query_plans.Capture(engine, run="test", min_rows=0) as capture:
+        with engine.connect() as conn:
+            for statement in statements:
+                conn.execute(text(statement)).all()
+
+    assert [p["statement"] for p in capture.plans] == statements
+    assert [
+        [s["table"] for s in p["seq_scans"]] for p in capture.plans
+    ] == [["plan_test"], ["plan_test"], []]
+    assert len(query_plans.load_run(engine, "test")) == 3
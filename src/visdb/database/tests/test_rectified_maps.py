@@ -0,0 +1,99 @@
+# Copyright 2022, United States Government as represented by the
+# Administrator of the National Aeronautics and Space Administration.
+# All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+# Reuse is permitted under the terms of the license.
+# The AUTHORS file and the LICENSE file are at the
+# top level of this library.
+
+import pickle
+
+from sqlalchemy import LargeBinary, bindparam, inspect, text
+
+import rectified_maps
+import table_rectified_products as rectified
+
+
+def add_legacy_maps(engine):
+    """Gives the map tables their old pickled list column, and two mosaic
+    maps, one of three rectified products and one of none."""
+    column = rectified_maps.legacy_column
+    with engine.begin() as conn:
+        conn.execute(rectified.Rectified_Product.__table__.insert(), [
+            {"rectified_product_id": f"r{i}", "software_version": "1"}
+            for i in range(1, 4)
+        ])
+        prep = conn.dialect.identifier_preparer
+        binary = LargeBinary().compile(dialect=conn.dialect)
+        for map_table, _ in rectified_maps.map_tables.values():
+            conn.exec_driver_sql(
+                f"ALTER TABLE {prep.format_table(map_table)} "
+                f"ADD COLUMN {prep.quote(column)} {binary}"
+            )
+        mosaic = rectified_maps.map_tables["mosaic"][0]
+        conn.execute(
+            text(
+                f"INSERT INTO {prep.format_table(mosaic)} "
+                f"(id, software_version, {prep.quote(column)}) "
+                f"VALUES (:id, '1', :pickled)"
+            ).bindparams(bindparam("pickled", type_=LargeBinary)),
+            [{"id": 1, "pickled": pickle.dumps([3, 1, 3, 2])},
+             {"id": 2, "pickled": None}]
+        )
+
+
+def test_migrate_pickled_maps(product_tables):
+    engine = product_tables
+    add_legacy_maps(engine)
+
+    counts = rectified_maps.migrate_pickled_maps(engine)
+    assert counts == {"mosaic": 3, "hazard": 0, "panorama": 0}
+    for map_table, assoc in rectified_maps.map_tables.values():
+        cols = [c["name"] for c in inspect(engine).get_columns(map_table.name)]
+        assert rectified_maps.legacy_column not in cols
+        assert inspect(engine).get_foreign_keys(assoc.name)
+
+    with engine.connect() as conn:
+        assert rectified_maps.rectified_products_for_map(
+            conn, "mosaic", 1
+        ) == [1, 2, 3]
+        assert rectified_maps.rectified_products_for_map(
+            conn, "mosaic", 2
+        ) == []
+        assert rectified_maps.maps_using_rectified_product(conn, 2) == [
+            ("mosaic", 1)
+        ]
+
+    # The pickled columns are gone, so a second run does nothing.
+    assert rectified_maps.migrate_pickled_maps(engine) == {}
+
+
+def test_migrate_keeping_column(product_tables):
+    engine = product_tables
+    add_legacy_maps(engine)
+
+    assert rectified_maps.migrate_pickled_maps(engine, drop_column=False) == {
+        "mosaic": 3, "hazard": 0, "panorama": 0
+    }
+    # The maps already migrated are skipped.
+    assert rectified_maps.migrate_pickled_maps(engine, drop_column=False) == {
+        "mosaic": 0, "hazard": 0, "panorama": 0
+    }
+    with engine.connect() as conn:
+        assert rectified_maps.rectified_products_for_map(
+            conn, "mosaic", 1
+        ) == [1, 2, 3]
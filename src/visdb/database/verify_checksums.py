@@ -0,0 +1,335 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+""" Verifies the files on disk against the Raw_Products file_checksum.
+
+Rows are read from the database in keyset pages, and the files they
+reference are hashed in a pool of worker processes through memory-mapped
+reads, so an audit of the whole archive runs on every core without
+holding a transaction open for its duration. The outcome for each file
+is kept in the File_Verifications table, and a file that verified
+correctly is not hashed again while its size and modification time stay
+the same (use --full to hash everything).
+
+Mismatched, missing, and unreadable files are printed, one per line, as
+tab-separated status, Raw_Products id, path, expected checksum, and
+actual checksum.
+"""
+
+# Copyright 2022, United States Government as represented by the
+# Administrator of the National Aeronautics and Space Administration.
+# All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+# Reuse is permitted under the terms of the license.
+# The AUTHORS file and the LICENSE file are at the
+# top level of this library.
+
+import argparse
+from collections import Counter, namedtuple
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+import datetime
+import hashlib
+import logging
+import mmap
+import multiprocessing
+from pathlib import Path
+import time
+from sqlalchemy import select
+from sqlalchemy.dialects import postgresql, sqlite
+
+import sys
+import os
+sys.path.insert(1, os.path.join(sys.path[0],'../../../../vipersci/src'))
+from vipersci import util
+
+from bulk_ingest import batched
+from db_utility import new_db
+import table_file_verification as tfv
+import table_raw_products as tb
+
+logger = logging.getLogger(__name__)
+
+raw = tb.Raw_Product.__table__
+state = tfv.File_Verification.__table__
+
+"""PDS4 labels record MD5 checksums."""
+default_algorithm = "md5"
+
+"""Files are hashed in slices of this many bytes of the memory map."""
+chunk_size = 8 * 1024 * 1024
+
+"""Each task sent to a worker process is a group of this many files, so
+that small files are not dominated by inter-process overhead."""
+task_files = 32
+
+"""One file to check: the previous state is None for a file that has
+never been verified."""
+Task = namedtuple(
+    "Task", ["id", "path", "expected", "size", "mtime", "status", "checksum"]
+)
+Result = namedtuple(
+    "Result",
+    ["id", "path", "status", "size", "mtime", "expected", "checksum"]
+)
+
+
+def arg_parser():
+    parser = argparse.ArgumentParser(
+            description=__doc__,
+            formatter_class=argparse.RawDescriptionHelpFormatter,
+            parents=[util.parent_parser()]
+    )
+    parser.add_argument(
+            "-c", "--config",
+            type=Path,
+            required=True,
+            help="Path to database configuration file."
+    )
+    parser.add_argument(
+            "-j", "--jobs",
+            type=int,
+            default=os.cpu_count(),
+            help="Number of worker processes (default: one per core)."
+    )
+    parser.add_argument(
+            "-a", "--algorithm",
+            default=default_algorithm,
+            help="hashlib algorithm of the file_checksum values."
+    )
+    parser.add_argument(
+            "-r", "--root",
+            type=Path,
+            help="Directory that relative pathnames are under."
+    )
+    parser.add_argument(
+            "--full",
+            action='store_true',
+            help="Hash every file, even those unchanged since they last "
+                 "verified."
+    )
+    return parser
+
+
+def product_path(pathname, source_file_name, root=None):
+    """Returns the path of a Raw_Product's file.
+
+    The pathname is the file itself, or the directory holding
+    source_file_name. Relative paths are taken to be under root.
+    """
+    path = Path(pathname)
+    if root is not None and not path.is_absolute():
+        path = root / path
+    if path.is_dir():
+        path = path / source_file_name
+    return path
+
+
+def file_digest(path, algorithm=default_algorithm):
+    """Returns the hex digest of a file, read through a memory map."""
+    h = hashlib.new(algorithm)
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return h.hexdigest()
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            view = memoryview(m)
+            try:
+                for i in range(0, size, chunk_size):
+                    h.update(view[i:i + chunk_size])
+            finally:
+                view.release()
+    return h.hexdigest()
+
+
+def verify_file(task, algorithm=default_algorithm, full=False):
+    """Checks one file against its expected checksum and returns a Result.
+
+    A file whose last verification was 'ok' for the same expected
+    checksum, and whose size and mtime are unchanged, is 'skipped'
+    without being read, unless full is True.
+    """
+    try:
+        st = os.stat(task.path)
+    except FileNotFoundError:
+        return Result(
+            task.id, task.path, "missing", None, None, task.expected, None
+        )
+    except OSError as err:
+        logger.debug(f"{task.path}: {err}")
+        return Result(
+            task.id, task.path, "error", None, None, task.expected, None
+        )
+
+    if (
+        not full and task.status == "ok" and
+        task.size == st.st_size and task.mtime == st.st_mtime and
+        (task.checksum or "").lower() == (task.expected or "").lower()
+    ):
+        return Result(
+            task.id, task.path, "skipped", st.st_size, st.st_mtime,
+            task.expected, task.checksum
+        )
+
+    try:
+        digest = file_digest(task.path, algorithm)
+    except OSError as err:
+        logger.debug(f"{task.path}: {err}")
+        return Result(
+            task.id, task.path, "error", st.st_size, st.st_mtime,
+            task.expected, None
+        )
+
+    status = "ok" if digest == (task.expected or "").lower() else "mismatch"
+    return Result(
+        task.id, task.path, status, st.st_size, st.st_mtime, task.expected,
+        digest
+    )
+
+
+def verify_files(tasks, algorithm=default_algorithm, full=False):
+    """Runs verify_file() on a list of tasks, in a worker process."""
+    return [verify_file(t, algorithm, full) for t in tasks]
+
+
+def stream_tasks(engine, root=None, page_size=5000):
+    """Yields a Task for every Raw_Product, with its last verification.
+
+    Rows are read page_size at a time in id order, each page in its own
+    short transaction, so neither the whole catalog nor a database
+    snapshot is held for the length of the audit.
+    """
+    stmt = select(
+        raw.c.id, raw.c.pathname, raw.c.source_file_name,
+        raw.c.file_checksum,
+        state.c.size, state.c.mtime, state.c.status, state.c.checksum,
+    ).outerjoin(
+        state, state.c.raw_product_table_id == raw.c.id
+    ).order_by(raw.c.id).limit(page_size)
+    last_id = None
+    while True:
+        page = stmt if last_id is None else stmt.where(raw.c.id > last_id)
+        with engine.connect() as conn:
+            rows = conn.execute(page).all()
+        for row in rows:
+            yield Task(
+                row.id,
+                str(product_path(row.pathname, row.source_file_name, root)),
+                row.file_checksum,
+                row.size, row.mtime, row.status, row.checksum,
+            )
+        if len(rows) < page_size:
+            return
+        last_id = rows[-1].id
+
+
+def _state_upsert(conn):
+    if conn.dialect.name == "postgresql":
+        stmt = postgresql.insert(state)
+    elif conn.dialect.name == "sqlite":
+        stmt = sqlite.insert(state)
+    else:
+        raise NotImplementedError(
+            f"Verification state is not supported for {conn.dialect.name}."
+        )
+    return stmt.on_conflict_do_update(
+        index_elements=[state.c.raw_product_table_id],
+        set_={
+            c.name: stmt.excluded[c.name] for c in state.columns
+            if c.name != "raw_product_table_id"
+        }
+    )
+
+
+def save_results(conn, results):
+    """Records verification results, leaving skipped files as they were."""
+    now = datetime.datetime.utcnow()
+    rows = [
+        {
+            "raw_product_table_id": r.id, "path": r.path, "size": r.size,
+            "mtime": r.mtime, "checksum": r.checksum, "status": r.status,
+            "verified_at": now,
+        }
+        for r in results if r.status != "skipped"
+    ]
+    if rows:
+        conn.execute(_state_upsert(conn), rows)
+
+
+def verify_archive(
+    engine, jobs=None, algorithm=default_algorithm, root=None, full=False,
+    report=None
+):
+    """Verifies every Raw_Product's file and returns a Counter of statuses.
+
+    Tasks are handed to jobs worker processes in groups of task_files,
+    with no more than a few groups per worker in flight, so memory use
+    stays flat however large the archive is. Results are saved, and
+    committed, as each group finishes. Every result other than 'ok' and
+    'skipped' is passed to report, if given.
+
+    The workers are started fresh rather than forked, so that they never
+    share the parent's pooled database connections.
+    """
+    jobs = jobs or os.cpu_count()
+    hashlib.new(algorithm)  # Fail early on an unknown algorithm.
+    state.create(bind=engine, checkfirst=True)
+    counts = Counter()
+    start = time.perf_counter()
+
+    def finish(done):
+        for future in done:
+            results = future.result()
+            with engine.begin() as conn:
+                save_results(conn, results)
+            for r in results:
+                counts[r.status] += 1
+                if report is not None and r.status not in ("ok", "skipped"):
+                    report(r)
+
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=jobs, mp_context=context) as pool:
+        pending = set()
+        for group in batched(stream_tasks(engine, root), task_files):
+            if len(pending) >= 4 * jobs:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                finish(done)
+            pending.add(pool.submit(verify_files, group, algorithm, full))
+        finish(pending)
+
+    logger.info(
+        f"Verified {sum(counts.values())} files in "
+        f"{time.perf_counter() - start:.1f} s: {dict(counts)}"
+    )
+    return counts
+
+
+if __name__ == "__main__":
+    args = arg_parser().parse_args()
+    util.set_logger(args.verbose)
+
+    Base, engine, db = new_db(args.config)
+
+    def report(r):
+        print("\t".join(
+            "" if v is None else str(v)
+            for v in (r.status, r.id, r.path, r.expected, r.checksum)
+        ))
+
+    counts = verify_archive(
+        engine, args.jobs, args.algorithm, args.root, args.full, report
+    )
+    print(", ".join(f"{n} {status}" for status, n in sorted(counts.items())))